@@ -0,0 +1,195 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+"""Measure cold, warm and incremental builds of a synthetic q2doc project.
+
+    python benchmarks/bench_build.py --pages 20 --output results.json
+    python benchmarks/bench_build.py --baseline results.json
+
+A cold build starts without any caches, a warm build starts from a fresh
+environment with warm caches, and an incremental build re-reads a single
+edited page. Each reports wall time, the peak RSS of the sphinx-build
+process and the bytes of the files it created or modified.
+"""
+
+import argparse
+import functools
+import http.server
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from synthetic import generate_data, generate_project
+
+
+BUILDS = ('cold', 'warm', 'incremental')
+METRICS = ('wall_time', 'peak_rss', 'bytes_written')
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def serve(root):
+    handler = functools.partial(QuietHandler, directory=root)
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def bytes_written(roots, since):
+    total = 0
+    for root in roots:
+        for dirpath, _, filenames in os.walk(root):
+            for filename in filenames:
+                stat = os.lstat(os.path.join(dirpath, filename))
+                if stat.st_mtime >= since:
+                    total += stat.st_size
+    return total
+
+
+def sphinx_build(srcdir, outdir, jobs, fresh_env):
+    args = [sys.executable, '-m', 'sphinx', '-q', '-b', 'html',
+            '-j', str(jobs), srcdir, outdir]
+    if fresh_env:
+        args.insert(3, '-E')
+
+    since = time.time()
+    start = time.perf_counter()
+    proc = subprocess.Popen(args)
+    _, status, rusage = os.wait4(proc.pid, 0)
+    wall_time = time.perf_counter() - start
+    # os.waitstatus_to_exitcode needs Python 3.9
+    if os.WIFSIGNALED(status):
+        proc.returncode = -os.WTERMSIG(status)
+    else:
+        proc.returncode = os.WEXITSTATUS(status)
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, args)
+
+    return {
+        'wall_time': wall_time,
+        # kilobytes on Linux
+        'peak_rss': rusage.ru_maxrss * 1024,
+        'bytes_written': bytes_written([srcdir, outdir], since),
+    }
+
+
+def run_suite(args, workdir):
+    srcdir = os.path.join(workdir, 'src')
+    outdir = os.path.join(workdir, 'out')
+    datadir = os.path.join(workdir, 'data')
+
+    generate_data(datadir, args.pages, args.downloads, args.output_size)
+    server = serve(datadir)
+    try:
+        docnames = generate_project(
+            srcdir, pages=args.pages, scope_size=args.scope_size,
+            examples=args.examples, commands=args.commands,
+            downloads=args.downloads, action_cost=args.action_cost,
+            output_size=args.output_size,
+            data_url='http://127.0.0.1:%d' % server.server_port)
+
+        results = {}
+        results['cold'] = sphinx_build(srcdir, outdir, args.jobs, True)
+
+        shutil.rmtree(outdir)
+        results['warm'] = sphinx_build(srcdir, outdir, args.jobs, True)
+
+        # edit the last page of the first scope
+        edited = os.path.join(srcdir, docnames[args.scope_size - 1] + '.rst')
+        with open(edited, 'a') as fh:
+            fh.write('\nAn edited paragraph.\n')
+        results['incremental'] = sphinx_build(srcdir, outdir, args.jobs,
+                                              False)
+    finally:
+        server.shutdown()
+        server.server_close()
+    return results
+
+
+def compare(results, baseline):
+    """Lines comparing each build metric with the baseline's."""
+    lines = ['%-12s %-14s %14s %14s %8s'
+             % ('build', 'metric', 'baseline', 'current', 'change')]
+    for build in BUILDS:
+        for metric in METRICS:
+            old = baseline['results'].get(build, {}).get(metric)
+            new = results[build][metric]
+            if not old:
+                continue
+            lines.append('%-12s %-14s %14.3f %14.3f %+7.1f%%'
+                         % (build, metric, old, new,
+                            100 * (new - old) / old))
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--pages', type=int, default=20)
+    parser.add_argument('--scope-size', type=int, default=4)
+    parser.add_argument('--examples', type=int, default=3)
+    parser.add_argument('--commands', type=int, default=2)
+    parser.add_argument('--downloads', type=int, default=1)
+    parser.add_argument('--action-cost', type=float, default=0.05,
+                        help='seconds per action and command')
+    parser.add_argument('--output-size', type=int, default=100000,
+                        help='bytes per action output, command output and '
+                             'download')
+    parser.add_argument('--jobs', type=int, default=1)
+    parser.add_argument('--workdir',
+                        help='keep the project here, instead of a temporary '
+                             'directory')
+    parser.add_argument('--output', help='write the results to this file')
+    parser.add_argument('--baseline',
+                        help='compare against the results in this file')
+    args = parser.parse_args()
+
+    if args.workdir:
+        shutil.rmtree(args.workdir, ignore_errors=True)
+        results = run_suite(args, args.workdir)
+    else:
+        with tempfile.TemporaryDirectory(prefix='q2doc-bench-') as workdir:
+            results = run_suite(args, workdir)
+
+    report = {
+        'parameters': {k: v for k, v in vars(args).items()
+                       if k not in ('workdir', 'output', 'baseline')},
+        'platform': {'python': platform.python_version(),
+                     'machine': platform.machine(),
+                     'cpus': os.cpu_count()},
+        'results': results,
+    }
+
+    for build in BUILDS:
+        print('%-12s %7.2fs  %7.1f MiB RSS  %9.1f MiB written'
+              % (build, results[build]['wall_time'],
+                 results[build]['peak_rss'] / 1024 ** 2,
+                 results[build]['bytes_written'] / 1024 ** 2))
+
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(report, fh, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)
+        if baseline['parameters'] != report['parameters']:
+            print('warning: the baseline was run with different parameters')
+        print('\n'.join(compare(results, baseline)))
+
+
+if __name__ == '__main__':
+    main()
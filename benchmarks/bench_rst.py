@@ -0,0 +1,79 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+"""Compare parsing the Galaxy instructions of a page of usage examples with
+a fresh docutils publisher per example against the cached parser.
+
+    python benchmarks/bench_rst.py --examples 200
+"""
+
+import argparse
+import time
+
+import docutils.core
+
+from q2doc.rst import parse_rst
+
+
+# shaped like the output of q2galaxy's GalaxyRSTInstructionsUsage
+EXAMPLE = '''\
+Using the ``qiime2 dada2 denoise-single`` tool:
+ #. Set *"demultiplexed_seqs"* to ``#: demux-{i}.qza``
+ #. Expand the ``additional options`` section
+
+    #. Set *"trunc_len"* to ``{i}``
+    #. Set *"n_threads"* to ``1``
+ #. Press the ``Execute`` button.
+
+Once completed, for each new entry in your history, use the ``Edit`` button
+to set the name as follows (renaming is optional, but it will make any
+subsequent steps easier):
+
+ .. list-table::
+    :align: left
+    :header-rows: 1
+
+    * - History Name
+      - *"Name"* to set (be sure to press ``Save``)
+    * - ``#: qiime2 dada2 denoise-single [...] : table.qza``
+      - ``table-{i}.qza``
+    * - ``#: qiime2 dada2 denoise-single [...] : representative_sequences.qza``
+      - ``rep-seqs-{i}.qza``
+'''
+
+
+def bench(parse, examples, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for example in examples:
+            parse(example)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--examples', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    examples = [EXAMPLE.format(i=i) for i in range(args.examples)]
+    # warm up the caches (and docutils' own imports) before timing
+    parse_rst(examples[0])
+    docutils.core.publish_doctree(examples[0])
+
+    baseline = bench(docutils.core.publish_doctree, examples, args.repeat)
+    cached = bench(parse_rst, examples, args.repeat)
+    print('%d examples, best of %d' % (args.examples, args.repeat))
+    print('  publish_doctree: %.3fs' % baseline)
+    print('  parse_rst:       %.3fs (%.2fx)' % (cached, baseline / cached))
+
+
+if __name__ == '__main__':
+    main()
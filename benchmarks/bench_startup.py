@@ -0,0 +1,80 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+"""Time a fresh sphinx-build of a small project that loads the q2doc
+extensions but uses no usage directives.
+
+    python benchmarks/bench_startup.py --repeat 5
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+
+EXTENSIONS = [
+    'q2doc.usage',
+    'q2doc.command_block',
+    'q2doc.external_links',
+    'q2doc.linkcode',
+]
+
+INDEX = '''\
+Startup
+=======
+
+A page without any usage examples.
+
+.. command-block::
+   :no-exec:
+
+   qiime --help
+'''
+
+
+def build_once(srcdir, outdir):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-m', 'sphinx', '-E', '-q', '-b', 'html',
+                    srcdir, outdir], check=True)
+    return time.perf_counter() - start
+
+
+def import_time(module):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'import %s' % module], check=True)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='q2doc-bench-') as tmp:
+        srcdir = os.path.join(tmp, 'src')
+        os.mkdir(srcdir)
+        with open(os.path.join(srcdir, 'conf.py'), 'w') as fh:
+            fh.write('extensions = %r\n' % EXTENSIONS)
+        with open(os.path.join(srcdir, 'index.rst'), 'w') as fh:
+            fh.write(INDEX)
+
+        builds = [build_once(srcdir, os.path.join(tmp, 'out'))
+                  for _ in range(args.repeat)]
+
+    print('sphinx-build (best of %d): %.2fs' % (args.repeat, min(builds)))
+    baseline = import_time('sphinx')
+    for module in EXTENSIONS:
+        print('  import %-22s %.2fs' % (module,
+                                        import_time(module) - baseline))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+"""Generator for the synthetic Sphinx project used by bench_build.py."""
+
+import os
+import textwrap
+
+
+# a QIIME 2 plugin whose actions take `cost` seconds and write `size` bytes
+PLUGIN = '''\
+import random
+import time
+
+import qiime2.plugin
+from qiime2.plugin import Float, Int, SemanticType, model
+
+
+BenchData = SemanticType('BenchData')
+
+
+class BenchFormat(model.BinaryFileFormat):
+    def _validate_(self, level):
+        pass
+
+
+BenchDirFmt = model.SingleFileDirectoryFormat('BenchDirFmt', 'data.bin',
+                                              BenchFormat)
+
+
+def _write(size, seed):
+    result = BenchDirFmt()
+    with open(result.path / 'data.bin', 'wb') as fh:
+        # random.Random.randbytes needs Python 3.9, where getrandbits(0)
+        # stopped failing too
+        if size:
+            fh.write(random.Random(seed).getrandbits(8 * size).to_bytes(
+                size, 'little'))
+    return result
+
+
+def make_data(size: int, cost: float, seed: int) -> BenchDirFmt:
+    time.sleep(cost)
+    return _write(size, seed)
+
+
+def transform_data(data: BenchDirFmt, size: int, cost: float,
+                   seed: int) -> BenchDirFmt:
+    time.sleep(cost)
+    with open(data.path / 'data.bin', 'rb') as fh:
+        seed += sum(fh.read(64))
+    return _write(size, seed)
+
+
+plugin = qiime2.plugin.Plugin(
+    name='bench',
+    version='0.0.1',
+    website='https://qiime2.org',
+    package='bench_plugin',
+    description='Synthetic actions for benchmarking q2doc.',
+    short_description='Synthetic actions for benchmarking q2doc.',
+)
+plugin.register_formats(BenchFormat, BenchDirFmt)
+plugin.register_semantic_types(BenchData)
+plugin.register_semantic_type_to_format(BenchData, artifact_format=BenchDirFmt)
+
+plugin.methods.register_function(
+    function=make_data,
+    inputs={},
+    parameters={'size': Int, 'cost': Float, 'seed': Int},
+    outputs=[('data', BenchData)],
+    name='Make data',
+    description='Make `size` bytes of data, taking `cost` seconds.',
+)
+plugin.methods.register_function(
+    function=transform_data,
+    inputs={'data': BenchData},
+    parameters={'size': Int, 'cost': Float, 'seed': Int},
+    outputs=[('data', BenchData)],
+    name='Transform data',
+    description='Derive `size` bytes of data, taking `cost` seconds.',
+)
+'''
+
+CONF = '''\
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath('.'))
+
+from qiime2.sdk import PluginManager  # noqa: E402
+
+import bench_plugin  # noqa: E402
+
+# only the synthetic plugin is loaded, it does not need to be installed
+PluginManager(add_plugins=False).add_plugin(
+    bench_plugin.plugin, package='bench_plugin', project_name='bench-plugin')
+
+extensions = ['q2doc.usage', 'q2doc.command_block']
+master_doc = 'index'
+exclude_patterns = ['_cache']
+command_block_cache_dir = '_cache/commands'
+command_block_download_cache_dir = '_cache/downloads'
+usage_result_cache_dir = '_cache/results'
+'''
+
+MAKE_DATA = '''\
+.. usage::
+
+   {var}, = use.action(
+       use.UsageAction(plugin_id='bench', action_id='make_data'),
+       use.UsageInputs(size={size}, cost={cost}, seed={seed}),
+       use.UsageOutputNames(data='{name}'))
+'''
+
+TRANSFORM_DATA = '''\
+.. usage::
+
+   {var}, = use.action(
+       use.UsageAction(plugin_id='bench', action_id='transform_data'),
+       use.UsageInputs(data={previous}, size={size}, cost={cost},
+                       seed={seed}),
+       use.UsageOutputNames(data='{name}'))
+'''
+
+COMMAND_BLOCK = '''\
+.. command-block::
+
+   sleep {cost}
+   head -c {size} /dev/zero > output-{name}.qza
+'''
+
+DOWNLOAD = '''\
+.. download::
+   :url: {url}/blob-{index}.bin
+   :saveas: blob-{index}.bin
+'''
+
+
+def page_source(page, scope, first_in_scope, examples, commands, downloads,
+                action_cost, output_size, data_url):
+    title = 'Page %d' % page
+    parts = ['%s\n%s\n' % (title, '=' * len(title)),
+             '.. usage-scope::\n   :name: scope-%d\n' % scope,
+             '.. usage-selector::\n']
+
+    for example in range(examples):
+        var = 'data_%d_%d' % (page, example)
+        fields = dict(var=var, name=var.replace('_', '-'), size=output_size,
+                      cost=action_cost, seed=page * 1000 + example)
+        if example == 0 and first_in_scope:
+            parts.append(MAKE_DATA.format(**fields))
+        else:
+            # examples build on the previous one, across the scope's pages
+            previous = ('data_%d_%d' % (page, example - 1) if example
+                        else 'data_%d_%d' % (page - 1, examples - 1))
+            parts.append(TRANSFORM_DATA.format(previous=previous, **fields))
+
+    for command in range(commands):
+        parts.append(COMMAND_BLOCK.format(cost=action_cost, size=output_size,
+                                          name='%d-%d' % (page, command)))
+    for download in range(downloads):
+        parts.append(DOWNLOAD.format(url=data_url,
+                                     index=page * downloads + download))
+    return '\n'.join(parts)
+
+
+def generate_project(root, pages=20, scope_size=4, examples=3, commands=2,
+                     downloads=1, action_cost=0.05, output_size=100000,
+                     data_url='http://127.0.0.1:8000'):
+    """Write the synthetic project to `root`, returning its page names."""
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, 'bench_plugin.py'), 'w') as fh:
+        fh.write(PLUGIN)
+    with open(os.path.join(root, 'conf.py'), 'w') as fh:
+        fh.write(CONF)
+
+    docnames = ['page-%03d' % page for page in range(pages)]
+    for page, docname in enumerate(docnames):
+        source = page_source(page, scope=page // scope_size,
+                             first_in_scope=page % scope_size == 0,
+                             examples=examples, commands=commands,
+                             downloads=downloads, action_cost=action_cost,
+                             output_size=output_size, data_url=data_url)
+        with open(os.path.join(root, docname + '.rst'), 'w') as fh:
+            fh.write(source)
+
+    with open(os.path.join(root, 'index.rst'), 'w') as fh:
+        fh.write(textwrap.dedent('''\
+            Benchmark
+            =========
+
+            .. toctree::
+
+            '''))
+        fh.writelines('   %s\n' % docname for docname in docnames)
+    return docnames
+
+
+def generate_data(root, pages, downloads, size):
+    """Write the files served to the project's download directives."""
+    os.makedirs(root, exist_ok=True)
+    for index in range(pages * downloads):
+        with open(os.path.join(root, 'blob-%d.bin' % index), 'wb') as fh:
+            fh.write(bytes([index % 256]) * size)
@@ -0,0 +1,107 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import gzip
+import hashlib
+import os
+import pathlib
+import tempfile
+
+import pkg_resources
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+ASSET_SUFFIXES = ('.js', '.css')
+
+
+def add_assets(app, package):
+    """Register the ``assets`` directory of a q2doc sub-package."""
+    base_fp = pkg_resources.resource_filename('q2doc', package)
+    asset_path = pathlib.Path(base_fp) / 'assets'
+    for path in sorted(asset_path.iterdir()):
+        if path.suffix in ASSET_SUFFIXES and path not in app.q2doc_assets:
+            app.q2doc_assets.append(path)
+
+
+def minify(text):
+    """Strip indentation, blank lines and whole-line ``//`` comments.
+
+    This is deliberately conservative (it does not tokenize), so it must not
+    be used on assets with multi-line string literals.
+    """
+    lines = (line.strip() for line in text.splitlines())
+    return '\n'.join(line for line in lines
+                     if line and not line.startswith('//')) + '\n'
+
+
+def _write(path, content):
+    fd, tmp_path = tempfile.mkstemp(prefix='.tmp-',
+                                    dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as fh:
+        fh.write(content)
+    os.replace(tmp_path, path)
+
+
+def install_asset(path, static_dir, minified=False, compressed=False):
+    """Write `path` into `static_dir` under a content-fingerprinted name.
+
+    Returns the new filename. Nothing is written when that file already
+    exists, as its name pins its content.
+    """
+    path = pathlib.Path(path)
+    content = path.read_bytes()
+    if minified:
+        content = minify(content.decode('utf-8')).encode('utf-8')
+
+    fingerprint = hashlib.sha256(content).hexdigest()[:12]
+    name = '%s.%s%s' % (path.stem, fingerprint, path.suffix)
+    dest = os.path.join(static_dir, name)
+
+    variants = [(dest, lambda: content)]
+    if compressed:
+        variants.append((dest + '.gz',
+                         lambda: gzip.compress(content, mtime=0)))
+        if brotli is not None:
+            variants.append((dest + '.br', lambda: brotli.compress(content)))
+    for variant, encode in variants:
+        if not os.path.exists(variant):
+            _write(variant, encode())
+    return name
+
+
+def install_assets(app):
+    if app.builder.format != 'html':
+        return
+
+    static_dir = os.path.join(app.outdir, '_static')
+    os.makedirs(static_dir, exist_ok=True)
+    for path in app.q2doc_assets:
+        name = install_asset(path, static_dir,
+                             minified=app.config.q2doc_assets_minify,
+                             compressed=app.config.q2doc_assets_compress)
+        if path.suffix == '.js':
+            app.add_js_file(name)
+        else:
+            app.add_css_file(name)
+
+
+def setup(app):
+    app.q2doc_assets = []
+    app.connect('builder-inited', install_assets)
+    app.add_config_value('q2doc_assets_minify', False, 'html')
+    app.add_config_value('q2doc_assets_compress', False, 'html')
+
+    return {
+        'version': '0.0.1',
+        'parallel_read_safe': True,
+        'parallel_write_safe': True,
+    }
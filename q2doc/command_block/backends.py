@@ -0,0 +1,367 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import multiprocessing
+import os
+import re
+import shlex
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import traceback
+import uuid
+
+from .executor import (CompletedCommand, KILL_GRACE, SPOOL_SIZE,
+                       run_streaming)
+
+
+# commands which only change the state of the shell they run in
+STATEFUL = re.compile(r'^\s*((export|unset|source|alias|set|\.)(\s|$)|'
+                      r'[A-Za-z_][A-Za-z0-9_]*=\S*\s*$)')
+# commands which may read the state of the shell they run in, i.e. expand
+# its variables
+READS_STATE = re.compile(r'[$`]')
+# anything that needs a shell to be interpreted
+SHELL_SYNTAX = re.compile(r'[|&;<>$`*?(){}\[\]~\\!#\n]')
+# q2cli commands which must not run inside the long-lived worker
+Q2CLI_EXCLUDED = ('dev',)
+
+
+def _spools():
+    return [tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE, mode='w+',
+                                          encoding='utf-8')
+            for _ in range(2)]
+
+
+class SubprocessBackend:
+    """Runs every command in a new shell."""
+    # commands share no state, so they may run at the same time
+    concurrent = True
+
+    def run(self, command, cwd, timeout=None, log=None):
+        return run_streaming(command, cwd, timeout, log=log)
+
+    @classmethod
+    def changes_state(cls, command):
+        return False
+
+    @classmethod
+    def cacheable(cls, command):
+        return True
+
+    def close(self):
+        pass
+
+
+def _pump_until(pipe, spool, log, token, status):
+    """Copy lines of `pipe` to `spool` up to the line carrying `token`,
+    which is followed by the command's exit status on stdout."""
+    for line in pipe:
+        index = line.find(token)
+        if index == -1:
+            spool.write(line)
+            if log is not None:
+                log(line.rstrip('\n'))
+            continue
+        # output that does not end with a newline precedes the token
+        if index:
+            spool.write(line[:index])
+            if log is not None:
+                log(line[:index])
+        fields = line[index + len(token):].split()
+        if fields:
+            status.append(int(fields[0]))
+        return
+
+
+class ShellBackend:
+    """Runs commands in one long-lived shell, so that the fixed cost of
+    starting a shell is paid once and its state (e.g. exported variables)
+    carries over from one command to the next.
+
+    The end of each command is marked by a unique token on both output
+    streams. When a command times out the shell's process group is killed
+    and a new shell is started for the next command.
+    """
+    # concurrently run commands would each need a shell of their own,
+    # without the state set by the commands before them
+    concurrent = False
+
+    def __init__(self):
+        self._proc = None
+        self._token = '__q2doc_%s__' % uuid.uuid4().hex
+
+    def _start(self):
+        self._proc = subprocess.Popen(
+            ['bash', '--noprofile', '--norc'], stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding='utf-8',
+            errors='replace', start_new_session=True)
+
+    def _kill(self):
+        try:
+            os.killpg(self._proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        self._proc.wait()
+        self._proc = None
+
+    def run(self, command, cwd, timeout=None, log=None):
+        if self._proc is None or self._proc.poll() is not None:
+            self._start()
+        proc = self._proc
+
+        spools = _spools()
+        status = []
+        pumps = [
+            threading.Thread(target=_pump_until,
+                             args=(pipe, spool, log, self._token, found),
+                             daemon=True)
+            for pipe, spool, found in zip((proc.stdout, proc.stderr), spools,
+                                          (status, []))]
+        for pump in pumps:
+            pump.start()
+
+        # commands must not read the rest of the script from the shell's
+        # stdin, and a failed `cd` must not run the command elsewhere
+        script = ('cd %s && {\n%s\n} < /dev/null\n'
+                  'printf "%s %%d\\n" $?\nprintf "%s\\n" >&2\n'
+                  % (shlex.quote(cwd), command, self._token, self._token))
+        try:
+            proc.stdin.write(script)
+            proc.stdin.flush()
+        except BrokenPipeError:
+            pass
+
+        timed_out = False
+        try:
+            pumps[0].join(timeout)
+        except BaseException:
+            self._kill()
+            raise
+        if pumps[0].is_alive():
+            timed_out = True
+            self._kill()
+        for pump in pumps:
+            pump.join(KILL_GRACE if timed_out else None)
+
+        if status:
+            returncode = status[0]
+        else:
+            # the shell exited (or was killed) before finishing the command
+            returncode = proc.wait()
+            self._proc = None
+
+        return CompletedCommand(command, returncode, *spools,
+                                timed_out=timed_out)
+
+    @classmethod
+    def changes_state(cls, command):
+        return STATEFUL.match(command) is not None
+
+    @classmethod
+    def cacheable(cls, command):
+        """Whether the result of `command` only depends on its files: the
+        shell's state is not part of the execution cache's keys."""
+        return not (cls.changes_state(command)
+                    or READS_STATE.search(command))
+
+    def close(self):
+        if self._proc is not None:
+            self._proc.stdin.close()
+            try:
+                self._proc.wait(KILL_GRACE)
+            except subprocess.TimeoutExpired:
+                self._kill()
+            self._proc = None
+
+
+def q2cli_args(command):
+    """The arguments of a plain `qiime ...` invocation, or None when the
+    command needs a shell (or must not run in the worker)."""
+    if SHELL_SYNTAX.search(command):
+        return None
+    try:
+        argv = shlex.split(command)
+    except ValueError:
+        return None
+    if len(argv) < 2 or argv[0] != 'qiime' or argv[1] in Q2CLI_EXCLUDED:
+        return None
+    return argv[1:]
+
+
+def _invoke(cli, args, cwd, stdout_path, stderr_path):
+    saved = [os.dup(1), os.dup(2)]
+    with open(stdout_path, 'w') as out, open(stderr_path, 'w') as err:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        # redirect the file descriptors, so that the output of any
+        # subprocesses is captured as well
+        os.dup2(out.fileno(), 1)
+        os.dup2(err.fileno(), 2)
+        try:
+            os.chdir(cwd)
+            cli.main(args=args, prog_name='qiime', standalone_mode=True)
+            returncode = 0
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                returncode = e.code or 0
+            else:
+                print(e.code, file=sys.stderr)
+                returncode = 1
+        except BaseException:
+            traceback.print_exc()
+            returncode = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(saved[0], 1)
+            os.dup2(saved[1], 2)
+            for fd in saved:
+                os.close(fd)
+    return returncode
+
+
+def _serve(conn):
+    import click
+    from q2cli.__main__ import qiime as cli
+
+    # listing the commands loads the plugins, which is most of the fixed
+    # cost of a `qiime` invocation
+    cli.list_commands(click.Context(cli))
+    environ = dict(os.environ)
+    conn.send(None)
+
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            break
+        if request is None:
+            # a new document starts from the build's environment
+            os.environ.clear()
+            os.environ.update(environ)
+            continue
+        conn.send(_invoke(cli, *request))
+
+
+class Q2CLIWorker:
+    """A process which has loaded q2cli and the plugins, to run plain
+    `qiime ...` invocations in.
+
+    It is loaded in the background from :meth:`start` on, and started again
+    when it was stopped (e.g. by a timeout). A process forked from the one
+    which started it (e.g. a parallel reader) starts a worker of its own.
+    """
+    def __init__(self):
+        self._process = None
+        self._conn = None
+        self._pid = None
+        self._ready = False
+
+    def start(self):
+        # spawned, as forking a process running threads is unsafe
+        context = multiprocessing.get_context('spawn')
+        self._conn, child_conn = context.Pipe()
+        self._process = context.Process(target=_serve, args=(child_conn,),
+                                        daemon=True)
+        self._process.start()
+        child_conn.close()
+        self._pid = os.getpid()
+        self._ready = False
+
+    def _running(self):
+        # the process and pipe of another process' worker are not ours
+        return (self._process is not None and self._pid == os.getpid()
+                and self._process.is_alive())
+
+    def run(self, args, cwd, stdout_path, stderr_path, timeout=None):
+        """Run q2cli with `args`, returning its exit status and whether it
+        timed out."""
+        if not self._running():
+            self.start()
+        if not self._ready:
+            self._conn.recv()
+            self._ready = True
+
+        self._conn.send((args, cwd, stdout_path, stderr_path))
+        try:
+            finished = self._conn.poll(timeout)
+        except BaseException:
+            self.stop()
+            raise
+        if not finished:
+            self.stop()
+            return -signal.SIGKILL, True
+        try:
+            return self._conn.recv(), False
+        except EOFError:
+            self.stop()
+            return -signal.SIGKILL, False
+
+    def reset(self):
+        """Restore the build's environment variables."""
+        if self._running() and self._ready:
+            self._conn.send(None)
+
+    def stop(self):
+        if self._process is not None and self._pid == os.getpid():
+            self._conn.close()
+            self._process.kill()
+            self._process.join()
+        self._process = self._conn = self._pid = None
+        self._ready = False
+
+
+class Q2CLIBackend(ShellBackend):
+    """A `ShellBackend` which runs plain `qiime ...` invocations inside a
+    worker process that has already loaded q2cli and the plugins.
+
+    The worker is shared when one is given, e.g. by the documents of a
+    build, and is only reset when the backend is closed. The worker only
+    sees the build's environment variables, not those exported in the
+    shell.
+    """
+    def __init__(self, worker=None):
+        super().__init__()
+        self._shared = worker is not None
+        self._worker = worker if worker is not None else Q2CLIWorker()
+
+    def run(self, command, cwd, timeout=None, log=None):
+        args = q2cli_args(command)
+        if args is None:
+            return super().run(command, cwd, timeout, log)
+
+        files = [tempfile.NamedTemporaryFile(mode='w+', encoding='utf-8',
+                                             errors='replace')
+                 for _ in range(2)]
+        returncode, timed_out = self._worker.run(
+            args, cwd, files[0].name, files[1].name, timeout)
+
+        result = CompletedCommand(command, returncode, *files,
+                                  timed_out=timed_out)
+        if log is not None:
+            for stream_type in ('stdout', 'stderr'):
+                for line in result.open(stream_type):
+                    log(line.rstrip('\n'))
+        return result
+
+    def close(self):
+        super().close()
+        if self._shared:
+            self._worker.reset()
+        else:
+            self._worker.stop()
+
+
+BACKENDS = {
+    'subprocess': SubprocessBackend,
+    'shell': ShellBackend,
+    'q2cli': Q2CLIBackend,
+}
@@ -0,0 +1,192 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import collections
+import hashlib
+import json
+import os
+import shlex
+import shutil
+import tempfile
+
+from q2doc.util import hash_path
+from .dag import file_accesses
+from .executor import CompletedCommand, SPOOL_SIZE, open_output
+
+
+CacheEntry = collections.namedtuple('CacheEntry', ['path', 'manifest'])
+
+
+def normalize_command(command):
+    return ' '.join(command.split())
+
+
+def format_stats(stats):
+    hits = sum(s['hits'] for s in stats)
+    misses = sum(s['misses'] for s in stats)
+    restored = sum(s.get('restored', 0) for s in stats)
+    time_saved = sum(s['time_saved'] for s in stats)
+    return ('command-block cache: %d hits, %d misses, %d pre-executed, '
+            '%.1fs saved' % (hits, misses, restored, time_saved))
+
+
+# the layout of cache entries, part of their keys so that entries of older
+# layouts are not restored
+FORMAT = 2
+# stands in for the working dir in cached output, which differs per build
+ROOT_PLACEHOLDER = '\x00q2doc-root\x00'
+
+
+def _copy_stream(src, dst, old, new):
+    # line by line, as output may be too large to be held in memory; paths
+    # do not span lines
+    for line in src:
+        dst.write(line.replace(old, new))
+
+
+def _input_paths(command, cwd, root):
+    try:
+        tokens = shlex.split(command)
+    except ValueError:
+        tokens = command.split()
+
+    paths = set()
+    for token in tokens:
+        if token.startswith('-') and '=' in token:
+            token = token.split('=', 1)[1]
+        candidate = os.path.normpath(os.path.join(cwd, token))
+        if os.path.commonpath([candidate, root]) != root:
+            continue
+        if os.path.exists(candidate):
+            paths.add(candidate)
+    return sorted(paths)
+
+
+class ExecutionCache:
+    """Content-addressed store of command-block command results.
+
+    Entries are keyed on the normalized command, its working directory
+    (relative to the document's working dir), the hashes of any files in
+    the document's working dir that the command refers to, the listing of
+    its working directory for commands other than plain `qiime` ones, and
+    the installed QIIME 2 and plugin versions. Each entry holds the
+    captured streams along with every file and directory the command
+    created or modified and the paths it removed, so that restoring it
+    replays the command's effect on the working dir. The working dir's
+    path is replaced in the streams, as it differs between builds.
+    """
+    def __init__(self, root, versions):
+        self.root = os.path.abspath(root)
+        self.versions = versions
+        os.makedirs(self.root, exist_ok=True)
+
+    def key(self, command, cwd, root):
+        inputs = {os.path.relpath(path, root): hash_path(path)
+                  for path in _input_paths(command, cwd, root)}
+        listing = None
+        if file_accesses(command, cwd) is None:
+            # commands like `ls` may depend on what is in the working dir
+            try:
+                listing = sorted(os.listdir(cwd))
+            except OSError:
+                pass
+        payload = {
+            'format': FORMAT,
+            'command': normalize_command(command),
+            'cwd': os.path.relpath(cwd, root),
+            'listing': listing,
+            'inputs': inputs,
+            'versions': self.versions,
+        }
+        payload = json.dumps(payload, sort_keys=True).encode('utf-8')
+        return hashlib.sha256(payload).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def get(self, key):
+        path = self._entry_path(key)
+        try:
+            with open(os.path.join(path, 'manifest.json')) as fh:
+                manifest = json.load(fh)
+        except (OSError, ValueError):
+            return None
+
+        return CacheEntry(path=path, manifest=manifest)
+
+    def restore(self, entry, root):
+        manifest = entry.manifest
+        for relpath in manifest['removed']:
+            path = os.path.join(root, relpath)
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            elif os.path.lexists(path):
+                os.remove(path)
+        for relpath in manifest['directories']:
+            os.makedirs(os.path.join(root, relpath), exist_ok=True)
+        for relpath in manifest['outputs']:
+            dest = os.path.join(root, relpath)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            shutil.copyfile(os.path.join(entry.path, 'files', relpath), dest)
+
+        spools = []
+        for stream_type in ('stdout', 'stderr'):
+            spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE,
+                                                  mode='w+', encoding='utf-8')
+            with open(os.path.join(entry.path, stream_type),
+                      encoding='utf-8') as fh:
+                _copy_stream(fh, spool, ROOT_PLACEHOLDER, root)
+            spools.append(spool)
+        return CompletedCommand(manifest['command'], manifest['returncode'],
+                                *spools)
+
+    def put(self, key, comp_proc, root, changes, duration, owns=None):
+        """Store the command's `changes` below `root`: the files written,
+        directories created and paths removed (see `FileIndex.since`), only
+        keeping those for which `owns` is true when it is given."""
+        path = self._entry_path(key)
+        if os.path.exists(path):
+            return
+
+        outputs, directories, removed = changes
+        if owns is not None:
+            outputs = [relpath for relpath in outputs if owns(relpath)]
+            directories = [relpath for relpath in directories
+                           if owns(relpath)]
+            removed = [relpath for relpath in removed if owns(relpath)]
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = tempfile.mkdtemp(prefix='.tmp-', dir=self.root)
+        try:
+            for relpath in outputs:
+                dest = os.path.join(tmp_path, 'files', relpath)
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                shutil.copyfile(os.path.join(root, relpath), dest)
+
+            for stream_type in ('stdout', 'stderr'):
+                with open(os.path.join(tmp_path, stream_type), 'w',
+                          encoding='utf-8') as fh:
+                    _copy_stream(open_output(comp_proc, stream_type), fh,
+                                 root, ROOT_PLACEHOLDER)
+
+            manifest = {
+                'command': comp_proc.args,
+                'returncode': comp_proc.returncode,
+                'outputs': outputs,
+                'directories': directories,
+                'removed': removed,
+                'duration': duration,
+            }
+            with open(os.path.join(tmp_path, 'manifest.json'), 'w') as fh:
+                json.dump(manifest, fh)
+
+            os.rename(tmp_path, path)
+        except OSError:
+            # caching is best-effort, e.g. another process may have stored
+            # this entry first
+            shutil.rmtree(tmp_path, ignore_errors=True)
@@ -0,0 +1,160 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import concurrent.futures
+import contextvars
+import os
+import shlex
+
+from .backends import SHELL_SYNTAX
+
+
+# options of q2cli commands which name files (or directories) they read or
+# write, besides the --i-*, --m-* and --o-* options of actions
+READ_OPTIONS = ('--input-path',)
+WRITE_OPTIONS = ('--output-dir', '--output-path', '--output-file')
+# q2cli adds these to output paths without an extension
+ARTIFACT_EXTENSIONS = ('.qza', '.qzv')
+
+
+def _path_key(cwd, path):
+    path = os.path.normpath(os.path.join(cwd, path))
+    root, ext = os.path.splitext(path)
+    return root if ext in ARTIFACT_EXTENSIONS else path
+
+
+def file_accesses(command, cwd):
+    """The paths a `qiime` command reads and writes, as `(reads, writes)`.
+
+    Files are found from the --i-*, --m-* and --o-* options, the options
+    naming files of the tools commands, and any other arguments, which are
+    assumed to be read. None is returned when the accesses of the command
+    cannot be inferred, i.e. for anything but a plain `qiime` invocation
+    and for options other than these and the --p-* parameters, which may
+    name files too.
+    """
+    if SHELL_SYNTAX.search(command):
+        return None
+    try:
+        tokens = shlex.split(command)
+    except ValueError:
+        return None
+    if len(tokens) < 2 or tokens[0] != 'qiime' or tokens[1] == 'dev':
+        return None
+
+    reads, writes = set(), set()
+    tokens = iter(tokens[1:])
+    for token in tokens:
+        if not token.startswith('--'):
+            reads.add(_path_key(cwd, token))
+            continue
+
+        option, has_value, value = token.partition('=')
+        if option.startswith('--o-') or option in WRITE_OPTIONS:
+            target = writes
+        elif option.startswith(('--i-', '--m-')) or option in READ_OPTIONS:
+            target = reads
+        elif option.startswith('--p-'):
+            continue
+        else:
+            return None
+        if not has_value:
+            value = next(tokens, None)
+        if value is not None:
+            target.add(_path_key(cwd, value))
+    return reads, writes
+
+
+def _overlaps(paths, others):
+    for path in paths:
+        for other in others:
+            if (path == other or path.startswith(other + os.sep)
+                    or other.startswith(path + os.sep)):
+                return True
+    return False
+
+
+class Job:
+    """A command of a command block, with the jobs it has to wait for."""
+    def __init__(self, index, command, cwd, threads=1):
+        self.index = index
+        self.command = command
+        self.cwd = cwd
+        self.threads = threads
+        self.accesses = file_accesses(command, cwd)
+        self.depends = set()
+
+    def depends_on(self, other):
+        # commands of unknown accesses run after and before everything
+        if self.accesses is None or other.accesses is None:
+            return True
+        reads, writes = self.accesses
+        other_reads, other_writes = other.accesses
+        return (_overlaps(other_writes, reads | writes)
+                or _overlaps(writes, other_reads))
+
+    def owns(self, path):
+        """Whether `path` is one of the outputs of the command."""
+        if self.accesses is None:
+            return True
+        return _overlaps([_path_key(self.cwd, path)], self.accesses[1])
+
+
+def plan(jobs):
+    """Record on each job the earlier jobs it depends on."""
+    for index, job in enumerate(jobs):
+        job.depends = {other for other in jobs[:index]
+                       if job.depends_on(other)}
+    return jobs
+
+
+def run_jobs(jobs, max_threads, run):
+    """Call `run` on each job once its dependencies finished, running
+    independent jobs concurrently within `max_threads` threads, and return
+    the results in the order of `jobs`.
+
+    A job is started as soon as it fits in the remaining threads, so jobs
+    needing fewer threads may overtake it. Once a job raises no further
+    jobs are started, and the exception of the earliest failed job is
+    raised after the running ones finish.
+    """
+    if max_threads <= 1:
+        return [run(job) for job in jobs]
+
+    results = {}
+    errors = {}
+    pending = list(jobs)
+    running = {}
+    used = 0
+    with concurrent.futures.ThreadPoolExecutor(max_threads) as executor:
+        while running or (pending and not errors):
+            for job in list(pending if not errors else []):
+                threads = min(job.threads, max_threads)
+                if (used + threads <= max_threads
+                        and all(dep in results for dep in job.depends)):
+                    pending.remove(job)
+                    used += threads
+                    # in a copy of the context, so that the jobs' trace
+                    # spans nest in their directive's
+                    future = executor.submit(
+                        contextvars.copy_context().run, run, job)
+                    running[future] = (job, threads)
+
+            done, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                job, threads = running.pop(future)
+                used -= threads
+                try:
+                    results[job] = future.result()
+                except Exception as e:
+                    errors[job.index] = e
+
+    if errors:
+        raise errors[min(errors)]
+    return [results[job] for job in jobs]
@@ -0,0 +1,170 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import concurrent.futures
+import hashlib
+import http.client
+import os
+import shutil
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from q2doc.publish import publish_file
+from q2doc.util import hash_file
+
+
+# attempts per download, resuming from the bytes already received
+RETRIES = 3
+RETRY_DELAY = 1
+
+
+class DownloadError(Exception):
+    pass
+
+
+def verify(path, sha256):
+    if sha256 is None:
+        return
+    observed = hash_file(path)
+    if observed != sha256.lower():
+        raise DownloadError('Checksum mismatch for %s: expected sha256 %s, '
+                            'observed %s.' % (path, sha256, observed))
+
+
+class DownloadCache:
+    """A local cache of downloaded files, keyed by URL.
+
+    Files are looked up in the cache, then in any offline `bundles`, and
+    only then fetched. A bundle is a directory holding files named by their
+    sha256 digest or mirroring their URLs (``<host>/<path>``, as created by
+    ``wget --force-directories``). ``file://`` URLs are copied directly.
+    """
+    def __init__(self, root, bundles=(), retries=RETRIES,
+                 retry_delay=RETRY_DELAY):
+        self.root = os.path.abspath(root)
+        self.bundles = [os.path.abspath(bundle) for bundle in bundles]
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self._pool = None
+        self._futures = {}
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, url):
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.root, key[:2], key)
+
+    def _find_in_bundles(self, url, sha256):
+        parts = urllib.parse.urlsplit(url)
+        candidates = [os.path.join(parts.netloc, parts.path.lstrip('/'))]
+        if sha256 is not None:
+            candidates.insert(0, sha256.lower())
+        for bundle in self.bundles:
+            for candidate in candidates:
+                path = os.path.join(bundle, candidate)
+                if os.path.isfile(path):
+                    return path
+        return None
+
+    def _download(self, url, dest):
+        for attempt in range(self.retries):
+            received = os.path.getsize(dest)
+            request = urllib.request.Request(url)
+            if received:
+                request.add_header('Range', 'bytes=%d-' % received)
+            try:
+                with urllib.request.urlopen(request) as response:
+                    # a server ignoring the range sends the whole file again
+                    start = received if response.status == 206 else 0
+                    length = response.headers.get('Content-Length')
+                    with open(dest, 'ab' if start else 'wb') as fh:
+                        shutil.copyfileobj(response, fh)
+                        # a dropped connection can look like a short read
+                        if length is not None \
+                                and fh.tell() < start + int(length):
+                            raise http.client.IncompleteRead(b'')
+                return
+            except urllib.error.HTTPError as e:
+                if e.code < 500 or attempt == self.retries - 1:
+                    raise
+            except (OSError, http.client.HTTPException):
+                if attempt == self.retries - 1:
+                    raise
+            time.sleep(self.retry_delay * 2 ** attempt)
+
+    def fetch(self, url, sha256=None):
+        """Make sure `url` is in the cache, returning its cached path."""
+        path = self.path(url)
+        if os.path.exists(path):
+            try:
+                verify(path, sha256)
+                return path
+            except DownloadError:
+                os.remove(path)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', dir=self.root)
+        os.close(fd)
+        try:
+            source = self._find_in_bundles(url, sha256)
+            if source is None and url.startswith('file://'):
+                source = urllib.request.url2pathname(
+                    urllib.parse.urlsplit(url).path)
+
+            try:
+                if source is not None:
+                    shutil.copyfile(source, tmp_path)
+                else:
+                    self._download(url, tmp_path)
+            except (OSError, http.client.HTTPException) as e:
+                raise DownloadError('Unable to fetch %s: %s' % (url, e))
+
+            verify(tmp_path, sha256)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return path
+
+    def prefetch(self, downloads, max_workers):
+        """Start fetching `downloads` (url, sha256 pairs) in the background.
+        """
+        if self._pool is None:
+            self._pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers, thread_name_prefix='q2doc-download')
+        for url, sha256 in downloads:
+            if url not in self._futures:
+                self._futures[url] = self._pool.submit(self.fetch, url,
+                                                       sha256)
+        return list(self._futures.values())
+
+    def prefetched(self, urls):
+        """The futures of the prefetches started for `urls`."""
+        return [self._futures[url] for url in urls if url in self._futures]
+
+    def shutdown(self):
+        if self._pool is not None:
+            # rather than with cancel_futures, which needs Python 3.9
+            for future in self._futures.values():
+                future.cancel()
+            self._pool.shutdown(wait=False)
+            self._pool = None
+        self._futures = {}
+
+    def install(self, url, dest, sha256=None):
+        """Place the (cached) contents of `url` at `dest`, waiting for its
+        prefetch if one was started."""
+        future = self._futures.get(url)
+        if future is not None:
+            # a failed prefetch is retried (and reported) by `fetch` below
+            concurrent.futures.wait([future])
+        # commands may modify the file in place, which must not reach the
+        # cached copy through a hardlink
+        publish_file(self.fetch(url, sha256), dest, link=False)
@@ -0,0 +1,123 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import collections
+import io
+import itertools
+import os
+import signal
+import subprocess
+import tempfile
+import threading
+
+
+# output beyond this many characters is spooled to disk instead of memory
+SPOOL_SIZE = 1024 * 1024
+# grace period for the output readers once a timed out command was killed
+KILL_GRACE = 5
+
+
+class CompletedCommand:
+    """A finished command, with its output streams spooled to files."""
+    def __init__(self, args, returncode, stdout_file, stderr_file,
+                 timed_out=False):
+        self.args = args
+        self.returncode = returncode
+        self.timed_out = timed_out
+        self._files = {'stdout': stdout_file, 'stderr': stderr_file}
+
+    def open(self, stream_type):
+        fh = self._files[stream_type]
+        fh.seek(0)
+        return fh
+
+    @property
+    def stdout(self):
+        return self.open('stdout').read()
+
+    @property
+    def stderr(self):
+        return self.open('stderr').read()
+
+
+def open_output(comp_proc, stream_type):
+    """A stream of a command as a file, rewound to its start."""
+    if isinstance(comp_proc, CompletedCommand):
+        return comp_proc.open(stream_type)
+    return io.StringIO(getattr(comp_proc, stream_type) or '')
+
+
+def read_output(comp_proc, stream_type, max_lines=None):
+    """Read a stream of a (possibly cached) command, keeping only the head
+    and tail (`max_lines` lines in total) of very long output."""
+    fh = open_output(comp_proc, stream_type)
+
+    if max_lines is None:
+        return fh.read()
+
+    head = list(itertools.islice(fh, max_lines - max_lines // 2))
+    tail = collections.deque(maxlen=max_lines // 2)
+    omitted = 0
+    for line in fh:
+        if len(tail) == tail.maxlen:
+            omitted += 1
+        tail.append(line)
+
+    if not omitted:
+        return ''.join(head) + ''.join(tail)
+    return '%s... (%d lines omitted) ...\n%s' % (''.join(head), omitted,
+                                                 ''.join(tail))
+
+
+def _pump(pipe, spool, log):
+    for line in pipe:
+        spool.write(line)
+        if log is not None:
+            log(line.rstrip('\n'))
+    pipe.close()
+
+
+def run_streaming(command, cwd, timeout=None, log=None):
+    """Run a shell command, streaming its output into spooled files.
+
+    Each line of output is passed to `log` as it arrives. When `timeout`
+    seconds pass before the command exits, its whole process group is
+    killed and the result is marked as `timed_out`.
+    """
+    spools = [tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE, mode='w+',
+                                            encoding='utf-8')
+              for _ in range(2)]
+    proc = subprocess.Popen(command, cwd=cwd, shell=True,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            encoding='utf-8', errors='replace',
+                            start_new_session=True)
+    pumps = [threading.Thread(target=_pump, args=(pipe, spool, log),
+                              daemon=True)
+             for pipe, spool in zip((proc.stdout, proc.stderr), spools)]
+    for pump in pumps:
+        pump.start()
+
+    timed_out = False
+    try:
+        proc.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        timed_out = True
+        os.killpg(proc.pid, signal.SIGKILL)
+        proc.wait()
+    except BaseException:
+        # e.g. the build being interrupted, which does not reach the
+        # command's own session
+        os.killpg(proc.pid, signal.SIGKILL)
+        proc.wait()
+        raise
+
+    for pump in pumps:
+        pump.join(KILL_GRACE if timed_out else None)
+
+    return CompletedCommand(command, proc.returncode, *spools,
+                            timed_out=timed_out)
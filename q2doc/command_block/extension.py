@@ -7,32 +7,46 @@
 # ----------------------------------------------------------------------------
 
 import collections
+import concurrent.futures
 import os
 import os.path
 import shutil
-import subprocess
 import tempfile
+import threading
+import time
 import urllib.parse
 import functools
 
 import docutils.nodes
 import docutils.parsers.rst
 import docutils.parsers.rst.directives
-import docutils.statemachine
 import jinja2
 import sphinx
 from sphinx.util import logging
 
-import qiime2
 
-
-CURRENT_WORKING_DIR = '.'
-CURRENT_TUTORIAL = None
+from q2doc.incremental import note_command
+from q2doc.publish import publish_file, note_published
+from q2doc.sources import iter_directives, read_source
+from q2doc.timings import note_preexecution
+from q2doc.trace import directive_span, note_wait, span
+from q2doc.util import (connect_doc_state, doc_state, installed_versions,
+                        read_docs)
+from .backends import BACKENDS, Q2CLIBackend, Q2CLIWorker
+from .cache import ExecutionCache, format_stats
+from .dag import Job, plan, run_jobs
+from .downloads import DownloadCache, DownloadError, verify
+from .executor import read_output
+from .index import FileIndex
+from .preexec import PreExecutor, extract_blocks, parse_commands
 
 
 loader = jinja2.PackageLoader('q2doc.command_block', 'templates')
 jinja_env = jinja2.Environment(loader=loader)
 logger = logging.getLogger(__name__)
+# guard state shared by the concurrently running commands of a block
+_backends_lock = threading.Lock()
+_stats_lock = threading.Lock()
 
 
 class download_node(docutils.nodes.Element):
@@ -62,6 +76,227 @@ def teardown_working_dir(app, exception):
     app.command_block_working_dir.cleanup()
 
 
+def setup_cache(app):
+    app.command_block_cache = None
+    if app.config.command_block_cache_dir:
+        cache_dir = os.path.join(app.confdir,
+                                 app.config.command_block_cache_dir)
+        app.command_block_cache = ExecutionCache(cache_dir,
+                                                 installed_versions())
+
+    app.command_block_download_cache = None
+    if app.config.command_block_download_cache_dir:
+        cache_dir = os.path.join(app.confdir,
+                                 app.config.command_block_download_cache_dir)
+        bundles = [os.path.join(app.confdir, bundle)
+                   for bundle in app.config.command_block_download_bundles]
+        app.command_block_download_cache = DownloadCache(cache_dir, bundles)
+
+
+def _executed_directives(app, env, docname, names):
+    if (app.config.command_block_no_exec
+            and app.config.debug_page != docname):
+        return []
+    return [directive for directive
+            in iter_directives(read_source(env, docname), names)
+            if 'no-exec' not in directive.options]
+
+
+def prefetch_downloads(app, env, docnames):
+    cache = app.command_block_download_cache
+    if cache is None:
+        return
+
+    downloads = []
+    for docname in docnames:
+        for directive in _executed_directives(app, env, docname,
+                                              ('download',)):
+            opts = directive.options
+            if 'url' in opts:
+                downloads.append((opts['url'], opts.get('sha256')))
+    if not downloads:
+        return
+
+    logger.info('Prefetching %d downloads' % len(downloads))
+    futures = cache.prefetch(downloads,
+                             app.config.command_block_download_workers)
+    if app.parallel > 1:
+        # forked reader processes do not inherit the download threads
+        concurrent.futures.wait(futures)
+
+
+def preexecute(app, env, docnames):
+    app.command_block_preexec = {}
+    # docname -> the cache keys its pre-execution stored
+    app.command_block_preexecuted = {}
+    workers = app.config.command_block_preexec_workers
+    if not workers:
+        return
+    cache = app.command_block_cache
+    if cache is None:
+        logger.warning('command_block_preexec_workers needs '
+                       'command_block_cache_dir to be set, as pre-executed '
+                       'results are handed over through the cache.')
+        return
+
+    documents = {}
+    # in reading order, so that documents are executed before being read
+    for docname in docnames:
+        blocks = extract_blocks(
+            _executed_directives(app, env, docname,
+                                 ('command-block', 'download')),
+            app.config.command_block_timeout)
+        if blocks:
+            documents[docname] = blocks
+    if not documents:
+        return
+
+    download_cache = None
+    if app.command_block_download_cache is not None:
+        download_cache = (app.command_block_download_cache.root,
+                          app.command_block_download_cache.bundles)
+    # split the cores between the workers' numerical libraries
+    threads = max(1, (os.cpu_count() or 1) // workers)
+
+    logger.info('Pre-executing the commands of %d documents' % len(documents))
+    app.command_block_preexec_dir = tempfile.mkdtemp(
+        prefix='qiime2-docs-preexec-')
+    executor = app.command_block_preexecutor = PreExecutor(workers)
+    for docname, blocks in documents.items():
+        # the downloads are fetched by the prefetch, which the workers wait
+        # for rather than fetching them again
+        prefetched = []
+        if app.command_block_download_cache is not None:
+            prefetched = app.command_block_download_cache.prefetched(
+                [block.url for block in blocks if block.name == 'download'])
+        app.command_block_preexec[docname] = executor.submit(
+            (blocks, os.path.join(app.command_block_preexec_dir, docname),
+             cache.root, cache.versions, app.config.command_block_backend,
+             download_cache, threads), prefetched)
+    if app.parallel > 1:
+        # forked reader processes cannot wait on the futures
+        executor.wait()
+
+
+def wait_for_preexecution(env):
+    preexec = getattr(env.app, 'command_block_preexec', {})
+    future = preexec.pop(env.docname, None)
+    if future is None:
+        return
+    start = time.perf_counter()
+    try:
+        with span(env, 'wait for pre-execution', 'command'):
+            executed, stored, duration = future.result()
+    except Exception as e:
+        logger.warning('Pre-executing the commands of %s failed: %s'
+                       % (env.docname, e))
+        return
+    finally:
+        # accounted for by the document's pre-execution time instead
+        note_wait(time.perf_counter() - start)
+    logger.info('Pre-executed %d commands in %.1fs' % (executed, duration))
+    note_preexecution(env, duration)
+    env.app.command_block_preexecuted[env.docname] = set(stored)
+
+
+def cleanup_preexecution(app, exception):
+    if getattr(app, 'command_block_preexecutor', None) is not None:
+        app.command_block_preexecutor.terminate()
+        app.command_block_preexecutor = None
+    if getattr(app, 'command_block_preexec_dir', None):
+        shutil.rmtree(app.command_block_preexec_dir, ignore_errors=True)
+
+
+def shutdown_downloads(app, exception):
+    if app.command_block_download_cache is not None:
+        app.command_block_download_cache.shutdown()
+
+
+def setup_backends(app):
+    if app.config.command_block_backend not in BACKENDS:
+        raise sphinx.errors.ExtensionError(
+            'Unknown command_block_backend %r, expected one of: %s.'
+            % (app.config.command_block_backend, ', '.join(BACKENDS)))
+    backend = BACKENDS[app.config.command_block_backend]
+    if app.config.command_block_max_threads > 1 and not backend.concurrent:
+        logger.warning('command_block_max_threads is ignored with the %r '
+                       'backend: commands run at the same time would not '
+                       'share the state of its shell.'
+                       % app.config.command_block_backend)
+    # docname -> backend, not kept in the environment as it is not picklable
+    app.command_block_backends = {}
+    # docname -> index of its working directory, only needed while reading
+    app.command_block_indexes = {}
+    # shared by the documents, so that plugins are loaded once per build
+    app.command_block_q2cli = None
+    if backend is Q2CLIBackend:
+        app.command_block_q2cli = Q2CLIWorker()
+
+
+def start_q2cli(app, env, docnames):
+    # loading the plugins overlaps with the rest of the build's start
+    if app.command_block_q2cli is not None and docnames:
+        app.command_block_q2cli.start()
+
+
+def get_backend(env):
+    backends = env.app.command_block_backends
+    with _backends_lock:
+        if env.docname not in backends:
+            if env.app.command_block_q2cli is not None:
+                backends[env.docname] = Q2CLIBackend(
+                    env.app.command_block_q2cli)
+            else:
+                backends[env.docname] = BACKENDS[
+                    env.config.command_block_backend]()
+    return backends[env.docname]
+
+
+def get_index(env, working_dir):
+    indexes = env.app.command_block_indexes
+    with _backends_lock:
+        if env.docname not in indexes:
+            indexes[env.docname] = FileIndex(working_dir)
+    return indexes[env.docname]
+
+
+def close_backend(app, doctree):
+    backend = app.command_block_backends.pop(app.env.docname, None)
+    if backend is not None:
+        backend.close()
+    app.command_block_indexes.pop(app.env.docname, None)
+    app.command_block_preexecuted.pop(app.env.docname, None)
+
+
+def close_backends(app, exception):
+    while app.command_block_backends:
+        _, backend = app.command_block_backends.popitem()
+        backend.close()
+    app.command_block_indexes.clear()
+    if app.command_block_q2cli is not None:
+        app.command_block_q2cli.stop()
+
+
+def get_doc_state(env, docname=None):
+    """Per-document command-block state, stored in the environment."""
+    return doc_state(env, 'command_block_docs', docname, lambda: {
+        'cache': {'hits': 0, 'misses': 0, 'restored': 0, 'time_saved': 0.0},
+    })
+
+
+def report_cache_stats(app, exception):
+    if app.command_block_cache is None or exception is not None:
+        return
+    docs = getattr(app.env, 'command_block_docs', {})
+    stats = [docs[docname]['cache'] for docname in read_docs(app)
+             if docname in docs]
+    logger.info(format_stats(stats))
+
+
+def _owns(job, root_dir, relpath):
+    return job.owns(os.path.join(root_dir, relpath))
+
+
 OutputPath = collections.namedtuple('OutputPath', ['file', 'url'])
 
 
@@ -75,24 +310,28 @@ class CommandBlockDirective(docutils.parsers.rst.Directive):
         'stdout': docutils.parsers.rst.directives.flag,
         'stderr': docutils.parsers.rst.directives.flag,
         'allow-error': docutils.parsers.rst.directives.flag,
+        'timeout': docutils.parsers.rst.directives.positive_int,
+        'sha256': docutils.parsers.rst.directives.unchanged_required,
+        'threads': docutils.parsers.rst.directives.positive_int,
     }
 
     def run(self):
-        global CURRENT_TUTORIAL
-        global CURRENT_WORKING_DIR
+        with directive_span(self):
+            return self._run()
 
+    def _run(self):
         command_mode = True if self.name == 'command-block' else False
         opts = self.options
         download_opts = [k in opts for k in ['url', 'saveas']]
 
         if command_mode:
             self.assert_has_content()
-            if any(download_opts):
+            if any(download_opts) or 'sha256' in opts:
                 raise sphinx.errors.ExtensionError('command-block does not '
                                                    'support the following '
-                                                   'options: `url`, `saveas`.')
-            commands = functools.reduce(self._parse_multiline_commands,
-                                        self.content, [])
+                                                   'options: `url`, `saveas`, '
+                                                   '`sha256`.')
+            commands = parse_commands(self.content)
             nodes = [self._get_literal_block_node(self.content)]
         else:
             if self.content:
@@ -104,7 +343,6 @@ class CommandBlockDirective(docutils.parsers.rst.Directive):
                                                    'download directive. '
                                                    'Please specify `url` and '
                                                    '`saveas`.')
-            commands = ['wget -O "%s" "%s"' % (opts['saveas'], opts['url'])]
             id_ = self.state.document.settings.env.new_serialno('download')
             nodes = [download_node(id_, opts['url'], opts['saveas'])]
 
@@ -112,21 +350,19 @@ class CommandBlockDirective(docutils.parsers.rst.Directive):
         if not ((env.config.command_block_no_exec
                  and env.config.debug_page != env.docname) or
                 'no-exec' in opts):
-            if env.docname != CURRENT_TUTORIAL:
-                CURRENT_TUTORIAL = env.docname
-                CURRENT_WORKING_DIR = os.path.join(
-                    env.app.command_block_working_dir.name,
-                    env.docname)
-
+            wait_for_preexecution(env)
             working_dir = os.path.join(env.app.command_block_working_dir.name,
                                        env.docname)
             os.makedirs(working_dir, exist_ok=True)
 
             allow_error = 'allow-error' in opts
-            completed_processes = self._execute_commands(commands, working_dir,
-                                                         allow_error)
+            timeout = opts.get('timeout', env.config.command_block_timeout)
 
             if command_mode:
+                completed_processes = self._execute_commands(
+                    commands, working_dir, allow_error, timeout,
+                    opts.get('threads', 1))
+
                 for stream_type in ['stdout', 'stderr']:
                     if stream_type in opts:
                         node = self._get_stream_node(completed_processes,
@@ -134,97 +370,166 @@ class CommandBlockDirective(docutils.parsers.rst.Directive):
                         if node is not None:
                             nodes.extend(node)
 
-                artifacts, visualizations = self._get_output_paths(working_dir)
+                with span(env, 'publish outputs', 'publish'):
+                    artifacts, visualizations = self._get_output_paths(
+                        working_dir)
                 if artifacts or visualizations:
                     nodes.append(
                         self._get_output_links_node(artifacts, visualizations))
+            else:
+                self._download(opts['url'], opts['saveas'], opts.get('sha256'),
+                               working_dir, allow_error, timeout)
 
         return nodes
 
     def _get_env(self):
         return self.state.document.settings.env
 
+    def _download(self, url, saveas, sha256, root_dir, allow_error, timeout):
+        cache = self._get_env().app.command_block_download_cache
+        dest = os.path.join(root_dir, saveas)
+        try:
+            if cache is None:
+                command = 'wget -O "%s" "%s"' % (saveas, url)
+                self._execute_commands([command], root_dir, allow_error,
+                                       timeout)
+                if os.path.exists(dest):
+                    verify(dest, sha256)
+            else:
+                logger.info("Fetching (cached) %s" % url)
+                with span(self._get_env(), url, 'download'):
+                    cache.install(url, dest, sha256)
+        except DownloadError as e:
+            raise sphinx.errors.ExtensionError(str(e))
+
     def _get_literal_block_node(self, commands):
         content = '\n'.join(commands)
         node = docutils.nodes.literal_block(content, content)
         node['language'] = 'shell'
         return node
 
-    def _execute_commands(self, commands, working_dir, allow_error):
-        comp_procs = []
+    def _execute_commands(self, commands, root_dir, allow_error,
+                          timeout=None, threads=1):
+        env = self._get_env()
+        working_dir = root_dir
+        jobs = []
         for command in commands:
             command = command.strip()
             if not command:
                 continue
 
             if command.startswith('cd'):
-                global CURRENT_WORKING_DIR
                 new_path = os.path.join(working_dir, command.split(' ', 1)[-1])
-                new_path = os.path.normpath(new_path)
-                CURRENT_WORKING_DIR = working_dir = new_path
+                working_dir = os.path.normpath(new_path)
                 logger.info("Changing directory: %s" % working_dir)
                 continue
 
-            try:
-                logger.info("Running command: %s" % command)
-                comp_proc = subprocess.run(command,
-                                           stdout=subprocess.PIPE,
-                                           stderr=subprocess.PIPE,
-                                           cwd=working_dir,
-                                           shell=True,
-                                           encoding='utf-8',
-                                           universal_newlines=True)
-            except OSError as e:
-                raise sphinx.errors.ExtensionError("Unable to execute "
-                                                   "command %r: %s" %
-                                                   (command, e))
-
-            if not allow_error and comp_proc.returncode != 0:
-                msg = (
-                    "Command %r exited with non-zero return code %d.\n\n"
-                    "stdout:\n\n%s\n\n"
-                    "stderr:\n\n%s" %
-                    (command, comp_proc.returncode, comp_proc.stdout,
-                     comp_proc.stderr)
-                )
-                raise sphinx.errors.ExtensionError(msg)
-
-            comp_procs.append(comp_proc)
-        return comp_procs
+            note_command(env, command)
+            jobs.append(Job(len(jobs), command, working_dir, threads))
+
+        max_threads = 1
+        if BACKENDS[env.config.command_block_backend].concurrent:
+            max_threads = env.config.command_block_max_threads
+        run = functools.partial(self._execute_command, root_dir=root_dir,
+                                allow_error=allow_error, timeout=timeout,
+                                concurrent=max_threads > 1)
+        return run_jobs(plan(jobs), max_threads, run)
+
+    def _execute_command(self, job, root_dir, allow_error, timeout,
+                         concurrent):
+        env = self._get_env()
+        cache = env.app.command_block_cache
+        backend = get_backend(env)
+        stats = get_doc_state(env)['cache']
+        command = job.command
+
+        # commands changing or reading the state of a long-lived shell
+        # always run
+        cached = cache is not None and backend.cacheable(command)
+        if cached:
+            key = cache.key(command, job.cwd, root_dir)
+            entry = cache.get(key)
+            preexecuted = env.app.command_block_preexecuted.get(
+                env.docname, ())
+            with _stats_lock:
+                if entry is None:
+                    stats['misses'] += 1
+                elif key in preexecuted:
+                    # its time is accounted for by the pre-execution
+                    stats['restored'] += 1
+                else:
+                    stats['hits'] += 1
+                    stats['time_saved'] += entry.manifest['duration']
+            if entry is not None:
+                logger.info("Restoring cached command: %s" % command)
+                return cache.restore(entry, root_dir)
+            index = get_index(env, root_dir)
+            mark = index.mark()
+
+        try:
+            logger.info("Running command: %s" % command)
+            start = time.monotonic()
+            with span(env, command, 'command'):
+                comp_proc = backend.run(command, job.cwd, timeout,
+                                        log=self._log_output)
+            duration = time.monotonic() - start
+        except OSError as e:
+            raise sphinx.errors.ExtensionError("Unable to execute "
+                                               "command %r: %s" %
+                                               (command, e))
+
+        if comp_proc.timed_out:
+            raise sphinx.errors.ExtensionError(
+                "Command %r timed out after %d seconds." %
+                (command, timeout))
+
+        if cached and comp_proc.returncode == 0:
+            # other commands may have written files in the meantime
+            owns = None
+            if concurrent:
+                owns = functools.partial(_owns, job, root_dir)
+            cache.put(key, comp_proc, root_dir, index.since(mark), duration,
+                      owns)
+
+        if not allow_error and comp_proc.returncode != 0:
+            msg = (
+                "Command %r exited with non-zero return code %d.\n\n"
+                "stdout:\n\n%s\n\n"
+                "stderr:\n\n%s" %
+                (command, comp_proc.returncode,
+                 self._read_output(comp_proc, 'stdout'),
+                 self._read_output(comp_proc, 'stderr'))
+            )
+            raise sphinx.errors.ExtensionError(msg)
+
+        return comp_proc
+
+    def _log_output(self, line):
+        logger.info('  | %s' % line)
+
+    def _read_output(self, comp_proc, stream_type):
+        max_lines = self._get_env().config.command_block_max_output_lines
+        return read_output(comp_proc, stream_type, max_lines)
 
     def _get_output_paths(self, working_dir):
         env = self._get_env()
-        # TODO don't harcode build dir. Not sure how to get this value from
-        # Sphinx programmatically.
-        root_build_dir = 'build/html'
+        root_build_dir = env.app.outdir
         doc_data_dir = os.path.join(root_build_dir, 'data', env.docname)
 
         artifacts = []
         visualizations = []
-        for dirpath, _, filenames in os.walk(working_dir):
-            for filename in filenames:
-                if filename.endswith('.qza') or filename.endswith('.qzv'):
-                    src_filepath = os.path.join(dirpath, filename)
-                    file_relpath = os.path.relpath(src_filepath,
-                                                   start=working_dir)
-
-                    dest_dir = os.path.join(doc_data_dir,
-                                            os.path.dirname(file_relpath))
-                    os.makedirs(dest_dir, exist_ok=True)
-                    dest_filepath = os.path.join(dest_dir, filename)
-
-                    if not os.path.exists(dest_filepath):
-                        shutil.copyfile(src_filepath, dest_filepath)
-
-                        url_relpath = os.path.relpath(dest_filepath,
-                                                      root_build_dir)
-
-                        output_path = OutputPath(file=file_relpath,
-                                                 url=url_relpath)
-                        if filename.endswith('.qza'):
-                            artifacts.append(output_path)
-                        elif filename.endswith('.qzv'):
-                            visualizations.append(output_path)
+        # only outputs that are new (or rewritten) since the previous block
+        for file_relpath in get_index(env, working_dir).changes():
+            src_filepath = os.path.join(working_dir, file_relpath)
+            dest_filepath = os.path.join(doc_data_dir, file_relpath)
+            note_published(env, publish_file(src_filepath, dest_filepath))
+
+            url_relpath = os.path.relpath(dest_filepath, root_build_dir)
+            output_path = OutputPath(file=file_relpath, url=url_relpath)
+            if file_relpath.endswith('.qza'):
+                artifacts.append(output_path)
+            elif file_relpath.endswith('.qzv'):
+                visualizations.append(output_path)
 
         return artifacts, visualizations
 
@@ -236,16 +541,8 @@ class CommandBlockDirective(docutils.parsers.rst.Directive):
         # we're mainly going for CSS styling. For now, a general admonition
         # works.
         node = docutils.nodes.admonition()
-
-        content = []
-        content.extend(self._get_output_links(artifacts, 'artifacts'))
-        content.extend(self._get_output_links(visualizations,
-                                              'visualizations'))
-
-        env = self._get_env()
-        content = docutils.statemachine.ViewList(content, env.docname)
-        self.state.nested_parse(content, 0, node)
-
+        node.extend(self._get_output_links(artifacts, 'artifacts'))
+        node.extend(self._get_output_links(visualizations, 'visualizations'))
         return node
 
     def _get_stream_node(self, comp_proc, stream_type):
@@ -254,7 +551,7 @@ class CommandBlockDirective(docutils.parsers.rst.Directive):
 
         merged_content = []
         for process in comp_proc:
-            content = getattr(process, stream_type)
+            content = self._read_output(process, stream_type)
             if content:
                 merged_content.append(content)
         merged_content = '\n'.join(merged_content)
@@ -262,47 +559,79 @@ class CommandBlockDirective(docutils.parsers.rst.Directive):
         return [subtitle_node, pre_node]
 
     def _get_output_links(self, output_paths, name):
-        content = []
+        # the nodes are built directly, rather than by parsing generated
+        # reStructuredText, as this runs for every executed command block
+        nodes = []
         if output_paths:
+            # imported here, as importing qiime2 slows down sphinx's startup
+            import qiime2
+
             # TODO it would be nice to not hardcode this.
             url_prefix = 'https://docs.qiime2.org/%s/' % qiime2.__release__
 
             # TODO it would be cool to format the artifacts/visualizations
-            # as tables instead of unordered lists, but will take a little
-            # work to format the RST tables correctly.
-            content.append('**Output %s:**' % name)
-            content.append('')
-            content.append('')
+            # as tables instead of unordered lists.
+            title = 'Output %s:' % name
+            nodes.append(docutils.nodes.paragraph(
+                '', '', docutils.nodes.strong(title, title)))
 
+            bullet_list = docutils.nodes.bullet_list(bullet='*')
             for output_path in output_paths:
                 download_url = url_prefix + output_path.url
-                content.append(
-                    '* :file:`%s`: '
-                    '`view <https://view.qiime2.org?src=%s>`__ | '
-                    '`download <%s>`__' %
-                    (output_path.file, urllib.parse.quote_plus(download_url),
-                     download_url))
-                content.append('')
-        return content
-
-    def _parse_multiline_commands(self, previous, next):
-        result = previous.copy()
-        if result and result[-1].endswith('\\'):
-            result[-1] = result[-1][:-1]
-            result[-1] += next.strip()
-        else:
-            result.append(next.strip())
-        return result
+                view_url = ('https://view.qiime2.org?src=%s'
+                            % urllib.parse.quote_plus(download_url))
+                paragraph = docutils.nodes.paragraph()
+                paragraph += docutils.nodes.literal(
+                    output_path.file, output_path.file, role='file',
+                    classes=['file'])
+                paragraph += docutils.nodes.Text(': ')
+                paragraph += docutils.nodes.reference('view', 'view',
+                                                      refuri=view_url)
+                paragraph += docutils.nodes.Text(' | ')
+                paragraph += docutils.nodes.reference('download', 'download',
+                                                      refuri=download_url)
+                bullet_list += docutils.nodes.list_item('', paragraph)
+            nodes.append(bullet_list)
+        return nodes
 
 
 def setup(app):
+    app.setup_extension('q2doc.incremental')
+    app.setup_extension('q2doc.publish')
+    app.setup_extension('q2doc.trace')
+    app.setup_extension('q2doc.timings')
+
     app.connect('builder-inited', setup_working_dir)
+    app.connect('builder-inited', setup_cache)
+    app.connect('builder-inited', setup_backends)
+    app.connect('env-before-read-docs', prefetch_downloads)
+    app.connect('env-before-read-docs', preexecute)
+    app.connect('env-before-read-docs', start_q2cli)
+    connect_doc_state(app, 'command_block_docs')
+    app.connect('doctree-read', close_backend)
     app.connect('build-finished', teardown_working_dir)
+    app.connect('build-finished', report_cache_stats)
+    app.connect('build-finished', shutdown_downloads)
+    app.connect('build-finished', close_backends)
+    app.connect('build-finished', cleanup_preexecution)
     app.add_directive('command-block', CommandBlockDirective)
     app.add_directive('download', CommandBlockDirective)
     app.add_config_value('command_block_no_exec', False, 'html')
     app.add_config_value('debug_page', '', 'html')
+    app.add_config_value('command_block_cache_dir', None, '')
+    app.add_config_value('command_block_timeout', None, '')
+    app.add_config_value('command_block_download_cache_dir', None, '')
+    app.add_config_value('command_block_download_bundles', [], '')
+    app.add_config_value('command_block_download_workers', 4, '')
+    app.add_config_value('command_block_max_output_lines', None, 'html')
+    app.add_config_value('command_block_backend', 'subprocess', '')
+    app.add_config_value('command_block_max_threads', 1, '')
+    app.add_config_value('command_block_preexec_workers', 0, '')
     app.add_node(download_node, html=(visit_download_node,
                                       depart_download_node))
 
-    return {'version': '0.0.1'}
+    return {
+        'version': '0.0.1',
+        'parallel_read_safe': True,
+        'parallel_write_safe': True,
+    }
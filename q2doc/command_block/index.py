@@ -0,0 +1,158 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import os
+import threading
+import time
+
+
+# directories modified this recently may still change within the same
+# timestamp tick, so they are listed again next time (cf. git's "racy" index)
+RACY_NS = 2 * 10 ** 9
+
+# the kinds of changes in the index's journal
+WRITTEN = 'written'
+CREATED = 'created'
+REMOVED = 'removed'
+
+
+def _signature(stat):
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+class FileIndex:
+    """An incrementally updated index of the files and directories below
+    `root`.
+
+    Adding, removing or renaming an entry updates its directory's mtime, so
+    a directory is only listed again when its own signature changed. Known
+    files are re-stat'ed to catch files rewritten in place. The cost of an
+    update thus depends on the number of directories and files, but not on
+    listing the whole tree.
+
+    Every change found is appended to a journal, so that the changes since
+    a :meth:`mark` can be told apart from those found for others, e.g. for
+    commands running at the same time.
+    """
+    def __init__(self, root):
+        self.root = root
+        # relative dir -> (signature, {file name: signature}, [subdirs])
+        self._dirs = {}
+        # (relative path, kind of change), in the order they were found
+        self._journal = []
+        self._changes_mark = 0
+        self._lock = threading.Lock()
+
+    def mark(self):
+        """Update the index, returning the position to pass to
+        :meth:`since`."""
+        with self._lock:
+            self._refresh()
+            return len(self._journal)
+
+    def since(self, mark):
+        """The files written, the directories created and the paths removed
+        since `mark`, each sorted."""
+        with self._lock:
+            self._refresh()
+            return self._collapse(mark)
+
+    def changes(self, suffixes=('.qza', '.qzv')):
+        """Paths of the files with one of `suffixes` which are new or
+        modified since the previous call."""
+        with self._lock:
+            self._refresh()
+            outputs, _, _ = self._collapse(self._changes_mark)
+            self._changes_mark = len(self._journal)
+        return [relpath for relpath in outputs if relpath.endswith(suffixes)]
+
+    def _collapse(self, mark):
+        last = {}
+        for relpath, change in self._journal[mark:]:
+            if change == REMOVED:
+                # what was written below a removed directory is gone too
+                prefix = relpath + os.sep
+                for other in [other for other in last
+                              if other.startswith(prefix)]:
+                    del last[other]
+            last[relpath] = change
+        return tuple(sorted(relpath for relpath, found in last.items()
+                            if found == kind)
+                     for kind in (WRITTEN, CREATED, REMOVED))
+
+    def _refresh(self):
+        found = []
+        seen = set()
+        self._update('.', found, seen)
+        vanished = sorted(set(self._dirs) - seen)
+        for reldir in vanished:
+            del self._dirs[reldir]
+        # first, as a directory may have been replaced by a file
+        self._journal.extend((os.path.normpath(reldir), REMOVED)
+                             for reldir in vanished if reldir != '.')
+        self._journal.extend(found)
+
+    def _update(self, reldir, found, seen):
+        path = os.path.normpath(os.path.join(self.root, reldir))
+        try:
+            signature = _signature(os.stat(path))
+        except FileNotFoundError:
+            return
+        seen.add(reldir)
+
+        previous = self._dirs.get(reldir)
+        if previous is not None and previous[0] == signature:
+            _, files, subdirs = previous
+            for name, file_signature in list(files.items()):
+                relpath = os.path.normpath(os.path.join(reldir, name))
+                try:
+                    current = _signature(os.stat(os.path.join(path, name)))
+                except FileNotFoundError:
+                    del files[name]
+                    found.append((relpath, REMOVED))
+                    continue
+                if current != file_signature:
+                    files[name] = current
+                    found.append((relpath, WRITTEN))
+        else:
+            old_files, old_subdirs = {}, []
+            if previous is not None:
+                _, old_files, old_subdirs = previous
+            files = {}
+            subdirs = []
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    relpath = os.path.normpath(os.path.join(reldir,
+                                                            entry.name))
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.name)
+                        if entry.name not in old_subdirs:
+                            if entry.name in old_files:
+                                found.append((relpath, REMOVED))
+                            found.append((relpath, CREATED))
+                        continue
+                    if entry.is_dir():
+                        # links to directories are not followed
+                        continue
+                    try:
+                        files[entry.name] = _signature(entry.stat())
+                    except FileNotFoundError:
+                        # e.g. a dangling link, or removed meanwhile
+                        continue
+                    if old_files.get(entry.name) != files[entry.name]:
+                        found.append((relpath, WRITTEN))
+            for name in old_files:
+                if name not in files and name not in subdirs:
+                    found.append((os.path.normpath(os.path.join(reldir, name)),
+                                  REMOVED))
+            if time.time_ns() - signature[2] < RACY_NS:
+                signature = None
+            self._dirs[reldir] = (signature, files, subdirs)
+
+        for subdir in subdirs:
+            self._update(os.path.join(reldir, subdir), found, seen)
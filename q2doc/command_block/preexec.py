@@ -0,0 +1,219 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import collections
+import concurrent.futures
+import multiprocessing
+import os
+import shutil
+import signal
+import threading
+import time
+
+from .backends import BACKENDS
+from .cache import ExecutionCache
+from .downloads import DownloadCache
+from .index import FileIndex
+
+
+# variables limiting the threads of numerical libraries
+THREAD_LIMITS = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+                 'NUMEXPR_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS')
+
+
+Block = collections.namedtuple(
+    'Block', ['name', 'commands', 'url', 'saveas', 'sha256', 'allow_error',
+              'timeout'])
+
+
+def parse_commands(lines):
+    """Join the lines of a command block continued with a backslash."""
+    commands = []
+    for line in lines:
+        if commands and commands[-1].endswith('\\'):
+            commands[-1] = commands[-1][:-1] + line.strip()
+        else:
+            commands.append(line.strip())
+    return commands
+
+
+def extract_blocks(directives, default_timeout=None):
+    """The command blocks and downloads a document executes, in order."""
+    blocks = []
+    for directive in directives:
+        opts = directive.options
+        if 'no-exec' in opts:
+            continue
+        timeout = int(opts['timeout']) if 'timeout' in opts \
+            else default_timeout
+        blocks.append(Block(name=directive.name,
+                            commands=parse_commands(directive.content),
+                            url=opts.get('url'),
+                            saveas=opts.get('saveas'),
+                            sha256=opts.get('sha256'),
+                            allow_error='allow-error' in opts,
+                            timeout=timeout))
+    return blocks
+
+
+def execute_document(blocks, root, cache_dir, versions, backend='subprocess',
+                     download_cache=None, threads=None):
+    """Run the blocks of a document ahead of Sphinx reading it.
+
+    This runs in a worker process. Its results are handed over through the
+    execution cache: each command that succeeds is stored there, to be
+    restored when the document's directives run. Execution stops at the
+    first failure, which the directive reports when it runs the command
+    itself, and at the first command which cannot be cached, as the
+    directive would run it again. Returns the number of commands run, the
+    cache keys of those stored, and the seconds it took.
+    """
+    if threads is not None:
+        for name in THREAD_LIMITS:
+            os.environ[name] = str(threads)
+
+    cache = ExecutionCache(cache_dir, versions)
+    if download_cache is not None:
+        download_cache = DownloadCache(*download_cache)
+    runner = BACKENDS[backend]()
+
+    start = time.monotonic()
+    executed = 0
+    stored = []
+    os.makedirs(root, exist_ok=True)
+    index = FileIndex(root)
+    try:
+        for block in blocks:
+            # like the directives, each block starts in the document's root
+            cwd = root
+            if block.name == 'download':
+                commands = []
+                dest = os.path.join(cwd, block.saveas)
+                if download_cache is not None:
+                    download_cache.install(block.url, dest, block.sha256)
+                else:
+                    commands = ['wget -O "%s" "%s"' % (block.saveas,
+                                                       block.url)]
+            else:
+                commands = block.commands
+
+            for command in commands:
+                if not command:
+                    continue
+                if command.startswith('cd'):
+                    cwd = os.path.normpath(
+                        os.path.join(cwd, command.split(' ', 1)[-1]))
+                    continue
+
+                if not runner.cacheable(command):
+                    return executed, stored, time.monotonic() - start
+                key = cache.key(command, cwd, root)
+                entry = cache.get(key)
+                if entry is not None:
+                    cache.restore(entry, root)
+                    continue
+                mark = index.mark()
+
+                command_start = time.monotonic()
+                comp_proc = runner.run(command, cwd, block.timeout)
+                duration = time.monotonic() - command_start
+                executed += 1
+                if comp_proc.timed_out:
+                    return executed, stored, time.monotonic() - start
+                if comp_proc.returncode == 0:
+                    cache.put(key, comp_proc, root, index.since(mark),
+                              duration)
+                    stored.append(key)
+                elif not block.allow_error:
+                    return executed, stored, time.monotonic() - start
+    finally:
+        runner.close()
+        shutil.rmtree(root, ignore_errors=True)
+    return executed, stored, time.monotonic() - start
+
+
+def _terminate(signum, frame):
+    raise SystemExit(128 + signum)
+
+
+def _work(conn, args):
+    # so that the running command is killed and the working dir removed
+    signal.signal(signal.SIGTERM, _terminate)
+    try:
+        result = (True, execute_document(*args))
+    except Exception as e:
+        result = (False, '%s: %s' % (type(e).__name__, e))
+    conn.send(result)
+    conn.close()
+
+
+class PreExecutor:
+    """Runs `execute_document` in worker processes, at most `max_workers`
+    at a time.
+
+    Unlike with a ProcessPoolExecutor, each document waits for the futures
+    it depends on (e.g. the prefetch of its downloads) before its worker is
+    started, and the running workers are terminated on :meth:`terminate`
+    rather than joined when the interpreter exits.
+    """
+    def __init__(self, max_workers):
+        self._threads = concurrent.futures.ThreadPoolExecutor(
+            max_workers, thread_name_prefix='q2doc-preexec')
+        # spawned, as forking a process running threads is unsafe
+        self._context = multiprocessing.get_context('spawn')
+        self._lock = threading.Lock()
+        self._processes = set()
+        self._futures = []
+        self._terminated = False
+
+    def submit(self, args, depends_on=()):
+        """Run `execute_document(*args)` once the `depends_on` futures
+        finished."""
+        future = self._threads.submit(self._run, args, depends_on)
+        self._futures.append(future)
+        return future
+
+    def _run(self, args, depends_on):
+        concurrent.futures.wait(depends_on)
+        conn, child_conn = self._context.Pipe(duplex=False)
+        process = self._context.Process(target=_work,
+                                        args=(child_conn, args))
+        with self._lock:
+            if self._terminated:
+                raise concurrent.futures.CancelledError()
+            process.start()
+            self._processes.add(process)
+        child_conn.close()
+        try:
+            ok, result = conn.recv()
+        except EOFError:
+            ok, result = False, 'the worker exited unexpectedly'
+        finally:
+            conn.close()
+            process.join()
+            with self._lock:
+                self._processes.discard(process)
+        if not ok:
+            raise RuntimeError(result)
+        return result
+
+    def wait(self):
+        concurrent.futures.wait(self._futures)
+
+    def terminate(self):
+        with self._lock:
+            self._terminated = True
+            processes = list(self._processes)
+        for future in self._futures:
+            future.cancel()
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+        # documents still waiting on their downloads will not start
+        self._threads.shutdown(wait=False)
@@ -0,0 +1,156 @@
+import os
+import tempfile
+import time
+import unittest
+
+from q2doc.command_block.backends import (Q2CLIBackend, ShellBackend,
+                                          SubprocessBackend, q2cli_args)
+
+
+class TestShellBackend(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory(prefix='qiime2-test-temp-')
+        self.backend = ShellBackend()
+
+    def tearDown(self):
+        self.backend.close()
+        self.test_dir.cleanup()
+
+    def run_command(self, command, **kwargs):
+        return self.backend.run(command, self.test_dir.name, **kwargs)
+
+    def test_streams(self):
+        lines = []
+        comp_proc = self.run_command('echo out; echo err >&2; false',
+                                     log=lines.append)
+
+        self.assertEqual(comp_proc.returncode, 1)
+        self.assertFalse(comp_proc.timed_out)
+        self.assertEqual(comp_proc.stdout, 'out\n')
+        self.assertEqual(comp_proc.stderr, 'err\n')
+        self.assertEqual(sorted(lines), ['err', 'out'])
+
+    def test_output_without_newline(self):
+        comp_proc = self.run_command('printf out')
+
+        self.assertEqual(comp_proc.returncode, 0)
+        self.assertEqual(comp_proc.stdout, 'out')
+
+    def test_keeps_state(self):
+        self.run_command('export GREETING=hello')
+        comp_proc = self.run_command('echo $GREETING')
+
+        self.assertEqual(comp_proc.stdout, 'hello\n')
+
+    def test_runs_in_cwd(self):
+        subdir = os.path.join(self.test_dir.name, 'subdir')
+        os.mkdir(subdir)
+        self.run_command('cd /')
+
+        comp_proc = self.backend.run('pwd', subdir)
+
+        self.assertEqual(comp_proc.stdout, subdir + '\n')
+
+    def test_does_not_read_script(self):
+        comp_proc = self.run_command('cat')
+        self.assertEqual(comp_proc.stdout, '')
+
+        comp_proc = self.run_command('echo next')
+        self.assertEqual(comp_proc.stdout, 'next\n')
+
+    def test_exit_restarts_shell(self):
+        comp_proc = self.run_command('exit 3')
+        self.assertEqual(comp_proc.returncode, 3)
+
+        comp_proc = self.run_command('echo again')
+        self.assertEqual(comp_proc.returncode, 0)
+        self.assertEqual(comp_proc.stdout, 'again\n')
+
+    def test_timeout_restarts_shell(self):
+        start = time.monotonic()
+        comp_proc = self.run_command('sleep 30', timeout=1)
+
+        self.assertTrue(comp_proc.timed_out)
+        self.assertLess(time.monotonic() - start, 10)
+
+        comp_proc = self.run_command('echo again')
+        self.assertEqual(comp_proc.stdout, 'again\n')
+
+    def test_changes_state(self):
+        self.assertTrue(self.backend.changes_state('export A=1'))
+        self.assertTrue(self.backend.changes_state('A=1'))
+        self.assertTrue(self.backend.changes_state('source env.sh'))
+        self.assertFalse(self.backend.changes_state('A=1 qiime info'))
+        self.assertFalse(self.backend.changes_state('echo A=1'))
+
+    def test_cacheable(self):
+        self.assertTrue(self.backend.cacheable('qiime info'))
+        self.assertFalse(self.backend.cacheable('export N=2'))
+        self.assertFalse(self.backend.cacheable('qiime a b --p-n $N'))
+        self.assertFalse(self.backend.cacheable('echo `cat n.txt`'))
+        self.assertTrue(SubprocessBackend.cacheable('echo $HOME'))
+
+
+class TestQ2CLIArgs(unittest.TestCase):
+    def test_plain_invocation(self):
+        self.assertEqual(
+            q2cli_args("qiime tools import --input-path 'a b.tsv'"),
+            ['tools', 'import', '--input-path', 'a b.tsv'])
+
+    def test_needs_shell(self):
+        self.assertIsNone(q2cli_args('qiime info | head'))
+        self.assertIsNone(q2cli_args('qiime info > info.txt'))
+        self.assertIsNone(q2cli_args('qiime tools peek $ARTIFACT'))
+        self.assertIsNone(q2cli_args('qiime tools peek *.qza'))
+
+    def test_not_qiime(self):
+        self.assertIsNone(q2cli_args('echo qiime'))
+        self.assertIsNone(q2cli_args('qiime'))
+        self.assertIsNone(q2cli_args('qiime dev refresh-cache'))
+
+
+class FakeWorker:
+    def __init__(self):
+        self.calls = []
+
+    def run(self, args, cwd, stdout_path, stderr_path, timeout=None):
+        self.calls.append((args, cwd))
+        with open(stdout_path, 'w') as fh:
+            fh.write('ran\n')
+        return 0, False
+
+    def reset(self):
+        self.calls.append('reset')
+
+    def stop(self):
+        self.calls.append('stop')
+
+
+class TestQ2CLIBackend(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory(prefix='qiime2-test-temp-')
+        self.worker = FakeWorker()
+
+    def tearDown(self):
+        self.test_dir.cleanup()
+
+    def test_shared_worker_is_reset(self):
+        for _ in range(2):
+            backend = Q2CLIBackend(self.worker)
+            result = backend.run('qiime info', self.test_dir.name)
+            self.assertEqual(result.stdout, 'ran\n')
+            backend.close()
+
+        self.assertEqual(self.worker.calls,
+                         [(['info'], self.test_dir.name), 'reset'] * 2)
+
+    def test_own_worker_is_stopped(self):
+        backend = Q2CLIBackend()
+        backend._worker = self.worker
+        backend.close()
+
+        self.assertEqual(self.worker.calls, ['stop'])
+
+
+if __name__ == '__main__':
+    unittest.main()
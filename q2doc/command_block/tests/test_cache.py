@@ -0,0 +1,134 @@
+import os
+import subprocess
+import tempfile
+import unittest
+
+from q2doc.command_block.cache import ExecutionCache, format_stats
+from q2doc.command_block.index import FileIndex
+
+
+class TestExecutionCache(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory(prefix='qiime2-test-temp-')
+        self.cache = ExecutionCache(os.path.join(self.test_dir.name, 'cache'),
+                                    {'qiime2': '2023.5.0'})
+        self.root = os.path.join(self.test_dir.name, 'work')
+        os.makedirs(self.root)
+        self._write('input.txt', 'hello')
+
+    def tearDown(self):
+        self.test_dir.cleanup()
+
+    def _write(self, relpath, content):
+        with open(os.path.join(self.root, relpath), 'w') as fh:
+            fh.write(content)
+
+    def _run(self, command):
+        key = self.cache.key(command, self.root, self.root)
+        index = FileIndex(self.root)
+        mark = index.mark()
+        comp_proc = subprocess.run(command, cwd=self.root, shell=True,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE,
+                                   universal_newlines=True)
+        self.cache.put(key, comp_proc, self.root, index.since(mark), 2.5)
+        return key
+
+    def test_key_normalizes_whitespace(self):
+        key = self.cache.key('cat  input.txt', self.root, self.root)
+        self.assertEqual(
+            key, self.cache.key('cat input.txt ', self.root, self.root))
+
+    def test_key_tracks_inputs(self):
+        key = self.cache.key('cat input.txt', self.root, self.root)
+        self._write('input.txt', 'goodbye')
+        self.assertNotEqual(
+            key, self.cache.key('cat input.txt', self.root, self.root))
+
+    def test_key_tracks_versions(self):
+        key = self.cache.key('cat input.txt', self.root, self.root)
+        cache = ExecutionCache(self.cache.root, {'qiime2': '2023.9.0'})
+        self.assertNotEqual(
+            key, cache.key('cat input.txt', self.root, self.root))
+
+    def test_roundtrip(self):
+        command = 'cat input.txt > output.qza && echo done'
+        key = self._run(command)
+        os.remove(os.path.join(self.root, 'output.qza'))
+
+        entry = self.cache.get(key)
+        self.assertIsNotNone(entry)
+        self.assertEqual(entry.manifest['outputs'], ['output.qza'])
+
+        comp_proc = self.cache.restore(entry, self.root)
+        self.assertEqual(comp_proc.returncode, 0)
+        self.assertEqual(comp_proc.stdout, 'done\n')
+        with open(os.path.join(self.root, 'output.qza')) as fh:
+            self.assertEqual(fh.read(), 'hello')
+
+    def test_streams_stored_as_files(self):
+        key = self._run('seq 3; seq 2 >&2')
+
+        entry = self.cache.get(key)
+        self.assertNotIn('stdout', entry.manifest)
+        with open(os.path.join(entry.path, 'stdout')) as fh:
+            self.assertEqual(fh.read(), '1\n2\n3\n')
+
+        comp_proc = self.cache.restore(entry, self.root)
+        self.assertEqual(comp_proc.stdout, '1\n2\n3\n')
+        self.assertEqual(comp_proc.stderr, '1\n2\n')
+
+    def test_roundtrip_directories(self):
+        key = self._run('mkdir -p empty out/nested')
+        os.rmdir(os.path.join(self.root, 'empty'))
+
+        entry = self.cache.get(key)
+        self.assertEqual(entry.manifest['directories'],
+                         ['empty', 'out', 'out/nested'])
+        self.cache.restore(entry, self.root)
+        self.assertTrue(os.path.isdir(os.path.join(self.root, 'empty')))
+        self.assertTrue(os.path.isdir(os.path.join(self.root, 'out/nested')))
+
+    def test_roundtrip_removals(self):
+        key = self._run('mv input.txt moved.txt')
+        os.rename(os.path.join(self.root, 'moved.txt'),
+                  os.path.join(self.root, 'input.txt'))
+
+        entry = self.cache.get(key)
+        self.assertEqual(entry.manifest['removed'], ['input.txt'])
+        self.cache.restore(entry, self.root)
+        self.assertEqual(sorted(os.listdir(self.root)), ['moved.txt'])
+
+    def test_key_tracks_listing(self):
+        key = self.cache.key('ls', self.root, self.root)
+        self._write('other.txt', '')
+        self.assertNotEqual(key, self.cache.key('ls', self.root, self.root))
+
+        # unlike plain qiime commands, which name their inputs
+        command = 'qiime tools peek input.txt'
+        key = self.cache.key(command, self.root, self.root)
+        self._write('another.txt', '')
+        self.assertEqual(key, self.cache.key(command, self.root, self.root))
+
+    def test_restore_substitutes_root(self):
+        key = self._run('pwd')
+        other = os.path.join(self.test_dir.name, 'other')
+        os.makedirs(other)
+
+        comp_proc = self.cache.restore(self.cache.get(key), other)
+        self.assertEqual(comp_proc.stdout, other + '\n')
+
+    def test_miss(self):
+        key = self.cache.key('cat input.txt', self.root, self.root)
+        self.assertIsNone(self.cache.get(key))
+
+    def test_format_stats(self):
+        stats = [{'hits': 2, 'misses': 1, 'restored': 4, 'time_saved': 3.0},
+                 {'hits': 1, 'misses': 0, 'restored': 0, 'time_saved': 0.5}]
+        self.assertEqual(format_stats(stats),
+                         'command-block cache: 3 hits, 1 misses, '
+                         '4 pre-executed, 3.5s saved')
+
+
+if __name__ == '__main__':
+    unittest.main()
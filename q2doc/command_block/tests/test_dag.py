@@ -0,0 +1,136 @@
+import threading
+import time
+import unittest
+
+from q2doc.command_block.dag import Job, file_accesses, plan, run_jobs
+
+
+class TestFileAccesses(unittest.TestCase):
+    def test_action(self):
+        reads, writes = file_accesses(
+            'qiime diversity alpha --i-table table.qza --p-metric shannon '
+            '--m-metadata-file=md.tsv --o-alpha-diversity shannon', '/w')
+
+        self.assertIn('/w/table', reads)
+        self.assertIn('/w/md.tsv', reads)
+        self.assertEqual(writes, {'/w/shannon'})
+
+    def test_tools(self):
+        reads, writes = file_accesses(
+            'qiime tools export --input-path ../table.qza --output-path out',
+            '/w/sub')
+
+        self.assertIn('/w/table', reads)
+        self.assertEqual(writes, {'/w/sub/out'})
+
+    def test_output_file(self):
+        reads, writes = file_accesses(
+            'qiime tools cast-metadata md.tsv --output-file md2.tsv', '/w')
+
+        self.assertIn('/w/md.tsv', reads)
+        self.assertEqual(writes, {'/w/md2.tsv'})
+
+    def test_unknown(self):
+        self.assertIsNone(file_accesses(
+            'qiime tools import --type X --input-path a --output-path b',
+            '/w'))
+        self.assertIsNone(file_accesses('wget -O a.qza url', '/w'))
+        self.assertIsNone(file_accesses('qiime info > info.txt', '/w'))
+        self.assertIsNone(file_accesses('qiime dev refresh-cache', '/w'))
+
+
+class TestPlan(unittest.TestCase):
+    def test_dependencies(self):
+        jobs = plan([
+            Job(0, 'qiime a b --o-x x', '/w'),
+            Job(1, 'qiime a c --i-x x.qza --o-y y', '/w'),
+            Job(2, 'qiime a c --i-x x.qza --o-z z', '/w'),
+            Job(3, 'qiime tools export --input-path x.qza '
+                   '--output-path x-dir', '/w'),
+            Job(4, 'qiime a d --m-file x-dir/data.tsv --o-w w', '/w'),
+            Job(5, 'rm x.qza', '/w'),
+        ])
+
+        self.assertEqual([{j.index for j in job.depends} for job in jobs],
+                         [set(), {0}, {0}, {0}, {3}, {0, 1, 2, 3, 4}])
+
+    def test_cast_metadata_consumer(self):
+        jobs = plan([
+            Job(0, 'qiime tools cast-metadata md.tsv --output-file md2.tsv',
+                '/w'),
+            Job(1, 'qiime a b --m-input-file md2.tsv --o-x x', '/w'),
+        ])
+
+        self.assertEqual(jobs[1].depends, {jobs[0]})
+        self.assertTrue(jobs[0].owns('/w/md2.tsv'))
+
+    def test_owns(self):
+        job = Job(0, 'qiime a b --o-x x --output-dir out', '/w')
+
+        self.assertTrue(job.owns('/w/x.qza'))
+        self.assertTrue(job.owns('/w/out/index.html'))
+        self.assertFalse(job.owns('/w/y.qza'))
+
+
+class TestRunJobs(unittest.TestCase):
+    def test_sequential(self):
+        jobs = plan([Job(i, 'qiime a b --o-x x%d' % i, '/w')
+                     for i in range(3)])
+        self.assertEqual(run_jobs(jobs, 1, lambda job: job.index), [0, 1, 2])
+
+    def test_concurrent_in_order(self):
+        jobs = plan([Job(i, 'qiime a b --o-x x%d' % i, '/w')
+                     for i in range(4)])
+        barrier = threading.Barrier(4, timeout=5)
+
+        def run(job):
+            # all four jobs have to run at the same time to pass
+            barrier.wait()
+            return job.index
+
+        self.assertEqual(run_jobs(jobs, 4, run), [0, 1, 2, 3])
+
+    def test_threads_limit(self):
+        jobs = plan([Job(i, 'qiime a b --o-x x%d' % i, '/w', threads=2)
+                     for i in range(4)])
+        lock = threading.Lock()
+        running = [0, 0]
+
+        def run(job):
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+
+        run_jobs(jobs, 4, run)
+        self.assertEqual(running[1], 2)
+
+    def test_dependencies_wait(self):
+        jobs = plan([Job(0, 'qiime a b --o-x x', '/w'),
+                     Job(1, 'qiime a c --i-x x.qza --o-y y', '/w')])
+        finished = []
+
+        def run(job):
+            if job.index == 0:
+                time.sleep(0.05)
+            finished.append(job.index)
+
+        run_jobs(jobs, 2, run)
+        self.assertEqual(finished, [0, 1])
+
+    def test_earliest_error(self):
+        jobs = plan([Job(i, 'qiime a b --o-x x%d' % i, '/w')
+                     for i in range(3)])
+
+        def run(job):
+            if job.index:
+                raise ValueError(job.index)
+
+        with self.assertRaisesRegex(ValueError, '1'):
+            run_jobs(jobs, 3, run)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+import hashlib
+import http.server
+import os
+import pathlib
+import tempfile
+import threading
+import unittest
+
+from q2doc.command_block.downloads import DownloadCache, DownloadError
+
+
+class TestDownloadCache(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory(prefix='qiime2-test-temp-')
+        self.root = pathlib.Path(self.test_dir.name)
+        self.source = self.root / 'source' / 'sequences.fastq.gz'
+        self.source.parent.mkdir()
+        self.source.write_bytes(b'@seq1\nACGT\n+\nIIII\n')
+        self.sha256 = hashlib.sha256(self.source.read_bytes()).hexdigest()
+        self.url = self.source.as_uri()
+        self.work = self.root / 'work'
+        self.work.mkdir()
+
+    def tearDown(self):
+        self.test_dir.cleanup()
+
+    def test_file_url(self):
+        cache = DownloadCache(self.root / 'cache')
+        dest = self.work / 'seqs.fastq.gz'
+        cache.install(self.url, str(dest), self.sha256)
+
+        self.assertEqual(dest.read_bytes(), self.source.read_bytes())
+        self.assertTrue(os.path.exists(cache.path(self.url)))
+
+    def test_install_is_a_copy(self):
+        cache = DownloadCache(self.root / 'cache')
+        dest = self.work / 'seqs.fastq.gz'
+        cache.install(self.url, str(dest), self.sha256)
+        with open(dest, 'ab') as fh:
+            fh.write(b'modified')
+
+        with open(cache.path(self.url), 'rb') as fh:
+            self.assertEqual(fh.read(), self.source.read_bytes())
+
+    def test_shutdown_cancels_pending(self):
+        started, release = threading.Event(), threading.Event()
+
+        class BlockingCache(DownloadCache):
+            def fetch(self, url, sha256=None):
+                started.set()
+                release.wait(5)
+
+        cache = BlockingCache(self.root / 'cache')
+        running, pending = cache.prefetch([('a', None), ('b', None)], 1)
+        started.wait(5)
+        cache.shutdown()
+        release.set()
+
+        self.assertTrue(pending.cancelled())
+        self.assertFalse(running.cancelled())
+
+    def test_cached_without_source(self):
+        cache = DownloadCache(self.root / 'cache')
+        cache.fetch(self.url)
+        self.source.unlink()
+
+        dest = self.work / 'seqs.fastq.gz'
+        cache.install(self.url, str(dest), self.sha256)
+        self.assertEqual(hashlib.sha256(dest.read_bytes()).hexdigest(),
+                         self.sha256)
+
+    def test_bundle_by_checksum(self):
+        bundle = self.root / 'bundle'
+        bundle.mkdir()
+        (bundle / self.sha256).write_bytes(self.source.read_bytes())
+
+        cache = DownloadCache(self.root / 'cache', bundles=[bundle])
+        url = 'https://data.qiime2.org/tutorials/sequences.fastq.gz'
+        path = cache.fetch(url, self.sha256)
+        with open(path, 'rb') as fh:
+            self.assertEqual(fh.read(), self.source.read_bytes())
+
+    def test_bundle_by_url(self):
+        mirrored = (self.root / 'bundle' / 'data.qiime2.org' / 'tutorials'
+                    / 'sequences.fastq.gz')
+        mirrored.parent.mkdir(parents=True)
+        mirrored.write_bytes(self.source.read_bytes())
+
+        cache = DownloadCache(self.root / 'cache',
+                              bundles=[self.root / 'bundle'])
+        url = 'https://data.qiime2.org/tutorials/sequences.fastq.gz'
+        path = cache.fetch(url)
+        with open(path, 'rb') as fh:
+            self.assertEqual(fh.read(), self.source.read_bytes())
+
+    def test_checksum_mismatch(self):
+        cache = DownloadCache(self.root / 'cache')
+        with self.assertRaisesRegex(DownloadError, 'Checksum mismatch'):
+            cache.fetch(self.url, '0' * 64)
+        self.assertFalse(os.path.exists(cache.path(self.url)))
+
+    def test_missing_source(self):
+        cache = DownloadCache(self.root / 'cache')
+        with self.assertRaisesRegex(DownloadError, 'Unable to fetch'):
+            cache.fetch((self.root / 'missing').as_uri())
+
+
+PAYLOAD = bytes(range(256)) * 64
+
+
+class FlakyHandler(http.server.BaseHTTPRequestHandler):
+    """Serves PAYLOAD, dropping the first connection half-way through."""
+    def do_GET(self):
+        self.server.ranges.append(self.headers.get('Range'))
+        start = 0
+        if self.headers.get('Range'):
+            start = int(self.headers['Range'][len('bytes='):-1])
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d'
+                             % (start, len(PAYLOAD) - 1, len(PAYLOAD)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(PAYLOAD) - start))
+        self.end_headers()
+
+        if len(self.server.ranges) == 1:
+            self.wfile.write(PAYLOAD[:len(PAYLOAD) // 2])
+            self.close_connection = True
+        else:
+            self.wfile.write(PAYLOAD[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+class TestHTTPDownloads(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory(prefix='qiime2-test-temp-')
+        self.root = pathlib.Path(self.test_dir.name)
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                                      FlakyHandler)
+        self.server.ranges = []
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+        self.url = 'http://127.0.0.1:%d/data.bin' % self.server.server_port
+        self.sha256 = hashlib.sha256(PAYLOAD).hexdigest()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.test_dir.cleanup()
+
+    def test_resume(self):
+        cache = DownloadCache(self.root / 'cache', retry_delay=0)
+        with open(cache.fetch(self.url, self.sha256), 'rb') as fh:
+            self.assertEqual(fh.read(), PAYLOAD)
+        self.assertEqual(self.server.ranges,
+                         [None, 'bytes=%d-' % (len(PAYLOAD) // 2)])
+
+    def test_prefetch(self):
+        cache = DownloadCache(self.root / 'cache', retry_delay=0)
+        futures = cache.prefetch([(self.url, self.sha256)] * 3, 2)
+        self.assertEqual(len(futures), 1)
+
+        dest = self.root / 'data.bin'
+        cache.install(self.url, str(dest), self.sha256)
+        cache.shutdown()
+        self.assertEqual(dest.read_bytes(), PAYLOAD)
+        self.assertEqual(len(self.server.ranges), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
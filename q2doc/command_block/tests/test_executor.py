@@ -0,0 +1,51 @@
+import subprocess
+import tempfile
+import time
+import unittest
+
+from q2doc.command_block.executor import read_output, run_streaming
+
+
+class TestRunStreaming(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory(prefix='qiime2-test-temp-')
+
+    def tearDown(self):
+        self.test_dir.cleanup()
+
+    def test_streams(self):
+        lines = []
+        comp_proc = run_streaming('echo out; echo err >&2; exit 3',
+                                  self.test_dir.name, log=lines.append)
+
+        self.assertEqual(comp_proc.returncode, 3)
+        self.assertFalse(comp_proc.timed_out)
+        self.assertEqual(comp_proc.stdout, 'out\n')
+        self.assertEqual(comp_proc.stderr, 'err\n')
+        self.assertEqual(sorted(lines), ['err', 'out'])
+
+    def test_timeout_kills_process_group(self):
+        start = time.monotonic()
+        comp_proc = run_streaming('sleep 30 & sleep 30', self.test_dir.name,
+                                  timeout=1)
+
+        self.assertTrue(comp_proc.timed_out)
+        self.assertLess(time.monotonic() - start, 10)
+
+
+class TestReadOutput(unittest.TestCase):
+    def test_untruncated(self):
+        comp_proc = subprocess.CompletedProcess('seq', 0, '1\n2\n3\n', '')
+        self.assertEqual(read_output(comp_proc, 'stdout'), '1\n2\n3\n')
+        self.assertEqual(read_output(comp_proc, 'stdout', 3), '1\n2\n3\n')
+        self.assertEqual(read_output(comp_proc, 'stderr', 3), '')
+
+    def test_head_and_tail(self):
+        stdout = ''.join('%d\n' % i for i in range(1, 11))
+        comp_proc = subprocess.CompletedProcess('seq', 0, stdout, '')
+        self.assertEqual(read_output(comp_proc, 'stdout', 4),
+                         '1\n2\n... (6 lines omitted) ...\n9\n10\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
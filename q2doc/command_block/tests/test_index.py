@@ -0,0 +1,133 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from q2doc.command_block.index import RACY_NS, FileIndex
+
+
+class TestFileIndex(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory(prefix='qiime2-test-temp-')
+        self.root = self.test_dir.name
+        self.index = FileIndex(self.root)
+
+    def tearDown(self):
+        self.test_dir.cleanup()
+
+    def _write(self, relpath, content='data'):
+        path = os.path.join(self.root, relpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as fh:
+            fh.write(content)
+        return path
+
+    def test_new_outputs(self):
+        self._write('a.qza')
+        self._write('sub/b.qzv')
+        self._write('sub/notes.txt')
+
+        self.assertEqual(self.index.changes(), ['a.qza', 'sub/b.qzv'])
+        self.assertEqual(self.index.changes(), [])
+
+        self._write('sub/deeper/c.qza')
+        self.assertEqual(self.index.changes(), ['sub/deeper/c.qza'])
+
+    def test_racy_directory_listed_again(self):
+        self._write('a.qza')
+        self.index.changes()
+        mtime = os.stat(self.root).st_mtime_ns
+
+        # a file added within the same timestamp tick leaves the directory's
+        # signature unchanged
+        self._write('b.qza')
+        os.utime(self.root, ns=(mtime, mtime))
+
+        self.assertEqual(self.index.changes(), ['b.qza'])
+
+    def test_settled_directory_not_listed(self):
+        self._write('a.qza')
+        past = time.time_ns() - 2 * RACY_NS
+        os.utime(self.root, ns=(past, past))
+        self.index.changes()
+
+        signature, _, _ = self.index._dirs['.']
+        self.assertIsNotNone(signature)
+
+    def test_rewritten_in_place(self):
+        path = self._write('a.qza')
+        past = time.time_ns() - 2 * RACY_NS
+        os.utime(self.root, ns=(past, past))
+        self.index.changes()
+
+        self._write('a.qza', 'other data')
+        os.utime(path, ns=(past + 1, past + 1))
+        os.utime(self.root, ns=(past, past))
+
+        self.assertEqual(self.index.changes(), ['a.qza'])
+        self.assertEqual(self.index.changes(), [])
+
+    def test_removed_directory(self):
+        self._write('sub/a.qza')
+        self.index.changes()
+
+        shutil.rmtree(os.path.join(self.root, 'sub'))
+        self.assertEqual(self.index.changes(), [])
+        self.assertNotIn('sub', self.index._dirs)
+
+        # a directory recreated with the same outputs reports them again
+        self._write('sub/a.qza')
+        self.assertEqual(self.index.changes(), ['sub/a.qza'])
+
+    def test_removed_output(self):
+        self._write('a.qza')
+        self._write('b.qza')
+        self.index.changes()
+
+        os.remove(os.path.join(self.root, 'a.qza'))
+        self.assertEqual(self.index.changes(), [])
+        self.assertEqual(sorted(self.index._dirs['.'][1]), ['b.qza'])
+
+    def test_since_mark(self):
+        self._write('input.txt')
+        self._write('old/a.txt')
+        mark = self.index.mark()
+
+        self._write('input.txt', 'rewritten')
+        self._write('new/b.txt')
+        shutil.rmtree(os.path.join(self.root, 'old'))
+
+        self.assertEqual(self.index.since(mark),
+                         (['input.txt', 'new/b.txt'], ['new'], ['old']))
+        self.assertEqual(self.index.since(self.index.mark()), ([], [], []))
+
+    def test_overlapping_marks(self):
+        first = self.index.mark()
+        self._write('a.txt')
+        second = self.index.mark()
+        self._write('b.txt')
+
+        # the changes found for one mark remain visible to the other
+        self.assertEqual(self.index.since(second)[0], ['b.txt'])
+        self.assertEqual(self.index.since(first)[0], ['a.txt', 'b.txt'])
+
+    def test_written_then_removed(self):
+        mark = self.index.mark()
+        self._write('sub/a.txt')
+        self.index.mark()
+        shutil.rmtree(os.path.join(self.root, 'sub'))
+
+        self.assertEqual(self.index.since(mark), ([], [], ['sub']))
+
+    def test_dangling_link_skipped(self):
+        mark = self.index.mark()
+        os.symlink(os.path.join(self.root, 'missing'),
+                   os.path.join(self.root, 'link'))
+        self._write('a.txt')
+
+        self.assertEqual(self.index.since(mark)[0], ['a.txt'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,204 @@
+import concurrent.futures
+import os
+import tempfile
+import time
+import unittest
+
+from q2doc.command_block.cache import ExecutionCache
+from q2doc.command_block.preexec import (PreExecutor, execute_document,
+                                         extract_blocks, parse_commands)
+from q2doc.sources import iter_directives
+
+
+SOURCE = '''\
+.. command-block::
+
+   mkdir out
+   cd out
+   echo one \\
+     two > words.txt
+
+.. command-block::
+   :no-exec:
+
+   echo skipped > skipped.txt
+
+.. command-block::
+   :allow-error:
+   :timeout: 5
+
+   cd out
+   cat words.txt
+   false
+   echo three >> words.txt
+'''
+
+
+class TestExtractBlocks(unittest.TestCase):
+    def test_parse_commands(self):
+        self.assertEqual(parse_commands(['echo a \\', '  b', 'echo c']),
+                         ['echo a b', 'echo c'])
+
+    def test_extract_blocks(self):
+        blocks = extract_blocks(
+            iter_directives(SOURCE, ('command-block', 'download')), 60)
+
+        self.assertEqual([block.commands for block in blocks],
+                         [['mkdir out', 'cd out', 'echo one two > words.txt'],
+                          ['cd out', 'cat words.txt', 'false',
+                           'echo three >> words.txt']])
+        self.assertEqual([block.timeout for block in blocks], [60, 5])
+        self.assertEqual([block.allow_error for block in blocks],
+                         [False, True])
+
+
+class TestExecuteDocument(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory(prefix='qiime2-test-temp-')
+        self.cache_dir = os.path.join(self.test_dir.name, 'cache')
+        self.blocks = extract_blocks(
+            iter_directives(SOURCE, ('command-block', 'download')))
+
+    def tearDown(self):
+        self.test_dir.cleanup()
+
+    def test_hands_over_through_cache(self):
+        root = os.path.join(self.test_dir.name, 'preexec')
+        executed, _, _ = execute_document(self.blocks, root, self.cache_dir,
+                                          {})
+
+        self.assertEqual(executed, 5)
+        self.assertFalse(os.path.exists(root))
+
+        # the commands are cached for another working dir of the document
+        cache = ExecutionCache(self.cache_dir, {})
+        other = os.path.join(self.test_dir.name, 'other')
+        os.makedirs(os.path.join(other, 'out'))
+        key = cache.key('echo one two > words.txt',
+                        os.path.join(other, 'out'), other)
+        entry = cache.get(key)
+        self.assertIsNotNone(entry)
+        cache.restore(entry, other)
+        with open(os.path.join(other, 'out', 'words.txt')) as fh:
+            self.assertEqual(fh.read(), 'one two\n')
+
+        key = cache.key('cat words.txt', os.path.join(other, 'out'), other)
+        self.assertEqual(cache.restore(cache.get(key), other).stdout,
+                         'one two\n')
+
+    def test_blocks_start_in_root(self):
+        blocks = [self.blocks[0], self.blocks[0]._replace(
+            commands=['echo root > root.txt'])]
+        root = os.path.join(self.test_dir.name, 'preexec')
+        execute_document(blocks, root, self.cache_dir, {})
+
+        cache = ExecutionCache(self.cache_dir, {})
+        os.makedirs(os.path.join(root, 'out'))
+        entry = cache.get(cache.key('echo root > root.txt', root, root))
+        self.assertEqual(entry.manifest['outputs'], ['root.txt'])
+
+    def test_stops_at_failure(self):
+        blocks = [self.blocks[0]._replace(
+            commands=['false', 'echo never > never.txt'])]
+        root = os.path.join(self.test_dir.name, 'preexec')
+
+        executed, _, _ = execute_document(blocks, root, self.cache_dir, {})
+
+        self.assertEqual(executed, 1)
+
+    def test_restores_cached(self):
+        root = os.path.join(self.test_dir.name, 'preexec')
+        execute_document(self.blocks, root, self.cache_dir, {})
+
+        executed, _, _ = execute_document(self.blocks, root, self.cache_dir,
+                                          {})
+
+        # only the failing command is run again
+        self.assertEqual(executed, 1)
+
+    def test_returns_stored_keys(self):
+        blocks = [self.blocks[0]._replace(commands=['echo a > a.txt'])]
+        root = os.path.join(self.test_dir.name, 'preexec')
+
+        _, stored, _ = execute_document(blocks, root, self.cache_dir, {})
+
+        # keyed as run in the then empty root
+        cache = ExecutionCache(self.cache_dir, {})
+        os.makedirs(root)
+        self.assertEqual(stored, [cache.key('echo a > a.txt', root, root)])
+
+    def test_stops_at_uncacheable(self):
+        blocks = [self.blocks[0]._replace(
+            commands=['echo a > a.txt', 'export NAME=b',
+                      'echo $NAME > b.txt'])]
+        root = os.path.join(self.test_dir.name, 'preexec')
+
+        executed, stored, _ = execute_document(blocks, root, self.cache_dir,
+                                               {}, 'shell')
+
+        # the directive runs the export (and what follows) itself
+        self.assertEqual(executed, 1)
+        self.assertEqual(len(stored), 1)
+
+
+class TestPreExecutor(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory(prefix='qiime2-test-temp-')
+        self.cache_dir = os.path.join(self.test_dir.name, 'cache')
+        self.root = os.path.join(self.test_dir.name, 'preexec')
+        self.block = extract_blocks(
+            iter_directives(SOURCE, ('command-block',)))[0]
+        self.executor = PreExecutor(2)
+
+    def tearDown(self):
+        self.executor.terminate()
+        self.test_dir.cleanup()
+
+    def _submit(self, commands, depends_on=()):
+        blocks = [self.block._replace(commands=commands)]
+        return self.executor.submit((blocks, self.root, self.cache_dir, {}),
+                                    depends_on)
+
+    def test_waits_for_dependencies(self):
+        prefetch = concurrent.futures.Future()
+        future = self._submit(['echo done > done.txt'], [prefetch])
+
+        time.sleep(0.2)
+        self.assertFalse(future.done())
+        prefetch.set_result(None)
+        executed, _, _ = future.result(timeout=60)
+        self.assertEqual(executed, 1)
+
+    def test_error(self):
+        blocks = [self.block]
+        future = self.executor.submit((blocks, self.root, self.cache_dir, {},
+                                       'no-such-backend'))
+        with self.assertRaisesRegex(RuntimeError, 'no-such-backend'):
+            future.result(timeout=60)
+
+    def test_terminate_kills_workers(self):
+        future = self._submit(['sleep 60'])
+        deadline = time.monotonic() + 60
+        while not os.path.exists(self.root) and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        start = time.monotonic()
+        self.executor.terminate()
+        self.assertLess(time.monotonic() - start, 10)
+        self.assertFalse(os.path.exists(self.root))
+        with self.assertRaises(RuntimeError):
+            future.result(timeout=10)
+
+    def test_terminate_before_start(self):
+        prefetch = concurrent.futures.Future()
+        future = self._submit(['echo done > done.txt'], [prefetch])
+        self.executor.terminate()
+        prefetch.set_result(None)
+
+        with self.assertRaises(concurrent.futures.CancelledError):
+            future.result(timeout=10)
+        self.assertFalse(os.path.exists(self.root))
+
+
+if __name__ == '__main__':
+    unittest.main()
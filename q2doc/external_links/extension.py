@@ -6,26 +6,10 @@
 # The full license is in the file LICENSE, distributed with this software.
 # ----------------------------------------------------------------------------
 
-import os
-import pathlib
-import pkg_resources
-
-from sphinx.util.fileutil import copy_asset
-
-
-def copy_asset_files(app, pagename, templatename, context, doctree):
-    base_fp = pkg_resources.resource_filename('q2doc', 'external_links')
-    asset_path = pathlib.Path(base_fp) / 'assets'
-
-    for path in asset_path.glob('*.js'):
-        copy_asset(str(path), os.path.join(app.outdir, '_static'))
-        app.add_js_file(str(path.name))
-
-    for path in asset_path.glob('*.css'):
-        copy_asset(str(path), os.path.join(app.outdir, '_static'))
-        app.add_css_file(str(path.name))
+from q2doc.assets import add_assets
 
 
 def setup(app):
-    app.connect('html-page-context', copy_asset_files)
+    app.setup_extension('q2doc.assets')
+    add_assets(app, 'external_links')
     return {'version': '0.0.1'}
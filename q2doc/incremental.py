@@ -0,0 +1,179 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import hashlib
+import json
+import os
+import shutil
+
+from sphinx.util import logging
+
+from q2doc.sources import iter_directives, read_source, scan_scopes
+from q2doc.util import (connect_doc_state, doc_state, installed_versions,
+                        plugin_distribution)
+
+
+EXECUTING_DIRECTIVES = ('usage', 'usage-scope', 'command-block', 'download')
+BUILTIN_COMMANDS = ('tools', 'dev', 'info')
+
+
+logger = logging.getLogger(__name__)
+
+
+def directive_hash(env, docname):
+    """Hash of the executable content of a document, ignoring its prose."""
+    hasher = hashlib.sha256()
+    for directive in iter_directives(read_source(env, docname),
+                                     EXECUTING_DIRECTIVES):
+        payload = [directive.name, directive.argument,
+                   sorted(directive.options.items()), directive.content]
+        hasher.update(json.dumps(payload).encode('utf-8'))
+    return hasher.hexdigest()
+
+
+def get_record(env, docname=None):
+    """The dependency record of a document that executes examples."""
+    return doc_state(env, 'q2doc_deps', docname,
+                     lambda: {'hash': None, 'scope': None, 'versions': {}})
+
+
+def note_plugin(env, plugin_name=None):
+    """Record that the current document executes the given plugin.
+
+    Without a `plugin_name` only the framework and q2cli are recorded. When
+    the plugin's distribution can't be determined every installed plugin is
+    recorded, so that any upgrade re-executes the document.
+    """
+    versions = installed_versions()
+    names = ['qiime2', 'q2cli']
+    if plugin_name is not None:
+        dist = plugin_distribution(plugin_name)
+        names.extend([dist] if dist is not None else versions)
+
+    record = get_record(env)
+    for name in names:
+        record['versions'][name] = versions.get(name)
+
+
+def note_command(env, command):
+    tokens = command.split()
+    if tokens[:1] != ['qiime']:
+        return
+    if len(tokens) < 2 or tokens[1].startswith('-') \
+            or tokens[1] in BUILTIN_COMMANDS:
+        note_plugin(env)
+    else:
+        note_plugin(env, tokens[1])
+
+
+def record_hash(app, doctree):
+    env = app.env
+    if env.docname in getattr(env, 'q2doc_deps', {}):
+        get_record(env)['hash'] = directive_hash(env, env.docname)
+
+
+def _purge_data_dir(outdir, docname, docnames):
+    data_dir = os.path.join(outdir, 'data', docname)
+    if not os.path.isdir(data_dir):
+        return
+
+    # leave the data of any nested documents (e.g. `foo` and `foo/bar`) be
+    prefix = docname + '/'
+    nested = {other[len(prefix):].split('/')[0] for other in docnames
+              if other.startswith(prefix)}
+    for entry in os.scandir(data_dir):
+        if entry.name in nested:
+            continue
+        if entry.is_dir(follow_symlinks=False):
+            shutil.rmtree(entry.path)
+        else:
+            os.remove(entry.path)
+
+
+def purge_data_dir(app, env, docname):
+    # the document will either be re-executed or is gone, so its previously
+    # published outputs are stale (unless a preview may still link to them)
+    if not getattr(app.config, 'usage_preview', False):
+        _purge_data_dir(app.outdir, docname, env.found_docs)
+
+
+def _members(scopes, scope, removed):
+    return [docname for docname, other_scope in scopes.items()
+            if other_scope == scope and docname not in removed]
+
+
+def get_outdated(app, env, added, changed, removed):
+    deps = getattr(env, 'q2doc_deps', {})
+    versions = installed_versions()
+
+    # documents which executed plugins that have since been up/downgraded
+    stale = {docname for docname, record in deps.items()
+             if docname not in removed and
+             any(versions.get(name) != version
+                 for name, version in record['versions'].items())}
+    reread = set(added) | set(changed) | stale
+
+    previous_scopes = {docname: record['scope']
+                       for docname, record in deps.items()
+                       if record['scope'] is not None}
+    scopes = dict(previous_scopes)
+    scopes.update(scan_scopes(env, reread))
+
+    # a document re-executing different examples than last time changes the
+    # scope state seen by every document after it in the scope
+    invalidating = {docname for docname in reread
+                    if docname in stale or
+                    deps.get(docname, {}).get('hash') !=
+                    directive_hash(env, docname)}
+    invalidating.update(docname for docname in removed if docname in scopes)
+
+    pending = list(reread | invalidating)
+    while pending:
+        docname = pending.pop()
+        scope = scopes.get(docname)
+        required = []
+        if scope is not None:
+            members = _members(scopes, scope, removed)
+            # scope state only lives in memory, so re-executing a document
+            # means re-executing the documents before it in its scope as
+            # well
+            required = [other for other in members if other < docname]
+            if docname in invalidating:
+                required.extend(other for other in members if other > docname)
+
+        # a document which left its scope changes the state seen by the
+        # documents after it in the scope it left
+        previous_scope = previous_scopes.get(docname)
+        if docname in invalidating and previous_scope not in (None, scope):
+            required.extend(other for other
+                            in _members(scopes, previous_scope, removed)
+                            if other > docname)
+
+        for other in required:
+            if other not in reread:
+                reread.add(other)
+                pending.append(other)
+
+    outdated = reread - set(added) - set(changed)
+    if outdated:
+        logger.info('q2doc: re-executing %d document(s) with outdated '
+                    'examples' % len(outdated))
+    return sorted(outdated)
+
+
+def setup(app):
+    app.connect('env-get-outdated', get_outdated)
+    connect_doc_state(app, 'q2doc_deps')
+    app.connect('env-purge-doc', purge_data_dir)
+    app.connect('doctree-read', record_hash)
+
+    return {
+        'version': '0.0.1',
+        'parallel_read_safe': True,
+        'parallel_write_safe': True,
+    }
@@ -1,29 +1,176 @@
 import os
+import ast
 import types
+import pickle
 import inspect
 import importlib
-
-from qiime2 import __version__
+import importlib.metadata
+import importlib.util
+import functools
 
 from sphinx.ext.linkcode import setup as linkcode_setup
 
 
-if '+' in __version__:
-    tag, local = __version__.split('+')
-    q2ref = local.split('.')[1][1:]
-elif 'dev' in __version__:
-    q2ref = 'dev'
-else:
-    q2ref = __version__
+def git_ref(version):
+    if '+' in version:
+        tag, local = version.split('+')
+        return local.split('.')[1][1:]
+    elif 'dev' in version:
+        return 'dev'
+    else:
+        return version
+
+
+@functools.lru_cache(maxsize=None)
+def get_q2ref():
+    # imported lazily, as importing qiime2 slows down sphinx's startup
+    from qiime2 import __version__
+
+    return git_ref(__version__)
+
+
+def _github_url(repo, ref):
+    def url(rel, line):
+        anchor = f'#L{line + 1}' if line is not None else ''
+        return f'{repo}/tree/{ref()}/{rel}{anchor}'
+    return url
+
 
 URLS = {
-    'qiime2': lambda rel, line: (
-        f'https://github.com/qiime2/qiime2/tree/'
-        f'{q2ref}/{rel}{f"#L{line + 1}" if line is not None else ""}'
-    )
+    'qiime2': _github_url('https://github.com/qiime2/qiime2', get_q2ref),
 }
 
 
+@functools.lru_cache(maxsize=None)
+def plugin_urls():
+    """URL builders for the packages of installed QIIME 2 plugins which are
+    hosted on GitHub, keyed by their root package."""
+    urls = {}
+    # through the distributions, as neither entry_points(group=...) nor
+    # EntryPoint.dist are available before Python 3.10
+    for dist in importlib.metadata.distributions():
+        plugins = [entry_point for entry_point in dist.entry_points
+                   if entry_point.group == 'qiime2.plugins']
+        if not plugins:
+            continue
+        candidates = [dist.metadata.get('Home-page') or '']
+        candidates += [url.split(',')[-1].strip() for url in
+                       dist.metadata.get_all('Project-URL') or []]
+        repo = next((url.rstrip('/') for url in candidates
+                     if url.startswith('https://github.com/')), None)
+        if repo is None:
+            continue
+        for entry_point in plugins:
+            root = entry_point.value.split(':')[0].split('.')[0]
+            urls[root] = _github_url(
+                repo, functools.partial(git_ref, dist.version))
+    return urls
+
+
+def get_url(root):
+    if root in URLS:
+        return URLS[root]
+    return plugin_urls().get(root)
+
+
+def _definitions(tree):
+    """Map the qualified names of the classes and functions defined in a
+    module to their (0-based) first line, as `inspect.findsource` would."""
+    lines = {}
+
+    def visit(body, prefix):
+        for node in body:
+            if isinstance(node, (ast.ClassDef, ast.FunctionDef,
+                                 ast.AsyncFunctionDef)):
+                qualname = prefix + node.name
+                lines[qualname] = min(
+                    [node.lineno] +
+                    [decorator.lineno for decorator in node.decorator_list]
+                ) - 1
+                if isinstance(node, ast.ClassDef):
+                    visit(node.body, qualname + '.')
+                else:
+                    visit(node.body, qualname + '.<locals>.')
+            else:
+                # definitions nested in if/try/with blocks
+                for field in ('body', 'orelse', 'finalbody'):
+                    visit(getattr(node, field, []), prefix)
+                for handler in getattr(node, 'handlers', []):
+                    visit(handler.body, prefix)
+
+    visit(tree.body, '')
+    return lines
+
+
+class SourceIndex:
+    """Definition lines of the modules of a package, found by parsing their
+    source once. Files are parsed lazily and only parsed again when their
+    size or mtime changed, so an index can be kept between builds."""
+    def __init__(self, package_dir):
+        self.package_dir = package_dir
+        self.base_dir = os.path.dirname(package_dir)
+        # relpath -> ((size, mtime_ns), {qualname: line})
+        self.files = {}
+
+    def module_relpath(self, module_name):
+        parts = module_name.split('.')[1:]
+        candidates = [os.path.join(*parts, '__init__.py')]
+        if parts:
+            candidates.append(os.path.join(*parts) + '.py')
+        for candidate in candidates:
+            path = os.path.join(self.package_dir, candidate)
+            if os.path.isfile(path):
+                return os.path.relpath(path, self.base_dir)
+        return None
+
+    def definitions(self, relpath):
+        path = os.path.join(self.base_dir, relpath)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return {}
+        signature = (stat.st_size, stat.st_mtime_ns)
+
+        cached = self.files.get(relpath)
+        if cached is None or cached[0] != signature:
+            try:
+                with open(path, 'rb') as fh:
+                    lines = _definitions(ast.parse(fh.read(), path))
+            except (SyntaxError, ValueError):
+                lines = {}
+            cached = self.files[relpath] = (signature, lines)
+        return cached[1]
+
+    def lookup(self, module_name, qualname):
+        relpath = self.module_relpath(module_name)
+        if relpath is None:
+            return None
+        line = self.definitions(relpath).get(qualname)
+        if line is None:
+            return None
+        return relpath, line
+
+
+_indexes = {}
+
+
+def _package_dir(root):
+    try:
+        spec = importlib.util.find_spec(root)
+        return spec.submodule_search_locations[0]
+    except Exception:
+        return None
+
+
+def get_index(root):
+    if root not in _indexes:
+        package_dir = _package_dir(root)
+        if package_dir is None:
+            return None
+        _indexes[root] = SourceIndex(package_dir)
+    return _indexes[root]
+
+
 def find_object(module, path: list):
     while path and (component := path.pop(0)):
         element = getattr(module, component, None)
@@ -44,34 +191,26 @@ def find_object(module, path: list):
     return module, element
 
 
-def linkcode_resolve(domain, info):
-    if domain != 'py':
-        return None
-
-    module_name = info['module']
-    fullname = info['fullname']
+def _locate_by_import(module_name, fullname):
+    """Find where an object is defined by importing it, for objects that are
+    re-exported, inherited or otherwise not defined where documented."""
     try:
         module = importlib.import_module(module_name)
     except Exception:
         return None
 
-    root = module_name.split('.')[0]
-    if root not in URLS:
-        return None
-
-    try:
-        root_dir = os.path.join(
-            os.path.dirname(importlib.import_module(root).__file__),
-            '..'  # one more directory up from the base init
-        )
-    except Exception:
-        return None
-
-    path = fullname.split('.')
-    module, element = find_object(module, path)
+    module, element = find_object(module, fullname.split('.'))
     if element is None:
         return None
 
+    defined_in = getattr(element, '__module__', None)
+    qualname = getattr(element, '__qualname__', None)
+    if defined_in and qualname:
+        index = get_index(defined_in.split('.')[0])
+        location = index.lookup(defined_in, qualname) if index else None
+        if location is not None:
+            return defined_in.split('.')[0], location
+
     try:
         file = inspect.getsourcefile(element)
         assert file is not None
@@ -83,11 +222,66 @@ def linkcode_resolve(domain, info):
     except Exception:
         line = None
 
-    relpath = os.path.relpath(file, root_dir)
+    root = module_name.split('.')[0]
+    index = get_index(root)
+    if index is None:
+        return None
+    return root, (os.path.relpath(file, index.base_dir), line)
+
+
+def linkcode_resolve(domain, info):
+    if domain != 'py':
+        return None
+
+    module_name = info['module']
+    fullname = info['fullname']
+    root = module_name.split('.')[0]
+    if get_url(root) is None:
+        return None
+
+    index = get_index(root)
+    if index is None:
+        return None
+
+    location = index.lookup(module_name, fullname)
+    if location is None:
+        found = _locate_by_import(module_name, fullname)
+        if found is None:
+            return None
+        root, location = found
+
+    url = get_url(root)
+    if url is None:
+        return None
+    return url(*location)
+
+
+def _index_path(app):
+    return os.path.join(app.doctreedir, 'linkcode-index.pickle')
+
+
+def load_indexes(app):
+    try:
+        with open(_index_path(app), 'rb') as fh:
+            indexes = pickle.load(fh)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return
+    # packages installed elsewhere since (e.g. reinstalled in another
+    # environment) are indexed again
+    _indexes.update({root: index for root, index in indexes.items()
+                     if index.package_dir == _package_dir(root)})
+
 
-    return URLS[root](relpath, line)
+def save_indexes(app, exception):
+    if exception is not None or not _indexes:
+        return
+    os.makedirs(app.doctreedir, exist_ok=True)
+    with open(_index_path(app), 'wb') as fh:
+        pickle.dump(_indexes, fh, pickle.HIGHEST_PROTOCOL)
 
 
 def setup(app):
     app.config['linkcode_resolve'] = linkcode_resolve
+    app.connect('builder-inited', load_indexes)
+    app.connect('build-finished', save_indexes)
     return linkcode_setup(app)
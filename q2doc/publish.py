@@ -0,0 +1,118 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import collections
+import os
+import shutil
+
+from sphinx.util import logging
+
+from q2doc.trace import note_output
+from q2doc.util import connect_doc_state, doc_state, read_docs
+
+try:
+    import fcntl
+except ImportError:  # not on POSIX
+    fcntl = None
+
+
+# linux/fs.h: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+
+Published = collections.namedtuple('Published', ['size', 'written'])
+
+
+logger = logging.getLogger(__name__)
+
+
+def _reflink(src, dest):
+    if fcntl is None:
+        raise OSError('reflinks are not supported on this platform')
+    with open(src, 'rb') as src_fh, open(dest, 'wb') as dest_fh:
+        fcntl.ioctl(dest_fh.fileno(), FICLONE, src_fh.fileno())
+
+
+def publish_file(src, dest, link=True):
+    """Place a copy of `src` at `dest`, sharing storage when possible.
+
+    A copy-on-write reflink is tried first, then a hardlink (both need `src`
+    and `dest` to be on the same filesystem), before falling back to an
+    actual copy. Hardlinks are not used without `link`, for copies which
+    may be modified in place. Returns the file's size and the number of
+    bytes written.
+    """
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    if os.path.lexists(dest):
+        os.remove(dest)
+    size = os.path.getsize(src)
+
+    try:
+        _reflink(src, dest)
+        return Published(size=size, written=0)
+    except OSError:
+        if os.path.lexists(dest):
+            os.remove(dest)
+
+    if link:
+        try:
+            os.link(src, dest)
+            return Published(size=size, written=0)
+        except OSError:
+            pass
+
+    shutil.copyfile(src, dest)
+    return Published(size=size, written=size)
+
+
+def publish_tree(src, dest):
+    size = written = 0
+    for dirpath, _, filenames in os.walk(src):
+        reldir = os.path.relpath(dirpath, src)
+        os.makedirs(os.path.join(dest, reldir), exist_ok=True)
+        for filename in filenames:
+            published = publish_file(os.path.join(dirpath, filename),
+                                     os.path.join(dest, reldir, filename))
+            size += published.size
+            written += published.written
+    return Published(size=size, written=written)
+
+
+def note_published(env, published):
+    """Add to the current document's tally of published output bytes."""
+    note_output(published.size)
+    tally = doc_state(env, 'q2doc_published',
+                      default=lambda: {'size': 0, 'written': 0})
+    tally['size'] += published.size
+    tally['written'] += published.written
+
+
+def report_published(app, exception):
+    if exception is not None:
+        return
+    published = getattr(app.env, 'q2doc_published', {})
+    totals = [published[docname] for docname in read_docs(app)
+              if docname in published]
+    if not totals:
+        return
+
+    size = sum(tally['size'] for tally in totals)
+    written = sum(tally['written'] for tally in totals)
+    logger.info('q2doc: published %.1f MiB of outputs, %.1f MiB written' %
+                (size / 1024 ** 2, written / 1024 ** 2))
+
+
+def setup(app):
+    connect_doc_state(app, 'q2doc_published')
+    app.connect('build-finished', report_published)
+
+    return {
+        'version': '0.0.1',
+        'parallel_read_safe': True,
+        'parallel_write_safe': True,
+    }
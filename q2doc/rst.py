@@ -0,0 +1,48 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import functools
+
+import docutils.frontend
+import docutils.parsers.rst
+import docutils.readers.standalone
+import docutils.utils
+import docutils.writers.null
+
+
+@functools.lru_cache(maxsize=None)
+def _components():
+    parser = docutils.parsers.rst.Parser()
+    reader = docutils.readers.standalone.Reader(parser=parser)
+    writer = docutils.writers.null.Writer()
+    return parser, reader, writer
+
+
+@functools.lru_cache(maxsize=None)
+def _settings():
+    components = _components()
+    try:
+        return docutils.frontend.get_default_settings(*components)
+    except AttributeError:  # docutils < 0.19
+        return docutils.frontend.OptionParser(
+            components=components).get_default_values()
+
+
+def parse_rst(text, source_path='<string>'):
+    """Parse generated reStructuredText into a doctree.
+
+    This is equivalent to ``docutils.core.publish_doctree(text)``, but the
+    parser and the (expensive to build) settings are shared between calls
+    instead of being set up anew for every snippet.
+    """
+    parser, reader, writer = _components()
+    document = docutils.utils.new_document(source_path, _settings())
+    parser.parse(text, document)
+    document.transformer.populate_from_components((reader, parser, writer))
+    document.transformer.apply_transforms()
+    return document
@@ -0,0 +1,126 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import collections
+import re
+import textwrap
+
+
+DIRECTIVE_RE = re.compile(r'^(?P<indent>\s*)\.\.\s+(?P<name>[\w-]+)::'
+                          r'(?:\s+(?P<argument>.*?))?\s*$')
+OPTION_RE = re.compile(r'^:(?P<key>[^:]+):(?:\s+(?P<value>.*?))?\s*$')
+# explicit markup other than directives, targets, substitution definitions,
+# footnotes and citations
+COMMENT_RE = re.compile(r'^\s*\.\.(\s+[^\s_|\[]|\s*$)')
+# directives whose content is not reStructuredText
+LITERAL_DIRECTIVES = ('code-block', 'code', 'sourcecode', 'parsed-literal',
+                      'raw', 'math')
+
+
+Directive = collections.namedtuple(
+    'Directive', ['name', 'argument', 'options', 'content', 'lineno'])
+
+
+def _indent_of(line):
+    return len(line) - len(line.lstrip())
+
+
+def _block_end(lines, i, indent):
+    """The index of the first line from `i` on which is not part of a block
+    indented more than `indent`."""
+    while i < len(lines):
+        line = lines[i]
+        if line.strip() and _indent_of(line) <= indent:
+            break
+        i += 1
+    return i
+
+
+def iter_directives(text, names):
+    """Find the given directives in reStructuredText source, without parsing.
+
+    This is a light-weight scan used to plan work before Sphinx reads a
+    document, so it only understands explicit markup blocks: the directive
+    line, its field-list options and its indented content. Directives
+    which Sphinx would not run, as they are in comments, literal blocks or
+    the content of literal directives (e.g. code-block), are skipped.
+    """
+    lines = text.splitlines()
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        match = DIRECTIVE_RE.match(line)
+        if match is None:
+            # an empty comment followed by a blank line has no content
+            empty = line.strip() == '..' and not (
+                i + 1 < len(lines) and lines[i + 1].strip())
+            if (COMMENT_RE.match(line) and not empty
+                    or line.rstrip().endswith('::')):
+                i = _block_end(lines, i + 1, _indent_of(line))
+            else:
+                i += 1
+            continue
+        if match.group('name') in LITERAL_DIRECTIVES:
+            i = _block_end(lines, i + 1, len(match.group('indent')))
+            continue
+        if match.group('name') not in names:
+            i += 1
+            continue
+
+        lineno = i + 1
+        indent = len(match.group('indent'))
+        start = i + 1
+        i = _block_end(lines, start, indent)
+        block = lines[start:i]
+
+        block = textwrap.dedent('\n'.join(block)).split('\n')
+        options = {}
+        while block and (option := OPTION_RE.match(block[0])):
+            block.pop(0)
+            # a value may continue on the lines indented below its field
+            # name, which docutils joins with newlines
+            value = [option.group('value') or '']
+            while block and block[0].strip() and _indent_of(block[0]) > 0:
+                value.append(block.pop(0).strip())
+            options[option.group('key')] = '\n'.join(value).strip()
+
+        content = '\n'.join(block).strip('\n')
+        content = content.split('\n') if content else []
+
+        yield Directive(name=match.group('name'),
+                        argument=match.group('argument') or '',
+                        options=options,
+                        content=content,
+                        lineno=lineno)
+
+
+def read_source(env, docname):
+    try:
+        with open(env.doc2path(docname),
+                  encoding=env.config.source_encoding) as fh:
+            return fh.read()
+    except OSError:
+        return ''
+
+
+def scan_scopes(env, docnames):
+    """Map each document with usage examples to the usage scope it is in."""
+    scopes = {}
+    for docname in docnames:
+        scope_name = docname
+        has_usage = False
+        for directive in iter_directives(read_source(env, docname),
+                                         ('usage', 'usage-scope')):
+            if directive.name == 'usage-scope':
+                scope_name = directive.options.get('name', docname)
+            else:
+                has_usage = True
+                break
+        if has_usage:
+            scopes[docname] = scope_name
+    return scopes
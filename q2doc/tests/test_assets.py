@@ -0,0 +1,116 @@
+import gzip
+import hashlib
+import os
+import pathlib
+import tempfile
+import types
+import unittest
+import unittest.mock
+
+from q2doc.assets import install_asset, install_assets
+
+
+SCRIPT = '''\
+// toggles the interface tabs
+function select(name) {
+    return name;
+}
+'''
+
+
+class TestInstallAsset(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory(prefix='qiime2-test-temp-')
+        self.static_dir = os.path.join(self.test_dir.name, '_static')
+        os.makedirs(self.static_dir)
+        self.path = self._write('usage.js', SCRIPT)
+
+    def tearDown(self):
+        self.test_dir.cleanup()
+
+    def _write(self, name, content):
+        path = pathlib.Path(self.test_dir.name) / name
+        path.write_text(content)
+        return path
+
+    def test_fingerprinted_name(self):
+        name = install_asset(self.path, self.static_dir)
+
+        fingerprint = hashlib.sha256(SCRIPT.encode('utf-8')).hexdigest()[:12]
+        self.assertEqual(name, 'usage.%s.js' % fingerprint)
+        with open(os.path.join(self.static_dir, name)) as fh:
+            self.assertEqual(fh.read(), SCRIPT)
+
+        # the name changes with the content, including when minified
+        self._write('usage.js', SCRIPT + '\n')
+        self.assertNotEqual(install_asset(self.path, self.static_dir), name)
+        self.assertNotEqual(
+            install_asset(self.path, self.static_dir, minified=True), name)
+
+    def test_minified(self):
+        name = install_asset(self.path, self.static_dir, minified=True)
+
+        with open(os.path.join(self.static_dir, name)) as fh:
+            self.assertEqual(fh.read(),
+                             'function select(name) {\nreturn name;\n}\n')
+
+    def test_compressed(self):
+        name = install_asset(self.path, self.static_dir, compressed=True)
+
+        with gzip.open(os.path.join(self.static_dir, name + '.gz'),
+                       'rt') as fh:
+            self.assertEqual(fh.read(), SCRIPT)
+
+    def test_reuses_installed(self):
+        name = install_asset(self.path, self.static_dir, compressed=True)
+
+        with unittest.mock.patch('q2doc.assets._write') as write:
+            self.assertEqual(
+                install_asset(self.path, self.static_dir, compressed=True),
+                name)
+        write.assert_not_called()
+
+
+class TestInstallAssets(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory(prefix='qiime2-test-temp-')
+        self.outdir = os.path.join(self.test_dir.name, 'html')
+        self.assets = []
+        for name in ('usage.js', 'usage.css'):
+            path = pathlib.Path(self.test_dir.name) / name
+            path.write_text('/* %s */\n' % name)
+            self.assets.append(path)
+        self.added = []
+
+    def tearDown(self):
+        self.test_dir.cleanup()
+
+    def _app(self, format='html'):
+        return types.SimpleNamespace(
+            builder=types.SimpleNamespace(format=format),
+            outdir=self.outdir,
+            q2doc_assets=self.assets,
+            config=types.SimpleNamespace(q2doc_assets_minify=False,
+                                         q2doc_assets_compress=False),
+            add_js_file=lambda name: self.added.append(('js', name)),
+            add_css_file=lambda name: self.added.append(('css', name)))
+
+    def test_references_installed_names(self):
+        install_assets(self._app())
+
+        static_dir = os.path.join(self.outdir, '_static')
+        self.assertEqual([kind for kind, _ in self.added], ['js', 'css'])
+        self.assertEqual(sorted(name for _, name in self.added),
+                         sorted(os.listdir(static_dir)))
+        for (_, name), path in zip(self.added, self.assets):
+            self.assertRegex(name, r'^usage\.[0-9a-f]{12}%s$' % path.suffix)
+
+    def test_not_html(self):
+        install_assets(self._app('latex'))
+
+        self.assertEqual(self.added, [])
+        self.assertFalse(os.path.exists(self.outdir))
+
+
+if __name__ == '__main__':
+    unittest.main()
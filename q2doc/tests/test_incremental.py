@@ -0,0 +1,96 @@
+import os
+import tempfile
+import types
+import unittest
+import unittest.mock
+
+from q2doc.incremental import directive_hash, get_outdated
+
+
+USAGE = '''\
+.. usage-scope::
+   :name: %s
+
+.. usage::
+
+   use.action(%r)
+'''
+
+
+class FakeEnv:
+    def __init__(self, srcdir):
+        self.srcdir = srcdir
+        self.config = types.SimpleNamespace(source_encoding='utf-8')
+        self.q2doc_deps = {}
+
+    def doc2path(self, docname):
+        return os.path.join(self.srcdir, docname + '.rst')
+
+
+class TestGetOutdated(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory(prefix='qiime2-test-temp-')
+        self.env = FakeEnv(self.test_dir.name)
+        self.versions = {'qiime2': '2023.5.0', 'q2-dummy': '1.0'}
+        # two scopes, of three and two documents
+        for docname, scope in [('a1', 'a'), ('a2', 'a'), ('a3', 'a'),
+                               ('b1', 'b'), ('b2', 'b')]:
+            self._write(docname, scope, docname)
+            self.env.q2doc_deps[docname] = {
+                'hash': directive_hash(self.env, docname),
+                'scope': scope,
+                'versions': {'q2-dummy': '1.0'},
+            }
+
+    def tearDown(self):
+        self.test_dir.cleanup()
+
+    def _write(self, docname, scope, action):
+        with open(self.env.doc2path(docname), 'w') as fh:
+            fh.write(USAGE % (scope, action))
+
+    def _outdated(self, added=(), changed=(), removed=()):
+        with unittest.mock.patch('q2doc.incremental.installed_versions',
+                                 return_value=self.versions):
+            return get_outdated(None, self.env, set(added), set(changed),
+                                set(removed))
+
+    def test_nothing_changed(self):
+        self.assertEqual(self._outdated(), [])
+
+    def test_prose_change(self):
+        # the examples are the same, so only the scope state the document
+        # needs has to be rebuilt
+        self.assertEqual(self._outdated(changed=['a2']), ['a1'])
+
+    def test_example_change(self):
+        self._write('a2', 'a', 'other')
+        self.assertEqual(self._outdated(changed=['a2']), ['a1', 'a3'])
+
+    def test_first_example_change(self):
+        self._write('a1', 'a', 'other')
+        self.assertEqual(self._outdated(changed=['a1']), ['a2', 'a3'])
+
+    def test_plugin_upgrade(self):
+        self.env.q2doc_deps['b2']['versions'] = {'q2-dummy': '0.9'}
+        self.assertEqual(self._outdated(), ['b1', 'b2'])
+
+    def test_removed(self):
+        self.assertEqual(self._outdated(removed=['a2']), ['a1', 'a3'])
+
+    def test_added_to_scope(self):
+        self._write('b3', 'b', 'b3')
+        self.assertEqual(self._outdated(added=['b3']), ['b1', 'b2'])
+
+    def test_moved_to_other_scope(self):
+        self._write('a2', 'b', 'a2')
+        self.assertEqual(self._outdated(changed=['a2']),
+                         ['a1', 'a3', 'b1', 'b2'])
+
+    def test_last_moved_to_other_scope(self):
+        self._write('a3', 'b', 'a3')
+        self.assertEqual(self._outdated(changed=['a3']), ['b1', 'b2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
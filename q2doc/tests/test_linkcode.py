@@ -0,0 +1,113 @@
+import ast
+import os
+import pickle
+import tempfile
+import textwrap
+import types
+import unittest
+
+from q2doc import linkcode
+from q2doc.linkcode import SourceIndex, _definitions, load_indexes
+
+
+SOURCE = textwrap.dedent('''\
+    import functools
+
+
+    def plain():
+        def inner():
+            pass
+
+
+    @functools.lru_cache()
+    @functools.wraps(plain)
+    def decorated():
+        pass
+
+
+    class Outer:
+        attribute = 1
+
+        class Inner:
+            def method(self):
+                pass
+
+        @property
+        def prop(self):
+            pass
+
+
+    try:
+        from fast import impl
+    except ImportError:
+        def impl():
+            pass
+    else:
+        pass
+    finally:
+        pass
+
+    if True:
+        class Conditional:
+            pass
+    else:
+        class Conditional:
+            pass
+    ''')
+
+
+class TestDefinitions(unittest.TestCase):
+    def setUp(self):
+        self.lines = _definitions(ast.parse(SOURCE))
+
+    def test_functions(self):
+        self.assertEqual(self.lines['plain'], 3)
+        self.assertEqual(self.lines['plain.<locals>.inner'], 4)
+
+    def test_decorated_from_first_decorator(self):
+        self.assertEqual(self.lines['decorated'], 8)
+        self.assertEqual(self.lines['Outer.prop'], 21)
+
+    def test_nested_classes(self):
+        self.assertEqual(self.lines['Outer'], 14)
+        self.assertEqual(self.lines['Outer.Inner'], 17)
+        self.assertEqual(self.lines['Outer.Inner.method'], 18)
+        self.assertNotIn('Outer.attribute', self.lines)
+
+    def test_in_blocks(self):
+        self.assertEqual(self.lines['impl'], 29)
+        # the last definition wins, as it would at runtime
+        self.assertEqual(self.lines['Conditional'], 40)
+
+
+class TestLoadIndexes(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory(prefix='qiime2-test-temp-')
+        self.app = types.SimpleNamespace(doctreedir=self.test_dir.name)
+        linkcode._indexes.clear()
+
+    def tearDown(self):
+        linkcode._indexes.clear()
+        self.test_dir.cleanup()
+
+    def _save(self, indexes):
+        with open(linkcode._index_path(self.app), 'wb') as fh:
+            pickle.dump(indexes, fh)
+
+    def test_current_install(self):
+        package_dir = os.path.dirname(linkcode.__file__)
+        self._save({'q2doc': SourceIndex(package_dir)})
+
+        load_indexes(self.app)
+        self.assertEqual(linkcode._indexes['q2doc'].package_dir, package_dir)
+
+    def test_moved_install(self):
+        self._save({'q2doc': SourceIndex('/gone/site-packages/q2doc'),
+                    'not_installed': SourceIndex('/gone/not_installed')})
+
+        load_indexes(self.app)
+        self.assertEqual(linkcode._indexes, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
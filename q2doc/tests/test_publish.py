@@ -0,0 +1,87 @@
+import errno
+import os
+import tempfile
+import unittest
+import unittest.mock
+
+from q2doc.publish import Published, publish_file, publish_tree
+
+
+def _no_reflink(src, dest):
+    raise OSError(errno.EOPNOTSUPP, 'reflinks are not supported')
+
+
+class TestPublishFile(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory(prefix='qiime2-test-temp-')
+        self.src = os.path.join(self.test_dir.name, 'work', 'table.qza')
+        self.dest = os.path.join(self.test_dir.name, 'out', 'data',
+                                 'table.qza')
+        os.makedirs(os.path.dirname(self.src))
+        with open(self.src, 'w') as fh:
+            fh.write('artifact')
+
+    def tearDown(self):
+        self.test_dir.cleanup()
+
+    def _read(self, path):
+        with open(path) as fh:
+            return fh.read()
+
+    def test_hardlink(self):
+        with unittest.mock.patch('q2doc.publish._reflink', _no_reflink):
+            published = publish_file(self.src, self.dest)
+
+        self.assertEqual(published, Published(size=8, written=0))
+        self.assertTrue(os.path.samefile(self.src, self.dest))
+
+    def test_cross_device_copies(self):
+        cross_device = OSError(errno.EXDEV, 'Invalid cross-device link')
+        with unittest.mock.patch('q2doc.publish._reflink', _no_reflink), \
+                unittest.mock.patch('os.link', side_effect=cross_device) \
+                as link:
+            published = publish_file(self.src, self.dest)
+
+        link.assert_called_once_with(self.src, self.dest)
+        self.assertEqual(published, Published(size=8, written=8))
+        self.assertFalse(os.path.samefile(self.src, self.dest))
+        self.assertEqual(self._read(self.dest), 'artifact')
+
+    def test_without_link(self):
+        published = publish_file(self.src, self.dest, link=False)
+
+        self.assertEqual(published.size, 8)
+        self.assertFalse(os.path.samefile(self.src, self.dest))
+        self.assertEqual(self._read(self.dest), 'artifact')
+
+        # so that modifying the copy leaves the source alone
+        with open(self.dest, 'w') as fh:
+            fh.write('modified')
+        self.assertEqual(self._read(self.src), 'artifact')
+
+    def test_replaces_dest(self):
+        os.makedirs(os.path.dirname(self.dest))
+        with open(self.dest, 'w') as fh:
+            fh.write('stale')
+
+        publish_file(self.src, self.dest)
+
+        self.assertEqual(self._read(self.dest), 'artifact')
+
+    def test_tree(self):
+        src = os.path.dirname(self.src)
+        os.makedirs(os.path.join(src, 'sub'))
+        with open(os.path.join(src, 'sub', 'index.html'), 'w') as fh:
+            fh.write('<html>')
+        dest = os.path.join(self.test_dir.name, 'out', 'tree')
+
+        with unittest.mock.patch('q2doc.publish._reflink', _no_reflink):
+            published = publish_tree(src, dest)
+
+        self.assertEqual(published, Published(size=14, written=0))
+        self.assertEqual(self._read(os.path.join(dest, 'sub', 'index.html')),
+                         '<html>')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import contextlib
+import io
+import unittest
+
+import docutils.core
+
+from q2doc.rst import parse_rst
+
+
+SOURCES = [
+    '''\
+Title
+=====
+
+Some *text* with a footnote [#]_ and a link_.
+
+.. [#] The footnote.
+.. _link: https://qiime2.org
+
+Section
+-------
+
+* item
+''',
+    '''\
+.. note::
+
+   Another footnote [#]_, numbered from 1 again.
+
+.. [#] Its text.
+''',
+    'A broken `reference\n',
+]
+
+
+class TestParseRST(unittest.TestCase):
+    def _parse(self, parse, text):
+        # the broken reference is reported on stderr
+        with contextlib.redirect_stderr(io.StringIO()):
+            return parse(text).pformat()
+
+    def test_same_as_publish_doctree(self):
+        for text in SOURCES:
+            with self.subTest(text=text):
+                self.assertEqual(
+                    self._parse(parse_rst, text),
+                    self._parse(docutils.core.publish_doctree, text))
+
+    def test_no_state_between_calls(self):
+        first = [self._parse(parse_rst, text) for text in SOURCES]
+        document = parse_rst(SOURCES[0])
+        before = document.pformat()
+
+        again = [self._parse(parse_rst, text) for text in reversed(SOURCES)]
+
+        self.assertEqual(first, again[::-1])
+        # nor are earlier documents changed by later calls
+        self.assertEqual(document.pformat(), before)
+
+
+if __name__ == '__main__':
+    unittest.main()
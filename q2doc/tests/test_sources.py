@@ -0,0 +1,137 @@
+import textwrap
+import unittest
+
+from q2doc.sources import iter_directives
+
+
+def _found(text):
+    return [directive.content for directive in iter_directives(
+        textwrap.dedent(text), ('command-block',))]
+
+
+class TestIterDirectives(unittest.TestCase):
+    def test_options_and_content(self):
+        text = textwrap.dedent("""\
+        Title
+        =====
+
+        .. usage-scope::
+           :name: tutorial
+
+        Some prose.
+
+        .. usage::
+
+           use.action(
+               use.UsageAction('dummy_plugin', 'concatenate_ints'),
+           )
+
+        .. note::
+
+           .. usage::
+              :stdout:
+
+              use.peek(ints)
+        """)
+        obs = list(iter_directives(text, ('usage', 'usage-scope')))
+
+        self.assertEqual([d.name for d in obs],
+                         ['usage-scope', 'usage', 'usage'])
+        self.assertEqual(obs[0].options, {'name': 'tutorial'})
+        self.assertEqual(obs[0].content, [])
+        self.assertEqual(obs[1].lineno, 9)
+        self.assertEqual(obs[1].content, [
+            'use.action(',
+            "    use.UsageAction('dummy_plugin', 'concatenate_ints'),",
+            ')',
+        ])
+        self.assertEqual(obs[2].options, {'stdout': ''})
+        self.assertEqual(obs[2].content, ['use.peek(ints)'])
+
+    def test_continued_options(self):
+        text = textwrap.dedent("""\
+        .. download::
+           :url: https://example.com/data/
+              moving-pictures/sample_metadata.tsv
+           :saveas:
+              sample-metadata.tsv
+
+           not an option
+        """)
+        obs, = iter_directives(text, ('download',))
+
+        self.assertEqual(obs.options, {
+            'url': 'https://example.com/data/\n'
+                   'moving-pictures/sample_metadata.tsv',
+            'saveas': 'sample-metadata.tsv',
+        })
+        self.assertEqual(obs.content, ['not an option'])
+
+    def test_nested(self):
+        self.assertEqual(_found('''\
+            .. note::
+
+               .. command-block::
+
+                  echo run
+            '''), [['echo run']])
+
+    def test_comments(self):
+        self.assertEqual(_found('''\
+            .. This is a comment, and so is its block:
+
+               .. command-block::
+
+                  echo commented
+
+            ..
+               .. command-block::
+
+                  echo commented
+
+            .. command-block::
+
+               echo run
+            '''), [['echo run']])
+
+    def test_empty_comment(self):
+        # followed by a blank line, the indented block is a block quote
+        self.assertEqual(_found('''\
+            ..
+
+               .. command-block::
+
+                  echo run
+            '''), [['echo run']])
+
+    def test_targets_are_not_comments(self):
+        self.assertEqual(_found('''\
+            .. _run:
+
+            .. command-block::
+
+               echo run
+            '''), [['echo run']])
+
+    def test_literal_blocks(self):
+        self.assertEqual(_found('''\
+            Write a command block like this::
+
+               .. command-block::
+
+                  echo literal
+
+            .. code-block:: rst
+
+               .. command-block::
+
+                  echo literal
+
+            .. command-block::
+
+               echo run
+            '''), [['echo run']])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,181 @@
+import time
+import types
+import unittest
+
+from q2doc.timings import (cost, directive_key, estimate, finish_document,
+                           format_regressions, longest_first, regressions,
+                           slower)
+from q2doc.trace import directive_digest
+
+
+class TestSchedule(unittest.TestCase):
+    def test_cost(self):
+        self.assertEqual(cost({'duration': 2.0}), 2.0)
+        self.assertEqual(cost({'duration': 2.0, 'preexec': 3.0}), 5.0)
+
+    def test_estimate(self):
+        history = {'a': {'duration': 1.0},
+                   'b': {'duration': 2.0, 'preexec': 4.0},
+                   'c': {'duration': 3.0},
+                   'removed': {'duration': 100.0}}
+
+        costs = estimate(['a', 'b', 'c', 'new'], history)
+        self.assertEqual(costs, {'a': 1.0, 'b': 6.0, 'c': 3.0,
+                                 # the median of the known costs
+                                 'new': 4.5})
+
+    def test_estimate_without_history(self):
+        self.assertEqual(estimate(['a', 'b'], {}), {'a': 0.0, 'b': 0.0})
+
+    def test_longest_first(self):
+        costs = {'a': 1.0, 'b': 5.0, 'c': 1.0, 'd': 3.0}
+        self.assertEqual(longest_first(['a', 'b', 'c', 'd'], costs),
+                         ['b', 'd', 'a', 'c'])
+
+
+class TestSlower(unittest.TestCase):
+    def test_slower(self):
+        history = {
+            'a': {'duration': 10.0,
+                  'directives': {'usage:1': 4.0, 'usage:2': 6.0}},
+            'b': {'duration': 10.0},
+            'c': {'duration': 0.1},
+        }
+        current = {
+            'a': {'duration': 20.0,
+                  'directives': {'usage:1': 12.0, 'usage:2': 8.0}},
+            # within the ratio
+            'b': {'duration': 12.0},
+            # too fast to report
+            'c': {'duration': 0.5},
+            'new': {'duration': 30.0},
+        }
+
+        self.assertEqual(slower(history, current, 1.25),
+                         [('a', 10.0, 20.0, 'usage:1')])
+
+    def test_ordered_by_growth(self):
+        history = {'a': {'duration': 10.0}, 'b': {'duration': 2.0}}
+        current = {'a': {'duration': 15.0}, 'b': {'duration': 20.0}}
+
+        self.assertEqual([docname for docname, *_
+                          in slower(history, current, 1.25)], ['b', 'a'])
+
+    def test_counts_preexecution(self):
+        history = {'a': {'duration': 2.0, 'preexec': 8.0}}
+        current = {'a': {'duration': 2.0, 'preexec': 20.0}}
+
+        self.assertEqual(slower(history, current, 1.25),
+                         [('a', 10.0, 22.0, None)])
+
+
+class TestFinishDocument(unittest.TestCase):
+    def _finish(self, spans):
+        env = types.SimpleNamespace(docname='doc', q2doc_trace={'doc': spans})
+        app = types.SimpleNamespace(
+            env=env, parallel=1, q2doc_timings=None,
+            q2doc_read_starts={'doc': time.perf_counter() - 10.0})
+        finish_document(app, None)
+        return env.q2doc_timings['doc']
+
+    def test_excludes_preexecution_wait(self):
+        timing = self._finish([
+            {'name': 'wait for pre-execution', 'depth': 1, 'dur': 4.0,
+             'args': {}},
+            {'name': 'command-block', 'depth': 0, 'dur': 5.0,
+             'args': {'lineno': 3, 'digest': 'abc', 'wait': 4.0}},
+        ])
+
+        self.assertGreaterEqual(timing['duration'], 6.0)
+        self.assertLess(timing['duration'], 7.0)
+        self.assertEqual(timing['directives'], {'command-block:abc': 1.0})
+
+    def test_directive_keys(self):
+        timing = self._finish([
+            {'name': 'usage', 'depth': 0, 'dur': 1.0,
+             'args': {'lineno': 3, 'digest': 'abc', 'output_size': 10}},
+            {'name': 'usage', 'depth': 0, 'dur': 2.0,
+             'args': {'lineno': 9, 'digest': 'abc'}},
+        ])
+
+        self.assertEqual(timing['directives'],
+                         {'usage:abc': 1.0, 'usage:abc#2': 2.0})
+        self.assertEqual(timing['output_sizes'], {'usage:abc': 10})
+        self.assertEqual(timing['lines'], {'usage:abc': 3, 'usage:abc#2': 9})
+
+
+class FakeDirective:
+    name = 'command-block'
+    arguments = []
+    options = {'stdout': None, 'timeout': 5}
+    content = ['echo 1']
+
+    def __init__(self, lineno):
+        self.lineno = lineno
+
+
+class TestDirectiveKey(unittest.TestCase):
+    def test_digest_ignores_position(self):
+        self.assertEqual(directive_digest(FakeDirective(3)),
+                         directive_digest(FakeDirective(30)))
+
+        changed = FakeDirective(3)
+        changed.content = ['echo 2']
+        self.assertNotEqual(directive_digest(FakeDirective(3)),
+                            directive_digest(changed))
+
+    def test_occurrences(self):
+        self.assertEqual(directive_key('usage', 'abc', {}), 'usage:abc')
+        self.assertEqual(
+            directive_key('usage', 'abc', {'usage:abc': 1, 'usage:abc#2': 5}),
+            'usage:abc#3')
+
+
+class TestRegressions(unittest.TestCase):
+    MIB = 1024 ** 2
+
+    def setUp(self):
+        self.baseline = {
+            'a': {'directives': {'usage:abc': 10.0, 'usage:def': 10.0},
+                  'output_sizes': {'usage:abc': 10 * self.MIB}},
+            'b': {'directives': {'usage:abc': 0.1}},
+        }
+        self.current = {
+            'a': {'directives': {'usage:abc': 20.0, 'usage:def': 11.0,
+                                 'usage:new': 50.0},
+                  'output_sizes': {'usage:abc': 40 * self.MIB},
+                  'lines': {'usage:abc': 12}},
+            # regressed, but too fast to matter
+            'b': {'directives': {'usage:abc': 0.5}},
+            'new': {'directives': {'usage:abc': 50.0}},
+        }
+
+    def test_regressions(self):
+        self.assertEqual(
+            regressions(self.baseline, self.current, 1.25, 1.25),
+            [('a', 'usage:12', 'time', 10.0, 20.0),
+             ('a', 'usage:12', 'size', 10 * self.MIB, 40 * self.MIB)])
+
+    def test_ratios(self):
+        self.assertEqual(
+            regressions(self.baseline, self.current, 2.5, 1.25),
+            [('a', 'usage:12', 'size', 10 * self.MIB, 40 * self.MIB)])
+
+    def test_format_regressions(self):
+        lines = format_regressions(
+            regressions(self.baseline, self.current, 1.25, 1.25))
+
+        self.assertEqual(lines, [
+            'document  directive  metric  baseline  current   change',
+            'a         usage:12   time    10.0s     20.0s     +100%',
+            'a         usage:12   size    10.0 MiB  40.0 MiB  +300%',
+        ])
+
+    def test_format_zero_baseline(self):
+        self.assertEqual(format_regressions([('a', 'usage:1', 'size', 0,
+                                              2 * self.MIB)])[1],
+                         'a         usage:1    size    0.0 MiB   2.0 MiB  new')
+
+
+if __name__ == '__main__':
+    unittest.main()
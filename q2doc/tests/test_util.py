@@ -0,0 +1,155 @@
+import io
+import os
+import sys
+import tempfile
+import threading
+import types
+import unittest
+import zipfile
+
+from q2doc.util import (capture_output, connect_doc_state, doc_state,
+                        read_docs, zip_tree)
+
+
+class FakeApp:
+    def __init__(self):
+        self.handlers = {}
+
+    def connect(self, event, handler):
+        self.handlers.setdefault(event, []).append(handler)
+
+    def emit(self, event, *args):
+        for handler in self.handlers.get(event, []):
+            handler(self, *args)
+
+
+class TestDocState(unittest.TestCase):
+    def setUp(self):
+        self.app = FakeApp()
+        connect_doc_state(self.app, 'test_docs')
+        connect_doc_state(self.app, 'other_docs')
+        self.env = types.SimpleNamespace(docname='a')
+
+    def test_default(self):
+        state = doc_state(self.env, 'test_docs', default=lambda: {'n': 0})
+        state['n'] += 1
+
+        self.assertEqual(doc_state(self.env, 'test_docs'), {'n': 1})
+        self.assertEqual(doc_state(self.env, 'test_docs', 'b', list), [])
+        self.assertEqual(self.env.test_docs, {'a': {'n': 1}, 'b': []})
+
+    def test_purge(self):
+        doc_state(self.env, 'test_docs')
+        doc_state(self.env, 'test_docs', 'b')
+
+        self.app.emit('env-purge-doc', self.env, 'a')
+
+        self.assertEqual(list(self.env.test_docs), ['b'])
+
+    def test_merge(self):
+        other = types.SimpleNamespace(docname='b')
+        doc_state(other, 'test_docs')['n'] = 1
+        doc_state(other, 'test_docs', 'c')['n'] = 2
+
+        self.app.emit('env-merge-info', self.env, ['b'], other)
+
+        self.assertEqual(self.env.test_docs, {'b': {'n': 1}})
+        self.assertFalse(hasattr(self.env, 'other_docs'))
+
+    def test_read_docs(self):
+        self.assertEqual(read_docs(self.app), [])
+        # recorded once, however many states are connected
+        self.assertEqual(len(self.app.handlers['env-before-read-docs']), 1)
+
+        self.app.emit('env-before-read-docs', self.env, ['a', 'b'])
+
+        self.assertEqual(read_docs(self.app), ['a', 'b'])
+
+
+class TestZipTree(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory(prefix='qiime2-test-temp-')
+        self.root = os.path.join(self.test_dir.name, 'dirfmt')
+        for relpath in ('b.tsv', 'a/data.txt', 'a/z/deep.txt'):
+            path = os.path.join(self.root, relpath)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as fh:
+                fh.write(relpath)
+
+    def tearDown(self):
+        self.test_dir.cleanup()
+
+    def _zip(self, name):
+        fp = os.path.join(self.test_dir.name, name)
+        zip_tree(self.root, fp)
+        with open(fp, 'rb') as fh:
+            return fh.read()
+
+    def test_contents(self):
+        fp = zip_tree(self.root, os.path.join(self.test_dir.name, 'out.zip'))
+
+        with zipfile.ZipFile(fp) as zf:
+            self.assertEqual(zf.namelist(), ['a/', 'b.tsv', 'a/z/',
+                                             'a/data.txt', 'a/z/deep.txt'])
+            self.assertEqual(zf.read('a/z/deep.txt'), b'a/z/deep.txt')
+
+    def test_deterministic(self):
+        first = self._zip('first.zip')
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                os.utime(os.path.join(dirpath, name), (0, 0))
+
+        self.assertEqual(self._zip('second.zip'), first)
+
+
+class TestCaptureOutput(unittest.TestCase):
+    def test_restores_streams(self):
+        stdout, stderr = sys.stdout, sys.stderr
+        out, err = io.StringIO(), io.StringIO()
+
+        with capture_output(out, err):
+            print('to out')
+            print('to err', file=sys.stderr)
+
+        self.assertIs(sys.stdout, stdout)
+        self.assertIs(sys.stderr, stderr)
+        self.assertEqual(out.getvalue(), 'to out\n')
+        self.assertEqual(err.getvalue(), 'to err\n')
+
+    def test_nested(self):
+        outer, inner = io.StringIO(), io.StringIO()
+
+        with capture_output(outer, io.StringIO()):
+            print('a')
+            with capture_output(inner, io.StringIO()):
+                print('b')
+            print('c')
+
+        self.assertEqual(outer.getvalue(), 'a\nc\n')
+        self.assertEqual(inner.getvalue(), 'b\n')
+
+    def test_threads_do_not_interleave(self):
+        outs = [io.StringIO() for _ in range(4)]
+        barrier = threading.Barrier(len(outs))
+
+        def write(index):
+            with capture_output(outs[index], io.StringIO()):
+                # all captures are active at the same time
+                barrier.wait()
+                for _ in range(100):
+                    print(index)
+                barrier.wait()
+
+        threads = [threading.Thread(target=write, args=(index,))
+                   for index in range(len(outs))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for index, out in enumerate(outs):
+            self.assertEqual(out.getvalue(), '%d\n' % index * 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,319 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import collections
+import json
+import os
+import statistics
+import time
+
+from sphinx.util import logging
+
+from q2doc.util import connect_doc_state, doc_state
+
+
+logger = logging.getLogger(__name__)
+
+# documents read faster than this are not worth reporting on
+MIN_SECONDS = 1.0
+# nor are outputs smaller than this
+MIN_BYTES = 1024 ** 2
+
+
+def _collecting(config):
+    return bool(config.q2doc_timings_file or config.q2doc_baseline_file)
+
+
+def format_duration(seconds):
+    seconds = round(seconds)
+    if seconds < 60:
+        return '%ds' % seconds
+    if seconds < 3600:
+        return '%dm %02ds' % divmod(seconds, 60)
+    return '%dh %02dm' % divmod(seconds // 60, 60)
+
+
+def load_timings(path):
+    """The documents' timings recorded by previous builds."""
+    try:
+        with open(path) as fh:
+            return json.load(fh)['documents']
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+def save_timings(path, documents):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as fh:
+        json.dump({'documents': documents}, fh, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def cost(timing):
+    """The time a document took, including its pre-executed commands (but
+    not the time it waited for them)."""
+    return timing['duration'] + timing.get('preexec', 0.0)
+
+
+def estimate(docnames, history):
+    """Map each document to its expected cost, using the median cost of
+    the known documents for the new ones."""
+    known = [cost(history[docname]) for docname in history]
+    default = statistics.median(known) if known else 0.0
+    return {docname: cost(history[docname]) if docname in history
+            else default for docname in docnames}
+
+
+def longest_first(docnames, costs):
+    """Order documents by decreasing cost (longest processing time first),
+    keeping the original order between equally costly documents."""
+    return sorted(docnames, key=lambda docname: -costs[docname])
+
+
+def slower(history, current, ratio):
+    """Documents whose cost grew by more than `ratio`, as tuples of
+    (docname, previous cost, current cost, slowest growing directive)."""
+    slower = []
+    for docname, timing in current.items():
+        if docname not in history:
+            continue
+        old, new = cost(history[docname]), cost(timing)
+        if new < MIN_SECONDS or new <= old * ratio:
+            continue
+        old_directives = history[docname].get('directives', {})
+        growth = {key: duration - old_directives.get(key, 0.0)
+                  for key, duration in timing.get('directives', {}).items()}
+        directive = None
+        if growth:
+            directive = directive_label(timing, max(growth, key=growth.get))
+        slower.append((docname, old, new, directive))
+    slower.sort(key=lambda item: item[2] - item[1], reverse=True)
+    return slower
+
+
+def directive_key(name, digest, keys):
+    """The key of a directive in a document's timings, from the digest of
+    its source rather than its line, which prose added above it changes.
+    Identical directives are told apart by their order, after the `keys`
+    of the directives before them."""
+    key = '%s:%s' % (name, digest)
+    occurrence = 1
+    while key in keys:
+        occurrence += 1
+        key = '%s:%s#%d' % (name, digest, occurrence)
+    return key
+
+
+def directive_label(timing, key):
+    """A directive as its name and line, for reports."""
+    lineno = timing.get('lines', {}).get(key)
+    if lineno is None:
+        return key
+    return '%s:%d' % (key.split(':')[0], lineno)
+
+
+def get_timing(env, docname=None):
+    """The timing of a document being read, stored in the environment so
+    that parallel readers' timings are merged back."""
+    return doc_state(env, 'q2doc_timings', docname,
+                     lambda: {'duration': 0.0})
+
+
+def note_preexecution(env, duration):
+    """Record the time a document's commands took ahead of reading it."""
+    if _collecting(env.config):
+        get_timing(env)['preexec'] = duration
+
+
+def _timings_path(app):
+    return os.path.join(app.confdir, app.config.q2doc_timings_file)
+
+
+def schedule_longest_first(app, env, docnames):
+    app.q2doc_timings = None
+    if not _collecting(app.config):
+        return
+
+    history = {}
+    if app.config.q2doc_timings_file:
+        history = load_timings(_timings_path(app))
+    costs = estimate(docnames, history)
+    docnames[:] = longest_first(docnames, costs)
+
+    total = sum(costs.values())
+    app.q2doc_timings = {'history': history, 'costs': costs,
+                         'remaining': total}
+    if total >= MIN_SECONDS:
+        unknown = sum(docname not in history for docname in docnames)
+        logger.info('q2doc: reading %d documents should take about %s%s'
+                    % (len(docnames),
+                       format_duration(total / max(app.parallel, 1)),
+                       ' (%d without timings)' % unknown if unknown else ''))
+
+
+def start_document(app, docname, source):
+    if _collecting(app.config):
+        if not hasattr(app, 'q2doc_read_starts'):
+            app.q2doc_read_starts = {}
+        app.q2doc_read_starts[docname] = time.perf_counter()
+
+
+def finish_document(app, doctree):
+    env = app.env
+    start = getattr(app, 'q2doc_read_starts', {}).pop(env.docname, None)
+    if start is None:
+        return
+    spans = getattr(env, 'q2doc_trace', {}).get(env.docname, [])
+    timing = get_timing(env)
+    # the time waiting on pre-executed commands is counted in `preexec`
+    waited = sum(span_['args'].get('wait', 0.0) for span_ in spans
+                 if span_['depth'] == 0)
+    timing['duration'] = time.perf_counter() - start - waited
+
+    directives = collections.Counter()
+    output_sizes = collections.Counter()
+    lines = {}
+    for span_ in spans:
+        args = span_['args']
+        if span_['depth'] == 0 and 'digest' in args:
+            key = directive_key(span_['name'], args['digest'], lines)
+            lines[key] = args['lineno']
+            directives[key] += span_['dur'] - args.get('wait', 0.0)
+            output_sizes[key] += args.get('output_size', 0)
+    timing['directives'] = dict(directives)
+    timing['output_sizes'] = {key: size for key, size in output_sizes.items()
+                              if size}
+    timing['lines'] = lines
+
+    # forked readers do not share the estimate, and their output is only
+    # shown once their chunk is done
+    state = app.q2doc_timings
+    if state is None or app.parallel > 1:
+        return
+    state['remaining'] -= state['costs'].get(env.docname, 0.0)
+    if cost(timing) >= MIN_SECONDS and state['remaining'] >= MIN_SECONDS:
+        logger.info('q2doc: read %s in %s, about %s left'
+                    % (env.docname, format_duration(cost(timing)),
+                       format_duration(state['remaining'])))
+
+
+def _current_timings(app, state):
+    timings = getattr(app.env, 'q2doc_timings', {})
+    return {docname: timings[docname] for docname in state['costs']
+            if docname in timings}
+
+
+def regressions(baseline, current, time_ratio, size_ratio):
+    """The directives whose duration or output size grew past the ratios,
+    as tuples of (docname, directive label, metric, baseline, current)."""
+    found = []
+    for docname in sorted(current):
+        if docname not in baseline:
+            continue
+        for metric, field, ratio, minimum in (
+                ('time', 'directives', time_ratio, MIN_SECONDS),
+                ('size', 'output_sizes', size_ratio, MIN_BYTES)):
+            old_values = baseline[docname].get(field, {})
+            for key, new in sorted(current[docname].get(field, {}).items()):
+                old = old_values.get(key)
+                if old is None or new < minimum or new <= old * ratio:
+                    continue
+                found.append((docname,
+                              directive_label(current[docname], key),
+                              metric, old, new))
+    return found
+
+
+def format_regressions(found):
+    """Lines of a table comparing the regressed directives' metrics."""
+    def fmt(metric, value):
+        if metric == 'time':
+            return '%.1fs' % value
+        return '%.1f MiB' % (value / 1024 ** 2)
+
+    rows = [('document', 'directive', 'metric', 'baseline', 'current',
+             'change')]
+    for docname, key, metric, old, new in found:
+        change = '+%.0f%%' % (100 * (new - old) / old) if old else 'new'
+        rows.append((docname, key, metric, fmt(metric, old),
+                     fmt(metric, new), change))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    return ['  '.join(cell.ljust(width) for cell, width in zip(row, widths))
+            .rstrip() for row in rows]
+
+
+def check_regressions(app, exception):
+    state = getattr(app, 'q2doc_timings', None)
+    if (state is None or exception is not None
+            or not app.config.q2doc_baseline_file):
+        return
+    path = os.path.join(app.confdir, app.config.q2doc_baseline_file)
+    if not os.path.exists(path):
+        logger.warning('q2doc: the baseline %s does not exist' % path)
+        return
+
+    found = regressions(load_timings(path), _current_timings(app, state),
+                        app.config.q2doc_regression_time_ratio,
+                        app.config.q2doc_regression_size_ratio)
+    if not found:
+        logger.info('q2doc: no performance regressions against %s' % path)
+        return
+
+    message = ('q2doc: %d performance regressions against %s:\n%s'
+               % (len(found), path, '\n'.join(format_regressions(found))))
+    if app.config.q2doc_regression_action == 'fail':
+        logger.error(message)
+        app.statuscode = 1
+    else:
+        logger.warning(message)
+
+
+def record_timings(app, exception):
+    state = getattr(app, 'q2doc_timings', None)
+    if (state is None or exception is not None
+            or not app.config.q2doc_timings_file):
+        return
+    current = _current_timings(app, state)
+
+    for docname, old, new, directive in slower(
+            state['history'], current, app.config.q2doc_timings_ratio):
+        logger.info('q2doc: %s got slower, %s instead of %s%s'
+                    % (docname, format_duration(new), format_duration(old),
+                       ' (mostly %s)' % directive if directive else ''))
+
+    # documents which were removed are forgotten
+    documents = {docname: timing
+                 for docname, timing in state['history'].items()
+                 if docname in app.env.found_docs}
+    documents.update(current)
+    save_timings(_timings_path(app), documents)
+
+
+def setup(app):
+    app.setup_extension('q2doc.trace')
+
+    # ordered before the handlers planning work in reading order
+    app.connect('env-before-read-docs', schedule_longest_first, priority=400)
+    app.connect('source-read', start_document)
+    app.connect('doctree-read', finish_document)
+    connect_doc_state(app, 'q2doc_timings')
+    app.connect('build-finished', check_regressions)
+    app.connect('build-finished', record_timings)
+
+    app.add_config_value('q2doc_timings_file', None, '')
+    app.add_config_value('q2doc_timings_ratio', 1.25, '')
+    app.add_config_value('q2doc_baseline_file', None, '')
+    app.add_config_value('q2doc_regression_time_ratio', 1.25, '')
+    app.add_config_value('q2doc_regression_size_ratio', 1.25, '')
+    app.add_config_value('q2doc_regression_action', 'warn', '')
+
+    return {
+        'version': '0.0.1',
+        'parallel_read_safe': True,
+        'parallel_write_safe': True,
+    }
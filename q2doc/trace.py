@@ -0,0 +1,182 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import collections
+import contextlib
+import contextvars
+import hashlib
+import json
+import os
+import threading
+import time
+
+from sphinx.util import logging
+
+from q2doc.util import connect_doc_state, doc_state, read_docs
+
+
+logger = logging.getLogger(__name__)
+
+# context variables, rather than thread locals, so that spans opened in the
+# threads of a copied context nest in the span that started them
+_depth = contextvars.ContextVar('q2doc_trace_depth', default=0)
+# the output bytes and the seconds spent waiting on work done elsewhere
+# (e.g. pre-executed commands), tallied for the enclosing top-level span
+_tally = contextvars.ContextVar('q2doc_trace_tally', default=None)
+
+
+def get_spans(env, docname=None):
+    """The spans recorded while reading a document, stored in the
+    environment so that parallel readers' spans are merged back."""
+    return doc_state(env, 'q2doc_trace', docname, list)
+
+
+@contextlib.contextmanager
+def span(env, name, category, **args):
+    """Time the enclosed block as a span of the current document.
+
+    This does nothing unless ``q2doc_trace_file`` (or the timings of
+    ``q2doc_timings_file`` or ``q2doc_baseline_file``, which keep the
+    directives' durations) is configured.
+    """
+    if not (env.config.q2doc_trace_file or env.config.q2doc_timings_file
+            or env.config.q2doc_baseline_file):
+        yield
+        return
+
+    depth = _depth.get()
+    depth_token = _depth.set(depth + 1)
+    if depth == 0:
+        tally = {'output_size': 0, 'wait': 0.0}
+        tally_token = _tally.set(tally)
+    timestamp = time.time()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _depth.reset(depth_token)
+        if depth == 0:
+            _tally.reset(tally_token)
+            args = dict(args, **{key: value for key, value in tally.items()
+                                 if value})
+        get_spans(env).append({
+            'name': name,
+            'cat': category,
+            'ts': timestamp,
+            'dur': time.perf_counter() - start,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'depth': depth,
+            'args': args,
+        })
+
+
+def directive_digest(directive):
+    """A digest of a directive's source, identifying it in the timings of
+    other builds even when prose is added around it."""
+    payload = [directive.name, directive.arguments,
+               sorted(directive.options.items()), list(directive.content)]
+    payload = json.dumps(payload, default=str).encode('utf-8')
+    return hashlib.sha256(payload).hexdigest()[:12]
+
+
+def directive_span(directive):
+    """A top-level span of a running directive."""
+    return span(directive.state.document.settings.env, directive.name,
+                'directive', lineno=directive.lineno,
+                digest=directive_digest(directive))
+
+
+def note_output(size):
+    """Add to the output bytes of the enclosing top-level span."""
+    tally = _tally.get()
+    if tally is not None:
+        tally['output_size'] += size
+
+
+def note_wait(seconds):
+    """Add to the time the enclosing top-level span spent waiting on work
+    which is accounted for separately."""
+    tally = _tally.get()
+    if tally is not None:
+        tally['wait'] += seconds
+
+
+def trace_events(spans_by_doc):
+    """Spans as Chrome trace-event "complete" events (microseconds)."""
+    events = []
+    for docname, spans in spans_by_doc.items():
+        for span_ in spans:
+            events.append({
+                'name': span_['name'],
+                'cat': span_['cat'],
+                'ph': 'X',
+                'ts': round(span_['ts'] * 1e6),
+                'dur': round(span_['dur'] * 1e6),
+                'pid': span_['pid'],
+                'tid': span_['tid'],
+                'args': dict(span_['args'], docname=docname),
+            })
+    events.sort(key=lambda event: event['ts'])
+    return events
+
+
+def summarize(spans_by_doc, top):
+    """Lines reporting the slowest documents and top-level spans."""
+    totals = collections.Counter()
+    directives = []
+    for docname, spans in spans_by_doc.items():
+        for span_ in spans:
+            if span_['depth'] == 0:
+                totals[docname] += span_['dur']
+                directives.append((span_['dur'], docname, span_))
+
+    lines = ['slowest documents:']
+    for docname, duration in totals.most_common(top):
+        lines.append('  %8.2fs  %s' % (duration, docname))
+
+    lines.append('slowest directives:')
+    directives.sort(key=lambda item: item[0], reverse=True)
+    for duration, docname, span_ in directives[:top]:
+        location = docname
+        if 'lineno' in span_['args']:
+            location += ':%d' % span_['args']['lineno']
+        lines.append('  %8.2fs  %s (%s)' % (duration, location, span_['name']))
+    return lines
+
+
+def write_trace(app, exception):
+    if not app.config.q2doc_trace_file or exception is not None:
+        return
+    traced = getattr(app.env, 'q2doc_trace', {})
+    spans_by_doc = {docname: traced[docname] for docname in read_docs(app)
+                    if traced.get(docname)}
+
+    path = os.path.join(app.confdir, app.config.q2doc_trace_file)
+    with open(path, 'w') as fh:
+        json.dump({'traceEvents': trace_events(spans_by_doc),
+                   'displayTimeUnit': 'ms'}, fh)
+    logger.info('q2doc: wrote trace of %d documents to %s'
+                % (len(spans_by_doc), path))
+
+    for line in summarize(spans_by_doc, app.config.q2doc_trace_top):
+        logger.info(line)
+
+
+def setup(app):
+    connect_doc_state(app, 'q2doc_trace')
+    app.connect('build-finished', write_trace)
+
+    app.add_config_value('q2doc_trace_file', None, '')
+    app.add_config_value('q2doc_trace_top', 10, '')
+
+    return {
+        'version': '0.0.1',
+        'parallel_read_safe': True,
+        'parallel_write_safe': True,
+    }
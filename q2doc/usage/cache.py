@@ -0,0 +1,137 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+from qiime2 import Metadata, MetadataColumn
+from qiime2.sdk import Result
+from qiime2.sdk.usage import UsageVariable
+
+from q2doc.util import hash_path, tree_size
+
+
+def digest(value):
+    """A JSON-able, content-based description of an action input."""
+    if isinstance(value, UsageVariable):
+        value = value.execute()
+
+    if isinstance(value, Result):
+        # UUIDs are minted anew whenever an example's factories run, so
+        # inputs are identified by their type and data payload instead
+        return {'type': str(value.type),
+                'data': hash_path(str(value._archiver.data_dir))}
+    elif isinstance(value, Metadata):
+        payload = value.to_dataframe().to_csv() + repr(value.columns)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    elif isinstance(value, MetadataColumn):
+        payload = value.to_series().to_csv() + value.type
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    elif isinstance(value, (list, tuple)):
+        return [digest(v) for v in value]
+    elif isinstance(value, (set, frozenset)):
+        return sorted((digest(v) for v in value), key=json.dumps)
+    elif isinstance(value, dict):
+        return {str(k): digest(v) for k, v in value.items()}
+    return repr(value)
+
+
+class ResultStore:
+    """On-disk store of executed action results, with LRU eviction.
+
+    Each entry is a directory named after the hash of the action, its
+    inputs and the relevant package versions, holding one saved result
+    per action output. Entries are touched on every hit, and the least
+    recently used ones are evicted once the store grows past `max_size`
+    bytes.
+    """
+    def __init__(self, root, max_size=None):
+        self.root = os.path.abspath(root)
+        self.max_size = max_size
+        os.makedirs(self.root, exist_ok=True)
+        self._size = tree_size(self.root)
+        self._sources = {}
+
+    def key(self, action_id, versions, inputs):
+        payload = {
+            'action': action_id,
+            'versions': versions,
+            'inputs': {name: digest(value) for name, value in inputs.items()},
+        }
+        payload = json.dumps(payload, sort_keys=True).encode('utf-8')
+        return hashlib.sha256(payload).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.root, key)
+
+    def load(self, key):
+        path = self._entry_path(key)
+        try:
+            with open(os.path.join(path, 'manifest.json')) as fh:
+                manifest = json.load(fh)
+            results = {name: Result.load(os.path.join(path, fn))
+                       for name, fn in manifest.items()}
+        except (OSError, ValueError):
+            return None
+
+        for name, result in results.items():
+            self._sources[result.uuid] = os.path.join(path, manifest[name])
+        os.utime(path)
+        return results
+
+    def path_of(self, result):
+        """The saved file a result was loaded from, if it came from here."""
+        path = self._sources.get(getattr(result, 'uuid', None))
+        if path is not None and os.path.exists(path):
+            return path
+        return None
+
+    def save(self, key, results):
+        path = self._entry_path(key)
+        if os.path.exists(path) or not all(
+                isinstance(r, Result) for r in results.values()):
+            return
+
+        tmp_path = tempfile.mkdtemp(prefix='.tmp-', dir=self.root)
+        try:
+            manifest = {}
+            for name, result in results.items():
+                fp = result.save(os.path.join(tmp_path, name))
+                manifest[name] = os.path.basename(fp)
+            with open(os.path.join(tmp_path, 'manifest.json'), 'w') as fh:
+                json.dump(manifest, fh)
+
+            size = tree_size(tmp_path)
+            os.rename(tmp_path, path)
+        except OSError:
+            # caching is best-effort, e.g. another process may have stored
+            # this entry first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            return
+
+        self._size += size
+        if self.max_size is not None and self._size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.root):
+            if entry.is_dir() and not entry.name.startswith('.'):
+                entries.append((entry.stat().st_mtime, entry.path))
+        entries.sort()
+
+        self._size = sum(tree_size(path) for _, path in entries)
+        for _, path in entries:
+            if self._size <= self.max_size:
+                break
+            size = tree_size(path)
+            shutil.rmtree(path, ignore_errors=True)
+            self._size -= size
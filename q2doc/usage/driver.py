@@ -6,28 +6,33 @@
 # The full license is in the file LICENSE, distributed with this software.
 # ----------------------------------------------------------------------------
 
-from contextlib import redirect_stdout, redirect_stderr
+import concurrent.futures
+import functools
 import io
-import re
 import os
 import pathlib
-import shutil
-import tempfile
 import textwrap
 import urllib.parse
 
 from docutils import nodes
-import docutils.core
 
 from qiime2.plugin import model
 from qiime2.plugin.model.directory_format import BoundFileCollection
 from qiime2.plugins import ArtifactAPIUsage
+from qiime2.sdk import Result
 from qiime2.sdk.usage import Usage, ExecutionUsageVariable
 from q2cli.core.usage import CLIUsage, CLIUsageVariable
 from q2galaxy.api import GalaxyRSTInstructionsUsage
 from q2galaxy.core.util import pretty_fmt_name
 
+from q2doc.incremental import note_plugin
+from q2doc.publish import Published, publish_file, publish_tree, note_published
+from q2doc.rst import parse_rst
+from q2doc.trace import span
+from q2doc.usage.files import FileMatcher, walk_paths
+from q2doc.usage.plugins import get_plugin_manager
 from q2doc.usage.reticulate import RtifactAPIUsage
+from q2doc.util import capture_output, installed_versions, zip_tree
 
 
 AUTO_COLLECT_SIZE = 3
@@ -43,6 +48,14 @@ def _build_url(env, fn):
     return url
 
 
+def _get_data_dir(env):
+    # save output files based on docname always, rather than using
+    # the scope's name
+    data_dir = pathlib.Path(env.app.outdir) / 'data' / env.docname
+    data_dir.mkdir(parents=True, exist_ok=True)
+    return data_dir
+
+
 def _list_to_lines(bullets, indent):
     marker = '- '
     if len(bullets) > 1:
@@ -77,23 +90,26 @@ def _list_to_lines(bullets, indent):
 
 
 def _collect_files(dirfmt, data_dir):
-    collections = {}
+    prefix = dirfmt.path.relative_to(data_dir)
+    pathspecs = {field: getattr(dirfmt, field).pathspec
+                 for field in dirfmt._fields}
+    matcher = FileMatcher(pathspecs)
+
+    collections = {field: [] for field in dirfmt._fields
+                   if isinstance(getattr(dirfmt, field), BoundFileCollection)}
     individuals = {}
-    paths = list(sorted(dirfmt.path.glob('**/*')))
-    for field in dirfmt._fields:
-        attr = getattr(dirfmt, field)
-        if isinstance(attr, BoundFileCollection):
-            matched = [
-                f.relative_to(data_dir) for f in paths
-                if re.match(attr.pathspec, str(f.relative_to(dirfmt.path)))]
-            collections[field] = matched
-        else:
-            for f in paths:
-                if re.match(attr.pathspec, str(f.relative_to(dirfmt.path))):
-                    break
-            else:
-                raise Exception
-            individuals[field] = f.relative_to(data_dir)
+    for path in walk_paths(dirfmt.path):
+        for field in matcher.match(path):
+            if field in collections:
+                collections[field].append(prefix / path)
+            elif field not in individuals:
+                individuals[field] = prefix / path
+
+    if len(collections) + len(individuals) < len(pathspecs):
+        raise Exception
+    # keep the field order of the directory format
+    individuals = {field: individuals[field] for field in dirfmt._fields
+                   if field in individuals}
     return collections, individuals
 
 
@@ -207,10 +223,10 @@ class SphinxGalaxyUsage(GalaxyRSTInstructionsUsage):
         """Save the directory format to the site's data_dir,
         returns a new directory format mounted on the saved location.
         """
-        data_dir = self.sphinx_env.app.q2_usage['data_dir']
+        data_dir = _get_data_dir(self.sphinx_env)
         dir_name = self._to_cli_name(var)
         save_path = os.path.join(data_dir, dir_name)
-        fmt.save(save_path)
+        note_published(self.sphinx_env, publish_tree(str(fmt.path), save_path))
         return fmt.__class__(save_path, mode='r')
 
     def init_format(self, name, factory, ext=None):
@@ -218,7 +234,7 @@ class SphinxGalaxyUsage(GalaxyRSTInstructionsUsage):
             name = '%s.%s' % (name, ext)
         var = super().init_format(name, factory, ext=ext)
 
-        data_dir = self.sphinx_env.app.q2_usage['data_dir']
+        data_dir = _get_data_dir(self.sphinx_env)
         fmt = var.execute()
 
         if isinstance(fmt, model.DirectoryFormat):
@@ -335,7 +351,7 @@ class SphinxGalaxyUsage(GalaxyRSTInstructionsUsage):
         rendered = super().render(flush)
         container_node = nodes.compound(
             raw_source='', ids=[node_id], classes=['galaxy-usage'])
-        tree = docutils.core.publish_doctree('\n'.join(rendered))
+        tree = parse_rst('\n'.join(rendered))
         container_node.children = tree.children
 
         return container_node
@@ -571,6 +587,12 @@ class SphinxCLIUsage(CLIUsage):
 
         return var
 
+    def action(self, action, input_opts, output_opts):
+        # every example is rendered for the CLI, so this is where the
+        # plugins a document depends on are recorded
+        note_plugin(self.sphinx_env, action.plugin_id)
+        return super().action(action, input_opts, output_opts)
+
     def render(self, node_id, flush=False, **kwargs):
         rendered = super().render(flush)
 
@@ -584,7 +606,37 @@ class SphinxCLIUsage(CLIUsage):
 class SphinxExecUsageVariable(ExecutionUsageVariable, CLIUsageVariable):
     # ExecutionUsageVariable knows how to assert results
     # CLIUsageVariable knows how to build filesystem filenames
-    pass
+
+    def execute(self):
+        value = super().execute()
+        spill = self.use.sphinx_env.app.q2_usage['spill']
+        if spill is not None and isinstance(value, Result):
+            spill.touch(self, value)
+        return value
+
+
+def _save_result(result, fp, source):
+    """Save one executed result at `fp` (which lacks an extension).
+
+    Returns the saved path, how it was published, and the stdout and
+    stderr written while saving.
+    """
+    stdout, stderr = io.StringIO(), io.StringIO()
+    if isinstance(result, model.DirectoryFormat):
+        # the format is already on disk, so it only needs to be zipped
+        fp = zip_tree(str(result), fp + '.zip')
+        size = os.path.getsize(fp)
+        published = Published(size=size, written=size)
+    elif source is not None:
+        # already saved in the result store, so share its storage
+        fp += os.path.splitext(source)[1]
+        published = publish_file(source, fp)
+    else:
+        with capture_output(stdout, stderr):
+            fp = result.save(fp)
+        size = os.path.getsize(fp)
+        published = Published(size=size, written=size)
+    return fp, published, stdout.getvalue(), stderr.getvalue()
 
 
 class SphinxExecUsage(Usage):
@@ -605,23 +657,27 @@ class SphinxExecUsage(Usage):
         return variable
 
     def _save_results(self):
-        fns = {}
-        data_dir = self.sphinx_env.app.q2_usage['data_dir']
+        data_dir = _get_data_dir(self.sphinx_env)
+        store = self.sphinx_env.app.q2_usage['result_store']
+        tasks = []
         for fn, result in self.recorder.items():
-            fp = str(data_dir / fn)
-            if isinstance(result, model.DirectoryFormat):
-                with tempfile.TemporaryDirectory() as tmpdir:
-                    tmpdir = pathlib.Path(tmpdir)
-                    with redirect_stdout(self.stdout), \
-                            redirect_stderr(self.stderr):
-                        result.save(tmpdir / 'dirfmt')
-                    fp = shutil.make_archive(fp, 'zip', str(result))
-            else:
-                with redirect_stdout(self.stdout), \
-                        redirect_stderr(self.stderr):
-                    fp = result.save(fp)
-            fp = pathlib.Path(fp)
-            fn_w_ext = fp.relative_to(data_dir)
+            source = store.path_of(result) if store is not None else None
+            tasks.append((result, str(data_dir / fn), source))
+
+        # an example's outputs are independent, so they are saved (and
+        # zipped) concurrently, each capturing its own output
+        workers = max(1, min(len(tasks),
+                             self.sphinx_env.config.usage_save_workers))
+        with span(self.sphinx_env, 'save results', 'usage'), \
+                concurrent.futures.ThreadPoolExecutor(workers) as pool:
+            saved = list(pool.map(lambda task: _save_result(*task), tasks))
+
+        fns = {}
+        for fp, published, stdout, stderr in saved:
+            self.stdout.write(stdout)
+            self.stderr.write(stderr)
+            note_published(self.sphinx_env, published)
+            fn_w_ext = pathlib.Path(fp).relative_to(data_dir)
             fns[fn_w_ext] = _build_url(self.sphinx_env, fn_w_ext)
         return fns
 
@@ -728,15 +784,42 @@ class SphinxExecUsage(Usage):
     def get_metadata_column(self, name, column_name, variable):
         return super().get_metadata_column(name, column_name, variable)
 
+    def _memoize_action(self, store, action, input_opts, variables):
+        outputs = variables._asdict()
+        factories = {name: var.factory for name, var in outputs.items()}
+
+        @functools.lru_cache(maxsize=None)
+        def load_or_execute():
+            plugin_manager = get_plugin_manager(self.sphinx_env.app)
+            plugin = plugin_manager.get_plugin(id=action.plugin_id)
+            versions = {'qiime2': installed_versions().get('qiime2'),
+                        action.plugin_id: plugin.version}
+            key = store.key('%s.%s' % (action.plugin_id, action.action_id),
+                            versions, input_opts.values)
+
+            results = store.load(key)
+            if results is None:
+                results = {name: factory()
+                           for name, factory in factories.items()}
+                store.save(key, results)
+            return results
+
+        for name, var in outputs.items():
+            var.factory = lambda name=name: load_or_execute()[name]
+
     def action(self, action, input_opts, output_opts):
         variables = super().action(action, input_opts, output_opts)
 
+        store = self.sphinx_env.app.q2_usage['result_store']
+        if store is not None:
+            self._memoize_action(store, action, input_opts, variables)
+
         if len(variables) > AUTO_COLLECT_SIZE:
             plugin_name = CLIUsageVariable.to_cli_name(action.plugin_id)
             action_name = CLIUsageVariable.to_cli_name(action.action_id)
             dir_name = self.cli_use._build_output_dir_name(plugin_name,
                                                            action_name)
-            data_dir = self.sphinx_env.app.q2_usage['data_dir']
+            data_dir = _get_data_dir(self.sphinx_env)
             output_dir = data_dir / dir_name
             output_dir.mkdir(exist_ok=True)
             self.cli_use._rename_outputs(variables._asdict(), str(output_dir))
@@ -6,59 +6,62 @@
 # The full license is in the file LICENSE, distributed with this software.
 # ----------------------------------------------------------------------------
 
+import collections
+import functools
+import gc
 import json
 import os
-import pathlib
 import traceback
-import pkg_resources
 
 import sphinx
+import sphinx.builders
+import sphinx.util.parallel
 import docutils.parsers.rst.directives
 from docutils import nodes
-from sphinx.util.fileutil import copy_asset
 import sphinx.errors
+from sphinx.util import logging
 
-from qiime2.sdk import PluginManager
+from q2doc.assets import add_assets
+from q2doc.incremental import get_record
+from q2doc.sources import scan_scopes
+from q2doc.trace import directive_span, span
+from q2doc.util import connect_doc_state, doc_state
+from .plugins import get_driver, get_plugin_manager
+from .preview import NodeStore, chain_key
+from .scheduler import group_by_scope, make_scope_chunks
+from .spill import ResultSpill
 
-from .driver import (
-    SphinxExecUsage,
-    SphinxArtifactUsage,
-    SphinxCLIUsage,
-    SphinxGalaxyUsage,
-    SphinxRtifactUsage
-)
 
-
-BASE_CASE = object()
+logger = logging.getLogger(__name__)
 
 
 INTERFACES = {
     'python3': {
-                     'driver':        SphinxArtifactUsage,
+                     'driver':        'SphinxArtifactUsage',
                      'label':        'Python 3 API (qiime2)',
                      'is_interface': True,
                      'class_name':   'python3-usage',
                     },
     'R': {
-                    'driver':        SphinxRtifactUsage,
+                    'driver':        'SphinxRtifactUsage',
                     'label':         'R API (qiime2)',
                     'is_interface':  True,
                     'class_name':    'r-usage',
     },
     'cli':          {
-                     'driver':       SphinxCLIUsage,
+                     'driver':       'SphinxCLIUsage',
                      'label':        'Command Line (q2cli)',
                      'is_interface': True,
                      'class_name':   'cli-usage',
                     },
     'galaxy':       {
-                     'driver':       SphinxGalaxyUsage,
+                     'driver':       'SphinxGalaxyUsage',
                      'label':        'Galaxy (q2galaxy)',
                      'is_interface': True,
                      'class_name':   'galaxy-usage',
                     },
     'exc':          {
-                     'driver':       SphinxExecUsage,
+                     'driver':       'SphinxExecUsage',
                      'label':        'Execution Usage (non-rendering)',
                      'is_interface': False,
                      'class_name':   '',
@@ -73,26 +76,124 @@ INTERFACES = {
 
 
 def setup_extension(app):
-    app.q2_usage = {
-        'plugin_manager': PluginManager(),
-        'current_doc': BASE_CASE,
-        'contexts': {},
-        'scope_names': {},
-        'default_interfaces': {},
-    }
-
+    # process-local execution state: when reading in parallel, each worker
+    # owns the contexts of the scopes it reads (see `schedule_scopes`)
+    result_store = None
+    if app.config.usage_result_cache_dir:
+        from .cache import ResultStore
 
-def copy_asset_files(app, pagename, templatename, context, doctree):
-    base_fp = pkg_resources.resource_filename('q2doc', 'usage')
-    asset_path = pathlib.Path(base_fp) / 'assets'
+        result_store = ResultStore(
+            os.path.join(app.confdir, app.config.usage_result_cache_dir),
+            app.config.usage_result_cache_max_size)
 
-    for path in asset_path.glob('*.js'):
-        copy_asset(str(path), os.path.join(app.outdir, '_static'))
-        app.add_js_file(str(path.name))
+    spill = None
+    if app.config.usage_memory_budget is not None:
+        spill = ResultSpill(os.path.join(app.doctreedir, 'usage-spill'),
+                            app.config.usage_memory_budget, result_store)
 
-    for path in asset_path.glob('*.css'):
-        copy_asset(str(path), os.path.join(app.outdir, '_static'))
-        app.add_css_file(str(path.name))
+    app.q2_usage = {
+        # loaded on first use, see `get_plugin_manager`
+        'plugin_manager': None,
+        'contexts': {},
+        # the documents to be read with usage examples, mapped to their
+        # scope, and per scope: how many of its documents are still to be
+        # read
+        'scopes': {},
+        'remaining': collections.Counter(),
+        'spill': spill,
+        # per scope: the chain key of its last example, and the examples
+        # whose nodes were reused instead of executing them
+        'chains': {},
+        'result_store': result_store,
+        # only kept when previewing, or recording the nodes for a preview
+        'node_store': None,
+    }
+    if app.config.usage_preview or app.config.usage_record_nodes:
+        app.q2_usage['node_store'] = NodeStore(
+            os.path.join(app.doctreedir, 'usage-nodes'))
+
+
+def get_interfaces(config):
+    """The interfaces to render, in `INTERFACES` order."""
+    if config.usage_interfaces is None:
+        return list(INTERFACES)
+    unknown = set(config.usage_interfaces) - set(INTERFACES)
+    if unknown:
+        raise sphinx.errors.ExtensionError(
+            'Unknown usage interfaces: %s' % ', '.join(sorted(unknown)))
+    # the example's source is always shown
+    return [name for name in INTERFACES
+            if name in config.usage_interfaces or name == 'raw']
+
+
+def get_doc_state(env, docname=None):
+    """Per-document usage state, stored in the environment."""
+    return doc_state(env, 'q2_usage_docs', docname, lambda: {
+        'scope_name': None,
+        'default_interface': None,
+        # the node store's keys of the document's examples
+        'node_keys': [],
+    })
+
+
+def schedule_scopes(app, env, docnames):
+    scopes = scan_scopes(env, docnames)
+
+    # read all of a scope's documents back to back, in their original
+    # (sorted) order, even when documents were reordered by their cost...
+    docnames[:] = [docname for group in group_by_scope(docnames, scopes)
+                   for docname in sorted(group)]
+
+    # ...and in the same worker process, when reading in parallel
+    sphinx.builders.make_chunks = functools.partial(make_scope_chunks,
+                                                    scopes=scopes)
+
+    if scopes and app.parallel > 1:
+        # load the plugins once, before the reader processes are forked
+        get_plugin_manager(app)
+
+    app.q2_usage['scopes'] = scopes
+    app.q2_usage['remaining'] = collections.Counter(scopes.values())
+
+
+def release_scope(app, doctree):
+    """Free a scope's driver contexts once its last document was read."""
+    q2_usage = app.q2_usage
+    # only the documents with usage examples were counted, e.g. not those
+    # only naming a scope
+    scope_name = q2_usage['scopes'].pop(app.env.docname, None)
+    if scope_name is None or q2_usage['remaining'][scope_name] <= 0:
+        return
+
+    q2_usage['remaining'][scope_name] -= 1
+    if q2_usage['remaining'][scope_name] == 0:
+        q2_usage['contexts'].pop(scope_name, None)
+        q2_usage['chains'].pop(scope_name, None)
+        # executed variables reference each other through their factories
+        gc.collect()
+
+
+def cleanup_spill(app, exception):
+    if app.q2_usage['spill'] is not None:
+        app.q2_usage['spill'].cleanup()
+
+
+def prune_node_store(app, exception):
+    """Drop the stored nodes of examples no document has any more."""
+    node_store = app.q2_usage['node_store']
+    # the keys of documents which failed to be read are unknown
+    if node_store is None or exception is not None:
+        return
+    docs = getattr(app.env, 'q2_usage_docs', {})
+    keep = {key for doc_state in docs.values()
+            for key in doc_state.get('node_keys', ())}
+    removed = node_store.prune(keep)
+    if removed:
+        logger.info('removed %d unused stored usage nodes' % removed)
+
+
+def restore_chunks(app, *args):
+    sphinx.builders.make_chunks = sphinx.util.parallel.make_chunks
 
 
 class UsageDirectiveInterfaceSelector(docutils.parsers.rst.Directive):
@@ -112,13 +213,12 @@ class UsageDirectiveInterfaceSelector(docutils.parsers.rst.Directive):
     def setup(self):
         env = self._get_env()
 
-        q2_usage = env.app.q2_usage
-        docname = env.docname
+        doc_state = get_doc_state(env)
         nodes_ = []
 
         # this means usage-selector directive has not been run in this doc,
         # so let's initialize the interface base case
-        if docname not in q2_usage['default_interfaces']:
+        if doc_state['default_interface'] is None:
             default_interface = self.options.get(
                 'default-interface', INTERFACES['cli']['class_name'])
 
@@ -127,9 +227,15 @@ class UsageDirectiveInterfaceSelector(docutils.parsers.rst.Directive):
                 raise sphinx.errors.ExtensionError(
                     'Invalid interface: %s' % default_interface)
 
+            enabled = get_interfaces(env.config)
+            if default_interface not in [INTERFACES[name]['class_name']
+                                         for name in enabled]:
+                default_interface = INTERFACES[enabled[0]]['class_name']
+
             interfaces = {}
             classes = []
-            for interface in INTERFACES.values():
+            for name in enabled:
+                interface = INTERFACES[name]
                 if interface['class_name'] != '':
                     interfaces[interface['class_name']] = [
                         interface['label'],
@@ -147,7 +253,7 @@ class UsageDirectiveInterfaceSelector(docutils.parsers.rst.Directive):
 
             nodes_.append(nodes.raw(tag, tag, format='html'))
 
-            q2_usage['default_interfaces'][docname] = default_interface
+            doc_state['default_interface'] = default_interface
 
         return nodes_
 
@@ -165,6 +271,10 @@ class UsageDirective(docutils.parsers.rst.Directive):
     }
 
     def run(self):
+        with directive_span(self):
+            return self._run()
+
+    def _run(self):
         if not self.content:
             raise sphinx.errors.ExtensionError(
                 'Content required for the %s directive.' % self.name)
@@ -176,7 +286,6 @@ class UsageDirective(docutils.parsers.rst.Directive):
 
         self.setup()
 
-        nodes_ = []
         cmd = '\n'.join(self.content)
 
         env = self._get_env()
@@ -190,15 +299,59 @@ class UsageDirective(docutils.parsers.rst.Directive):
             global_no_exec = os.environ.get('Q2DOC_NO_EXEC', False)
             debug_pg_isnt_current_pg = True
 
-        scope_name = env.app.q2_usage['scope_names'][env.docname]
+        scope_name = get_doc_state(env)['scope_name']
+        q2_usage = env.app.q2_usage
+        chain = q2_usage['chains'][scope_name]
+
+        skip_exc = no_exec or (global_no_exec and debug_pg_isnt_current_pg)
+        drivers = [driver for driver in q2_usage['contexts'][scope_name]
+                   if not (driver == 'exc' and skip_exc)]
+
+        options = [name for name in ('stdout', 'stderr') if name in opts]
+        chain['key'] = chain_key(chain['key'], env.docname, cmd, options)
+        node_store = q2_usage['node_store']
+        if node_store is not None:
+            get_doc_state(env)['node_keys'].append(chain['key'])
+
+        rendered = None
+        if env.config.usage_preview:
+            cached = node_store.load(chain['key'])
+            if all(driver in cached for driver in drivers):
+                rendered = {driver: cached[driver] for driver in drivers}
+                # it is only executed if a later example needs to be
+                chain['pending'].append((cmd, drivers, stdout, stderr))
+
+        if rendered is None:
+            for example in chain['pending']:
+                self._render(scope_name, *example)
+            chain['pending'] = []
+            rendered = self._render(scope_name, cmd, drivers, stdout, stderr)
+            if node_store is not None:
+                node_store.save(chain['key'], rendered)
 
-        for driver, ctx in env.app.q2_usage['contexts'][scope_name].items():
-            if driver == 'exc':
-                if no_exec or (global_no_exec and debug_pg_isnt_current_pg):
-                    continue
+        nodes_ = []
+        for driver in drivers:
+            node_id = self._new_id()
+            node = rendered[driver]
+            if node is not None:
+                node['ids'] = [node_id]
+                nodes_.append(node)
+
+        nodes_.insert(
+            -2,  # bc execution usage should always be _last_
+            nodes.literal_block(cmd, cmd, ids=[self._new_id()],
+                                classes=['raw-usage']))
+        return nodes_
 
+    def _render(self, scope_name, cmd, drivers, stdout, stderr):
+        env = self._get_env()
+        contexts = env.app.q2_usage['contexts'][scope_name]
+        rendered = {}
+        for driver in drivers:
+            ctx = contexts[driver]
             try:
-                exec(cmd, ctx)
+                with span(env, '%s exec' % driver, 'usage'):
+                    exec(cmd, ctx)
             except Exception as e:
                 spacer = '=' * 79
                 error = '\n'.join(traceback.format_exception_only(type(e), e))
@@ -208,56 +361,40 @@ class UsageDirective(docutils.parsers.rst.Directive):
                                  "\n\n%s\n%s\n%s\n%s"
                                  % (driver, error, spacer, cmd, spacer)) from e
 
-            node_id = self._new_id()
-            node = ctx['use'].render(
-                node_id,
-                flush=True,
-                stdout=stdout,
-                stderr=stderr,
-            )
-            if node is not None:
-                nodes_.append(node)
-
-        nodes_.insert(
-            -2,  # bc execution usage should always be _last_
-            nodes.literal_block(cmd, cmd, ids=[self._new_id()],
-                                classes=['raw-usage']))
-        return nodes_
+            # ids are assigned by `run`, as the nodes may be reused
+            with span(env, '%s render' % driver, 'usage'):
+                rendered[driver] = ctx['use'].render(
+                    '',
+                    flush=True,
+                    stdout=stdout,
+                    stderr=stderr,
+                )
+        return rendered
 
     def setup(self):
         env = self._get_env()
 
         q2_usage = env.app.q2_usage
-        docname = env.docname
+        doc_state = get_doc_state(env)
 
         # this means usage-scope directive has not been run in this doc,
         # so let's use the current docname for the scope's name
-        if docname not in q2_usage['scope_names']:
-            q2_usage['scope_names'][docname] = docname
-
-        scope_name = q2_usage['scope_names'][docname]
+        if doc_state['scope_name'] is None:
+            doc_state['scope_name'] = env.docname
 
-        # save output files based on docname always, rather than using
-        # the scope's name
-        if q2_usage['current_doc'] != docname:
-            q2_usage['current_doc'] = docname
-
-            # find somewhere to stick all the result data
-            root_build_dir = pathlib.Path(env.app.outdir)
-            doc_data_dir = root_build_dir / 'data' / docname
-            doc_data_dir.mkdir(parents=True, exist_ok=True)
-            q2_usage['data_dir'] = doc_data_dir
+        scope_name = doc_state['scope_name']
+        get_record(env)['scope'] = scope_name
 
         # if scope hasn't been initialized yet, do that now
         if scope_name not in q2_usage['contexts']:
             # these are the locals() for the individual drivers
             scope = dict()
-            for k, v in INTERFACES.items():
-                if v['driver'] is not None:
-                    scope[k] = {'use': v['driver'](env)}
+            for k in get_interfaces(env.config):
+                if INTERFACES[k]['driver'] is not None:
+                    driver = get_driver(env.app, INTERFACES[k]['driver'])
+                    scope[k] = {'use': driver(env)}
             q2_usage['contexts'][scope_name] = scope
-
-        env.app.q2_usage = q2_usage
+            q2_usage['chains'][scope_name] = {'key': '', 'pending': []}
 
     def _get_env(self):
         return self.state.document.settings.env
@@ -277,21 +414,47 @@ class UsageScopeDirective(docutils.parsers.rst.Directive):
     def run(self):
         scope_name = self.options['name']
         env = self.state.document.settings.env
-        if env.docname in env.app.q2_usage['scope_names']:
+        doc_state = get_doc_state(env)
+        if doc_state['scope_name'] is not None:
             raise sphinx.errors.ExtensionError(
                 'cannot redefine a document\'s scope after '
                 'usage has been initialized')
 
-        env.app.q2_usage['scope_names'][env.docname] = scope_name
+        doc_state['scope_name'] = scope_name
         return []
 
 
 def setup(app):
+    app.setup_extension('q2doc.incremental')
+    app.setup_extension('q2doc.publish')
+    app.setup_extension('q2doc.assets')
+    app.setup_extension('q2doc.trace')
+    app.setup_extension('q2doc.timings')
+    add_assets(app, 'usage')
+
     app.connect('builder-inited', setup_extension)
-    app.connect('html-page-context', copy_asset_files)
+    app.connect('env-before-read-docs', schedule_scopes)
+    app.connect('doctree-read', release_scope)
+    app.connect('env-updated', restore_chunks)
+    connect_doc_state(app, 'q2_usage_docs')
+    app.connect('build-finished', cleanup_spill)
+    app.connect('build-finished', prune_node_store)
 
     app.add_directive('usage', UsageDirective)
     app.add_directive('usage-selector', UsageDirectiveInterfaceSelector)
     app.add_directive('usage-scope', UsageScopeDirective)
 
-    return {'version': '0.0.1'}
+    app.add_config_value('usage_result_cache_dir', None, '')
+    app.add_config_value('usage_result_cache_max_size', 10 * 1024 ** 3, '')
+    app.add_config_value('usage_save_workers', 4, '')
+    app.add_config_value('usage_plugins', None, '')
+    app.add_config_value('usage_interfaces', None, 'html')
+    app.add_config_value('usage_preview', False, 'env')
+    app.add_config_value('usage_record_nodes', False, 'env')
+    app.add_config_value('usage_memory_budget', None, '')
+
+    return {
+        'version': '0.0.1',
+        'parallel_read_safe': True,
+        'parallel_write_safe': True,
+    }
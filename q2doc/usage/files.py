@@ -0,0 +1,66 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import os
+import re
+
+
+def walk_paths(root):
+    """All paths below `root` (files and directories, like ``**/*``),
+    relative to it and in the order of ``sorted(root.glob('**/*'))``."""
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        reldir = os.path.relpath(dirpath, root)
+        for name in dirnames + filenames:
+            paths.append(name if reldir == '.'
+                         else os.path.join(reldir, name))
+    paths.sort(key=lambda path: path.split(os.sep))
+    return paths
+
+
+class FileMatcher:
+    """Classify paths by the first-matching pathspecs of a set of fields.
+
+    Every pathspec is compiled once, and also combined into a single
+    alternation, so a path matching none of the fields costs a single regex
+    match. Fields are checked with ``re.match`` semantics.
+    """
+    def __init__(self, pathspecs):
+        self.fields = list(pathspecs)
+        self._patterns = [re.compile(spec) for spec in pathspecs.values()]
+        self._combined = None
+        # numbered backreferences would point at the wrong group once the
+        # pathspecs are wrapped in an alternation
+        if not any(re.search(r'\\[1-9]', p.pattern) for p in self._patterns):
+            try:
+                self._combined = re.compile('|'.join(
+                    '(?P<_q2doc_%d>%s)' % (i, pattern.pattern)
+                    for i, pattern in enumerate(self._patterns)))
+            except re.error:
+                # e.g. inline global flags are only allowed at the start
+                pass
+
+    def match(self, path):
+        """The fields whose pathspec matches `path`, in field order."""
+        matched = []
+        start = 0
+        if self._combined is not None:
+            match = self._combined.match(path)
+            if match is None:
+                return matched
+            start = next(i for i in range(len(self._patterns))
+                         if match.group('_q2doc_%d' % i) is not None)
+            matched.append(self.fields[start])
+            start += 1
+
+        # an alternation only reports its first matching branch, so later
+        # fields are still checked for overlapping pathspecs
+        for i in range(start, len(self._patterns)):
+            if self._patterns[i].match(path):
+                matched.append(self.fields[i])
+        return matched
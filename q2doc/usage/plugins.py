@@ -0,0 +1,52 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import importlib
+
+
+def _load_plugin_manager(allowed):
+    from qiime2.sdk import PluginManager
+
+    if allowed is None:
+        return PluginManager()
+
+    # only the allowed plugins are loaded, so they must include every plugin
+    # providing the types and formats they depend on (e.g. `types`)
+    allowed = {name.replace('_', '-') for name in allowed}
+    plugin_manager = PluginManager(add_plugins=False)
+    for entry_point in PluginManager.iter_entry_points():
+        if entry_point.name.replace('_', '-') not in allowed:
+            continue
+        plugin_manager.add_plugin(
+            entry_point.load(),
+            package=entry_point.module_name.split('.')[0],
+            project_name=entry_point.dist.project_name,
+            consistency_check=False)
+    return plugin_manager
+
+
+def get_plugin_manager(app):
+    """The QIIME 2 plugin manager, loaded on first use.
+
+    Loading every installed plugin is the slowest part of starting a build,
+    so this only happens once a document actually uses the usage drivers.
+    It must happen before anything else instantiates the (singleton)
+    `PluginManager`, which is why the drivers are only imported afterwards.
+    """
+    q2_usage = app.q2_usage
+    if q2_usage['plugin_manager'] is None:
+        q2_usage['plugin_manager'] = _load_plugin_manager(
+            app.config.usage_plugins)
+    return q2_usage['plugin_manager']
+
+
+def get_driver(app, name):
+    """Import a usage driver class from `q2doc.usage.driver` by name."""
+    get_plugin_manager(app)
+    driver = importlib.import_module('q2doc.usage.driver')
+    return getattr(driver, name)
@@ -0,0 +1,71 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+
+
+def chain_key(previous, docname, example, options):
+    """Key of an example's rendering: it depends on the example itself and,
+    through `previous`, on every example run before it in its scope."""
+    payload = json.dumps([previous, docname, example, sorted(options)])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class NodeStore:
+    """The nodes each usage driver last rendered for an example, on disk.
+
+    Entries are keyed by :func:`chain_key` and hold one node (or None, for
+    drivers rendering nothing) per driver, so a preview limited to a few
+    interfaces can reuse the nodes recorded by a full build. Keys change
+    with every edit of an example or of those before it, so the entries a
+    build no longer uses are dropped with :meth:`prune`.
+    """
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], key + '.pickle')
+
+    def load(self, key):
+        try:
+            with open(self._path(key), 'rb') as fh:
+                return pickle.load(fh)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return {}
+
+    def save(self, key, rendered):
+        entry = self.load(key)
+        entry.update(rendered)
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', dir=self.root)
+        with os.fdopen(fd, 'wb') as fh:
+            pickle.dump(entry, fh, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    def prune(self, keep):
+        """Remove the entries whose key is not in `keep`, returning how many
+        were removed."""
+        removed = 0
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                key, ext = os.path.splitext(filename)
+                if ext != '.pickle' or key in keep:
+                    continue
+                try:
+                    os.unlink(os.path.join(dirpath, filename))
+                except FileNotFoundError:
+                    continue
+                removed += 1
+        return removed
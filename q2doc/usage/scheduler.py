@@ -0,0 +1,45 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import math
+
+
+def group_by_scope(docnames, scopes):
+    """Group documents so that all members of a scope are adjacent."""
+    groups = {}
+    for docname in docnames:
+        key = scopes.get(docname, docname)
+        groups.setdefault(key, []).append(docname)
+    return list(groups.values())
+
+
+def make_scope_chunks(arguments, nproc, maxbatch=10, scopes=None):
+    """A scope-aware replacement for :func:`sphinx.util.parallel.make_chunks`.
+
+    Chunks are sized the same way Sphinx sizes them, but documents sharing
+    a usage scope are never split across chunks, so a single worker process
+    owns (and executes) all of a scope's examples.
+    """
+    groups = group_by_scope(arguments, scopes or {})
+
+    nargs = len(arguments)
+    chunksize = nargs // nproc
+    if chunksize >= maxbatch:
+        chunksize = int(math.sqrt(nargs / nproc * maxbatch))
+    chunksize = max(chunksize, 1)
+
+    chunks = []
+    chunk = []
+    for group in groups:
+        if chunk and len(chunk) + len(group) > chunksize:
+            chunks.append(chunk)
+            chunk = []
+        chunk.extend(group)
+    if chunk:
+        chunks.append(chunk)
+    return chunks
@@ -0,0 +1,85 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import collections
+import functools
+import os
+import shutil
+import weakref
+
+from q2doc.util import tree_size
+
+
+class ResultSpill:
+    """Keeps the executed results of usage variables within `budget` bytes.
+
+    Results are tracked in least recently used order as their variables
+    are executed. Past the budget, the least recently used ones are saved
+    under `root` (unless `store` already has them saved) and dropped from
+    their variables, which reload them lazily when executed again.
+    Entries of variables that are garbage collected (e.g. with their
+    scope) are forgotten.
+    """
+    def __init__(self, root, budget, store=None):
+        self.root = root
+        self.budget = budget
+        self.store = store
+        self.size = 0
+        # id(variable) -> weakref to it, notifying `_forget`
+        self._refs = {}
+        # id(variable) -> size of its result, for resident results
+        self._resident = collections.OrderedDict()
+        # id(variable) -> the path its result was spilled to
+        self._spilled = {}
+        os.makedirs(self.root, exist_ok=True)
+
+    def touch(self, variable, result):
+        key = id(variable)
+        if key in self._resident:
+            self._resident.move_to_end(key)
+            return
+
+        if key not in self._refs:
+            self._refs[key] = weakref.ref(
+                variable, functools.partial(self._forget, key))
+        size = tree_size(str(result._archiver.data_dir))
+        self._resident[key] = size
+        self.size += size
+
+        # the most recent result is needed right now, so it always stays
+        while self.size > self.budget and len(self._resident) > 1:
+            old_key, old_size = self._resident.popitem(last=False)
+            self.size -= old_size
+            old = self._refs[old_key]()
+            if old is not None:
+                self._spill(old_key, old)
+
+    def _spill(self, key, variable):
+        result = variable.value
+        path = self._spilled.get(key)
+        if path is None and self.store is not None:
+            path = self.store.path_of(result)
+        if path is None:
+            path = result.save(os.path.join(self.root, str(result.uuid)))
+        self._spilled[key] = path
+
+        variable.factory = functools.partial(type(result).load, path)
+        variable.value = variable.DEFERRED
+
+    def _forget(self, key, ref=None):
+        self._refs.pop(key, None)
+        self.size -= self._resident.pop(key, 0)
+        path = self._spilled.pop(key, None)
+        if path is not None and path.startswith(self.root + os.sep):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def cleanup(self):
+        shutil.rmtree(self.root, ignore_errors=True)
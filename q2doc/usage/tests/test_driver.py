@@ -0,0 +1,43 @@
+import os
+import tempfile
+import unittest
+import unittest.mock
+import zipfile
+
+from qiime2.plugin import model
+
+from q2doc.usage import driver
+
+
+class TestSaveResult(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory(prefix='qiime2-test-temp-')
+        self.dirfmt_path = os.path.join(self.test_dir.name, 'dirfmt')
+        os.makedirs(self.dirfmt_path)
+        with open(os.path.join(self.dirfmt_path, 'ints.tsv'), 'w') as fh:
+            fh.write('1\n2\n')
+
+    def tearDown(self):
+        self.test_dir.cleanup()
+
+    def test_directory_format_zipped_once(self):
+        result = unittest.mock.MagicMock(spec=model.DirectoryFormat)
+        result.__str__.return_value = self.dirfmt_path
+        fp = os.path.join(self.test_dir.name, 'out')
+
+        with unittest.mock.patch.object(driver, 'zip_tree',
+                                        wraps=driver.zip_tree) as zip_tree:
+            saved, published, stdout, stderr = driver._save_result(
+                result, fp, None)
+
+        # straight from where the format is, without saving it first
+        zip_tree.assert_called_once_with(self.dirfmt_path, fp + '.zip')
+        result.save.assert_not_called()
+        self.assertEqual(saved, fp + '.zip')
+        self.assertEqual(published.size, os.path.getsize(saved))
+        with zipfile.ZipFile(saved) as zf:
+            self.assertEqual(zf.read('ints.tsv'), b'1\n2\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
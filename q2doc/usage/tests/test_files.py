@@ -0,0 +1,61 @@
+import pathlib
+import tempfile
+import time
+import unittest
+
+from q2doc.usage.files import FileMatcher, walk_paths
+
+
+class TestWalkPaths(unittest.TestCase):
+    def test_glob_order(self):
+        with tempfile.TemporaryDirectory(prefix='qiime2-test-temp-') as tmp:
+            root = pathlib.Path(tmp)
+            for name in ['b/x.txt', 'a-b.txt', 'a/z.txt', 'a/y/w.txt']:
+                (root / name).parent.mkdir(parents=True, exist_ok=True)
+                (root / name).touch()
+
+            expected = [str(p.relative_to(root))
+                        for p in sorted(root.glob('**/*'))]
+            self.assertEqual(walk_paths(root), expected)
+
+
+class TestFileMatcher(unittest.TestCase):
+    def test_first_match_per_field(self):
+        matcher = FileMatcher({
+            'manifest': r'MANIFEST',
+            'sequences': r'.+_L[0-9][0-9][0-9]_R[12]_001\.fastq\.gz',
+            'metadata': r'metadata\.yml',
+        })
+        self.assertEqual(matcher.match('MANIFEST'), ['manifest'])
+        self.assertEqual(matcher.match('s1_S1_L001_R1_001.fastq.gz'),
+                         ['sequences'])
+        self.assertEqual(matcher.match('metadata.yml'), ['metadata'])
+        self.assertEqual(matcher.match('README'), [])
+
+    def test_overlapping_pathspecs(self):
+        matcher = FileMatcher({'all': r'.+', 'fasta': r'.+\.fasta'})
+        self.assertEqual(matcher.match('a.fasta'), ['all', 'fasta'])
+        self.assertEqual(matcher.match('a.txt'), ['all'])
+
+    def test_uncombinable_pathspecs(self):
+        matcher = FileMatcher({'pair': r'(.)\1\.txt', 'any': r'(?i)X.*'})
+        self.assertEqual(matcher.match('aa.txt'), ['pair'])
+        self.assertEqual(matcher.match('ab.txt'), [])
+        self.assertEqual(matcher.match('x.txt'), ['any'])
+
+    def test_scales_linearly(self):
+        matcher = FileMatcher({
+            'manifest': r'MANIFEST',
+            'sequences': r'.+_L[0-9][0-9][0-9]_R[12]_001\.fastq\.gz',
+        })
+        paths = ['s%d_S%d_L001_R1_001.fastq.gz' % (i, i)
+                 for i in range(100000)]
+
+        start = time.perf_counter()
+        matched = sum(1 for path in paths if matcher.match(path))
+        self.assertEqual(matched, len(paths))
+        self.assertLess(time.perf_counter() - start, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import tempfile
+import unittest
+
+from docutils import nodes
+
+from q2doc.usage.preview import NodeStore, chain_key
+
+
+class TestChainKey(unittest.TestCase):
+    def test_depends_on_previous_examples(self):
+        first = chain_key('', 'index', 'use.action(...)', [])
+        self.assertEqual(first, chain_key('', 'index', 'use.action(...)', []))
+
+        other = chain_key('', 'index', 'use.other(...)', [])
+        self.assertNotEqual(chain_key(first, 'index', 'x', []),
+                            chain_key(other, 'index', 'x', []))
+        self.assertNotEqual(chain_key(first, 'index', 'x', []),
+                            chain_key(first, 'other', 'x', []))
+        self.assertNotEqual(chain_key(first, 'index', 'x', []),
+                            chain_key(first, 'index', 'x', ['stdout']))
+
+
+class TestNodeStore(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory(prefix='qiime2-test-temp-')
+        self.store = NodeStore(self.test_dir.name)
+
+    def tearDown(self):
+        self.test_dir.cleanup()
+
+    def test_roundtrip(self):
+        key = chain_key('', 'index', 'x', [])
+        self.assertEqual(self.store.load(key), {})
+
+        cli = nodes.literal_block('qiime foo', 'qiime foo',
+                                  classes=['cli-usage'])
+        self.store.save(key, {'cli': cli, 'exc': None})
+
+        loaded = self.store.load(key)
+        self.assertEqual(set(loaded), {'cli', 'exc'})
+        self.assertEqual(loaded['cli'].astext(), 'qiime foo')
+        self.assertEqual(loaded['cli']['classes'], ['cli-usage'])
+        self.assertIsNone(loaded['exc'])
+
+    def test_merges_drivers(self):
+        key = chain_key('', 'index', 'x', [])
+        self.store.save(key, {'cli': nodes.literal_block('a', 'a')})
+        self.store.save(key, {'galaxy': nodes.compound()})
+        self.assertEqual(set(self.store.load(key)), {'cli', 'galaxy'})
+
+    def test_prune(self):
+        keys = [chain_key('', 'index', example, []) for example in 'abc']
+        for key in keys:
+            self.store.save(key, {'cli': None})
+
+        self.assertEqual(self.store.prune({keys[0]}), 2)
+        self.assertEqual(self.store.load(keys[0]), {'cli': None})
+        self.assertEqual(self.store.load(keys[1]), {})
+        self.assertEqual(self.store.prune({keys[0]}), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
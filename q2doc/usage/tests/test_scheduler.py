@@ -0,0 +1,64 @@
+import collections
+import types
+import unittest
+
+from q2doc.usage.extension import release_scope
+from q2doc.usage.scheduler import group_by_scope, make_scope_chunks
+
+
+class TestMakeScopeChunks(unittest.TestCase):
+    def test_group_by_scope(self):
+        scopes = {'a': 'a', 'b': 'tutorial', 'd': 'tutorial'}
+        obs = group_by_scope(['a', 'b', 'c', 'd'], scopes)
+        self.assertEqual(obs, [['a'], ['b', 'd'], ['c']])
+
+    def test_scopes_are_not_split(self):
+        docnames = ['a', 'b', 'c', 'd', 'e', 'f']
+        scopes = {'b': 'tutorial', 'c': 'tutorial', 'd': 'tutorial'}
+        obs = make_scope_chunks(docnames, 3, scopes=scopes)
+        self.assertEqual(obs, [['a'], ['b', 'c', 'd'], ['e', 'f']])
+
+    def test_no_scopes(self):
+        docnames = ['a', 'b', 'c', 'd']
+        obs = make_scope_chunks(docnames, 2)
+        self.assertEqual(obs, [['a', 'b'], ['c', 'd']])
+
+
+class TestReleaseScope(unittest.TestCase):
+    def _release(self, app, docname):
+        app.env.docname = docname
+        release_scope(app, None)
+
+    def test_uncounted_documents(self):
+        scopes = {'a': 'tutorial', 'c': 'tutorial'}
+        app = types.SimpleNamespace(
+            env=types.SimpleNamespace(docname=None),
+            q2_usage={'scopes': scopes,
+                      'remaining': collections.Counter(scopes.values()),
+                      'contexts': {'tutorial': object()},
+                      'chains': {'tutorial': {}}})
+
+        # `b` only names the scope, without any usage examples
+        self._release(app, 'a')
+        self._release(app, 'b')
+        self.assertIn('tutorial', app.q2_usage['contexts'])
+
+        self._release(app, 'c')
+        self.assertNotIn('tutorial', app.q2_usage['contexts'])
+
+    def test_released_once(self):
+        scopes = {'a': 'tutorial', 'b': 'tutorial'}
+        app = types.SimpleNamespace(
+            env=types.SimpleNamespace(docname=None),
+            q2_usage={'scopes': scopes,
+                      'remaining': collections.Counter(scopes.values()),
+                      'contexts': {'tutorial': object()},
+                      'chains': {'tutorial': {}}})
+
+        self._release(app, 'a')
+        self._release(app, 'a')
+        self.assertIn('tutorial', app.q2_usage['contexts'])
+
+
+if __name__ == '__main__':
+    unittest.main()
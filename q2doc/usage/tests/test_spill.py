@@ -0,0 +1,89 @@
+import gc
+import os
+import pathlib
+import tempfile
+import types
+import unittest
+
+from q2doc.usage.spill import ResultSpill
+
+
+class FakeResult:
+    def __init__(self, data_dir, uuid):
+        self._archiver = types.SimpleNamespace(data_dir=data_dir)
+        self.uuid = uuid
+
+    def save(self, fp):
+        fp += '.qza'
+        with open(fp, 'w') as fh:
+            fh.write(str(self._archiver.data_dir))
+        return fp
+
+    @classmethod
+    def load(cls, fp):
+        with open(fp) as fh:
+            return cls(pathlib.Path(fh.read()), os.path.basename(fp))
+
+
+class FakeVariable:
+    DEFERRED = object()
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.value = self.DEFERRED
+
+    def execute(self, spill):
+        if self.value is self.DEFERRED:
+            self.value = self.factory()
+        spill.touch(self, self.value)
+        return self.value
+
+
+class TestResultSpill(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory(prefix='qiime2-test-temp-')
+        self.root = pathlib.Path(self.test_dir.name)
+        self.spill = ResultSpill(str(self.root / 'spill'), budget=250)
+
+    def tearDown(self):
+        self.test_dir.cleanup()
+
+    def make_variable(self, name, size):
+        data_dir = self.root / name
+        data_dir.mkdir()
+        (data_dir / 'data.bin').write_bytes(b'x' * size)
+        return FakeVariable(lambda: FakeResult(data_dir, name))
+
+    def test_spills_least_recently_used(self):
+        a = self.make_variable('a', 100)
+        b = self.make_variable('b', 100)
+        c = self.make_variable('c', 100)
+        a.execute(self.spill)
+        b.execute(self.spill)
+        a.execute(self.spill)
+        c.execute(self.spill)
+
+        self.assertIs(b.value, FakeVariable.DEFERRED)
+        self.assertIsNot(a.value, FakeVariable.DEFERRED)
+        self.assertEqual(self.spill.size, 200)
+
+        # reloaded lazily from the spilled copy
+        reloaded = b.execute(self.spill)
+        self.assertEqual(reloaded._archiver.data_dir, self.root / 'b')
+        self.assertIs(a.value, FakeVariable.DEFERRED)
+
+    def test_forgets_collected_variables(self):
+        a = self.make_variable('a', 200)
+        b = self.make_variable('b', 100)
+        a.execute(self.spill)
+        b.execute(self.spill)
+        self.assertEqual(len(os.listdir(self.root / 'spill')), 1)
+
+        del a, b
+        gc.collect()
+        self.assertEqual(self.spill.size, 0)
+        self.assertEqual(os.listdir(self.root / 'spill'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
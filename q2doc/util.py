@@ -0,0 +1,215 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import contextlib
+import functools
+import hashlib
+import importlib.metadata
+import os
+import shutil
+import sys
+import threading
+import zipfile
+
+
+CHUNK_SIZE = 1024 * 1024
+# the earliest a zip entry can have
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+
+@functools.lru_cache(maxsize=None)
+def installed_versions():
+    """Versions of QIIME 2, q2cli and every installed plugin distribution."""
+    versions = {}
+    for name in ('qiime2', 'q2cli'):
+        try:
+            versions[name] = importlib.metadata.version(name)
+        except importlib.metadata.PackageNotFoundError:
+            pass
+
+    for dist in importlib.metadata.distributions():
+        if any(ep.group == 'qiime2.plugins' for ep in dist.entry_points):
+            versions[dist.metadata['Name']] = dist.version
+
+    return dict(sorted(versions.items()))
+
+
+def plugin_distribution(plugin_name):
+    """Best guess at the distribution providing a plugin, by id or CLI name.
+
+    Returns None when no installed distribution follows the usual
+    ``q2-<plugin>`` naming convention.
+    """
+    expected = 'q2-' + plugin_name.replace('_', '-').lower()
+    for name in installed_versions():
+        if name.replace('_', '-').lower() == expected:
+            return name
+    return None
+
+
+def doc_state(env, attr, docname=None, default=dict):
+    """The state of a document (the current one by default) kept in the
+    environment's `attr`, a dict keyed by docname, created by calling
+    `default` on first use. See `connect_doc_state`."""
+    if docname is None:
+        docname = env.docname
+    if not hasattr(env, attr):
+        setattr(env, attr, {})
+    docs = getattr(env, attr)
+    if docname not in docs:
+        docs[docname] = default()
+    return docs[docname]
+
+
+def connect_doc_state(app, attr):
+    """Drop the `doc_state` kept in `attr` of the documents which are read
+    again or removed, and merge it back from parallel readers.
+
+    This also records the documents each build reads, see `read_docs`.
+    """
+    def purge(app, env, docname):
+        getattr(env, attr, {}).pop(docname, None)
+
+    def merge(app, env, docnames, other):
+        if not hasattr(other, attr):
+            return
+        if not hasattr(env, attr):
+            setattr(env, attr, {})
+        ours, theirs = getattr(env, attr), getattr(other, attr)
+        ours.update((docname, theirs[docname]) for docname in docnames
+                    if docname in theirs)
+
+    app.connect('env-purge-doc', purge)
+    app.connect('env-merge-info', merge)
+    if not hasattr(app, 'q2doc_read_docs'):
+        app.q2doc_read_docs = []
+        app.connect('env-before-read-docs', _record_read_docs)
+
+
+def _record_read_docs(app, env, docnames):
+    app.q2doc_read_docs[:] = docnames
+
+
+def read_docs(app):
+    """The documents read by the current build, as opposed to those whose
+    state was kept from previous builds."""
+    return list(getattr(app, 'q2doc_read_docs', []))
+
+
+def hash_file(path, hasher=None):
+    hasher = hashlib.sha256() if hasher is None else hasher
+    with open(path, 'rb') as fh:
+        for chunk in iter(functools.partial(fh.read, CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def hash_path(path):
+    """Content hash of a file, or of a directory tree (names and contents)."""
+    if not os.path.isdir(path):
+        return hash_file(path)
+
+    hasher = hashlib.sha256()
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            filepath = os.path.join(dirpath, filename)
+            relpath = os.path.relpath(filepath, path)
+            hasher.update(relpath.encode('utf-8'))
+            hasher.update(hash_file(filepath).encode('ascii'))
+    return hasher.hexdigest()
+
+
+def tree_size(path):
+    size = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            size += os.path.getsize(os.path.join(dirpath, filename))
+    return size
+
+
+def zip_tree(root, fp):
+    """Zip the contents of directory `root` into `fp`, like
+    ``shutil.make_archive(fp, 'zip', root)`` but without changing the
+    working directory (so it is safe to use from threads).
+
+    Entries are sorted and their timestamps fixed, so that the zip only
+    depends on the tree's names, contents and permissions.
+    """
+    with zipfile.ZipFile(fp, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            for name in dirnames + sorted(filenames):
+                path = os.path.join(dirpath, name)
+                # the timestamp is replaced, so it may be out of range
+                info = zipfile.ZipInfo.from_file(
+                    path, os.path.relpath(path, root), strict_timestamps=False)
+                info.date_time = ZIP_DATE_TIME
+                if info.is_dir():
+                    zf.writestr(info, b'')
+                    continue
+                info.compress_type = zipfile.ZIP_DEFLATED
+                with open(path, 'rb') as src, zf.open(info, 'w') as dest:
+                    shutil.copyfileobj(src, dest, CHUNK_SIZE)
+    return fp
+
+
+class _ThreadLocalStream:
+    """Stands in for sys.stdout/sys.stderr, writing to a per-thread target
+    when one is set."""
+    def __init__(self, default):
+        self.default = default
+        self.local = threading.local()
+
+    def _target(self):
+        return getattr(self.local, 'target', None) or self.default
+
+    def write(self, s):
+        return self._target().write(s)
+
+    def flush(self):
+        return self._target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self._target(), name)
+
+
+_capture_lock = threading.Lock()
+_capture_count = 0
+_proxies = None
+
+
+@contextlib.contextmanager
+def capture_output(stdout, stderr):
+    """Like ``redirect_stdout``/``redirect_stderr``, but only affecting the
+    calling thread."""
+    global _capture_count, _proxies
+    with _capture_lock:
+        if _capture_count == 0:
+            _proxies = (_ThreadLocalStream(sys.stdout),
+                        _ThreadLocalStream(sys.stderr))
+            sys.stdout, sys.stderr = _proxies
+        _capture_count += 1
+        proxies = _proxies
+
+    previous = [getattr(proxy.local, 'target', None) for proxy in proxies]
+    for proxy, target in zip(proxies, (stdout, stderr)):
+        proxy.local.target = target
+    try:
+        yield
+    finally:
+        for proxy, target in zip(proxies, previous):
+            proxy.local.target = target
+        with _capture_lock:
+            _capture_count -= 1
+            if _capture_count == 0:
+                if sys.stdout is proxies[0]:
+                    sys.stdout = proxies[0].default
+                if sys.stderr is proxies[1]:
+                    sys.stderr = proxies[1].default
+                _proxies = None